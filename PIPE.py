@@ -1,4 +1,5 @@
 import array
+from collections import deque
 
 # 操作码定义
 RTYPE = 0b000000
@@ -123,37 +124,48 @@ def decode(IR):
     return opcode, rs, rt, rd, shamt, funct, imm, address
 
 
-def i2u(val):
-    if val < 0:  # 负数
-        val = val + (1 << 32)
-    elif val >= (1 << 32):  # 溢出
-        val = val - (1 << 32)
-    return val
-
-
+# 把无符号表示的32位数转换为有符号数
 def u2i(val):
     if val >= (1 << 31):  # 负数
         val = val - (1 << 32)
     return val
 
+
+# 数据内存按页记录写操作，每页64个字
+PAGE_SHIFT = 6
+PAGE_WORDS = 1 << PAGE_SHIFT
+
+
 # 数据内存
 class DMemory:
     # 构造函数
     def __init__(self, size):
-        self.mem = array.array('I', [0] * size)
+        self.mem = array.array('i', [0] * size)
+        self.clearCheckpoints()
 
     def __len__(self):
         return len(self.mem)
 
     def loadData(self, data):
         for i in range(len(data)):
-            self.mem[i] = data[i]
-
-    # 访问内存
-    def access(self, read, write, address, data):
-        if not read and not write:
-            return
-
+            self.mem[i] = u2i(data[i])
+        self.clearCheckpoints()
+
+    # 从当前内容重新开始记录，检查点0就是当前状态
+    def clearCheckpoints(self):
+        # 当前检查点之后写过的页
+        self.dirty = bytearray((len(self.mem) + PAGE_WORDS - 1) >> PAGE_SHIFT)
+        # [(检查点编号, {页号: 该页在检查点之后第一次被写之前的内容})]
+        self.checkpoints = [(0, {})]
+        self.nextCheckpoint = 1
+
+    # 某页在当前检查点之后第一次被写，保存它原来的内容
+    def touch(self, page):
+        self.dirty[page] = 1
+        self.checkpoints[-1][1][page] = self.mem[page << PAGE_SHIFT:(page + 1) << PAGE_SHIFT]
+
+    # 检查地址，返回字的编号
+    def index(self, address):
         if address >= len(self.mem) * 4:
             raise MyError(f"dmem_error: address({address}) out of length of dmem({len(self.mem) * 4})")
 
@@ -161,104 +173,277 @@ class DMemory:
         if addr_mod4 != 0:
             raise MyError(f"dmem_error: address({address}) is not a multiple of four")
 
-        addr_div4 = address // 4
+        return address // 4
+
+    # 访问内存
+    def access(self, read, write, address, data):
+        if not read and not write:
+            return
+
+        addr_div4 = self.index(address)
         if read:
-            return u2i(self.mem[addr_div4])
+            return self.mem[addr_div4]
         if write:
-            self.mem[addr_div4] = i2u(data)
+            if not self.dirty[addr_div4 >> PAGE_SHIFT]:
+                self.touch(addr_div4 >> PAGE_SHIFT)
+            self.mem[addr_div4] = data
             return data
 
+    # 不经过访存直接写一个字，仍然记录脏页
+    def poke(self, index, value):
+        if not self.dirty[index >> PAGE_SHIFT]:
+            self.touch(index >> PAGE_SHIFT)
+        self.mem[index] = value
+
+    # 建立新的检查点，返回检查点编号
+    def checkpoint(self):
+        cp = self.nextCheckpoint
+        self.nextCheckpoint += 1
+        self.checkpoints.append((cp, {}))
+        self.dirty = bytearray(len(self.dirty))
+        return cp
+
+    def _position(self, cp):
+        for i, (number, _) in enumerate(self.checkpoints):
+            if number == cp:
+                return i
+        raise MyError(f"dmem_error: checkpoint({cp}) does not exist")
+
+    # 丢弃cp之前的检查点
+    def release(self, cp):
+        del self.checkpoints[:self._position(cp)]
+
+    # 检查点cp之后改变过的字，返回[(地址, 原来的值, 现在的值)]
+    def changedSince(self, cp):
+        # 每页取cp之后最早的备份，就是该页在cp时的内容
+        old = {}
+        for _, pages in self.checkpoints[self._position(cp):]:
+            for page, words in pages.items():
+                old.setdefault(page, words)
+        changes = []
+        for page in sorted(old):
+            start = page << PAGE_SHIFT
+            for i, val in enumerate(old[page]):
+                if self.mem[start + i] != val:
+                    changes.append(((start + i) * 4, val, self.mem[start + i]))
+        return changes
+
     def emit(self, length):
         if length > len(self.mem):
             length = len(self.mem)
         print("\nDMemory:")
         for i in range(length):
-            print(f"0x{format(i * 4, '08x')}: {u2i(self.mem[i])}")
+            print(f"0x{format(i * 4, '08x')}: {self.mem[i]}")
+        print("")
+
+    # 只输出检查点cp之后改变过的字
+    def emitChanges(self, cp=0):
+        print("\nDMemory changes:")
+        for address, old, new in self.changedSince(cp):
+            print(f"0x{format(address, '08x')}: {old} -> {new}")
         print("")
 
 
+# *****************************
+# 访存阶段的写缓冲
+# sw在访存阶段只把(IR, 地址, 数据)放进缓冲，缓冲在后台按先后顺序写内存，
+# 队首的写操作需要latency(IR, 地址)个周期，每个周期结束时推进一个周期
+# lw先按地址查缓冲，命中最新的同地址写操作时直接转发数据
+# *****************************
+class StoreBuffer:
+    def __init__(self, depth, dmem, latency):
+        if depth < 1:
+            raise MyError(f"store_buffer_error: depth({depth}) must be at least 1")
+        self.depth = depth
+        self.dmem = dmem
+        self.latency = latency
+        self.reset()
+
+    def reset(self):
+        self.entries = deque()
+        # 队首的写操作还要的周期数
+        self.remaining = 0
+        self.stores = 0
+        self.forwardHits = 0
+        self.fullStalls = 0
+        self.drainStalls = 0
+        self.maxOccupancy = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def full(self):
+        return len(self.entries) >= self.depth
+
+    # 地址在进入缓冲时检查，出错的sw和没有写缓冲时一样在访存阶段报错
+    def push(self, IR, address, data):
+        self.dmem.index(address)
+        self.entries.append((IR, address, data))
+        if len(self.entries) == 1:
+            self.remaining = self.latency(IR, address)
+        self.stores += 1
+        if len(self.entries) > self.maxOccupancy:
+            self.maxOccupancy = len(self.entries)
+
+    # 缓冲里最新的同地址数据，没有时返回None
+    def forward(self, address):
+        for _, entryAddress, data in reversed(self.entries):
+            if entryAddress == address:
+                self.forwardHits += 1
+                return data
+        return None
+
+    # 一个周期结束，队首写完时写入内存
+    def tick(self):
+        if not self.entries:
+            return
+        self.remaining -= 1
+        if self.remaining > 0:
+            return
+        _, address, data = self.entries.popleft()
+        self.dmem.access(False, True, address, data)
+        if self.entries:
+            IR, address, _ = self.entries[0]
+            self.remaining = self.latency(IR, address)
+
+    def snapshot(self):
+        return (tuple(self.entries), self.remaining, self.stores, self.forwardHits, self.fullStalls,
+                self.drainStalls, self.maxOccupancy)
+
+    def restore(self, values):
+        entries, self.remaining, self.stores, self.forwardHits, self.fullStalls, \
+            self.drainStalls, self.maxOccupancy = values
+        self.entries = deque(entries)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "stores": self.stores,
+            "forwardHits": self.forwardHits,
+            "fullStalls": self.fullStalls,
+            "drainStalls": self.drainStalls,
+            "maxOccupancy": self.maxOccupancy,
+        }
+
+
 class RegFile:
     # 构造函数
     def __init__(self):
-        self.reg = array.array('I', [0] * 32)
+        self.reg = array.array('i', [0] * 32)
+        # 当前检查点之后写过的寄存器
+        self.writeMask = 0
+        # [(检查点编号, 检查点时的寄存器, 该检查点到下一个检查点之间的写掩码)]
+        self.checkpoints = [[0, self.reg[:], 0]]
+        self.nextCheckpoint = 1
 
     def read(self, srcA, srcB):
         valA = valB = None
         if srcA is not None:
-            valA = u2i(self.reg[srcA])
+            valA = self.reg[srcA]
         if srcB is not None:
-            valB = u2i(self.reg[srcB])
+            valB = self.reg[srcB]
         return valA, valB
 
     def write(self, dstE, valE, dstM, valM):
         if dstE is not None:
-            self.reg[dstE] = i2u(valE)
+            self.reg[dstE] = valE
+            self.writeMask |= 1 << dstE
         if dstM is not None:
-            self.reg[dstM] = i2u(valM)
+            self.reg[dstM] = valM
+            self.writeMask |= 1 << dstM
+
+    # 直接写一个寄存器
+    def poke(self, index, value):
+        self.reg[index] = value
+        self.writeMask |= 1 << index
+
+    # 建立新的检查点，返回检查点编号
+    def checkpoint(self):
+        self.checkpoints[-1][2] = self.writeMask
+        self.writeMask = 0
+        cp = self.nextCheckpoint
+        self.nextCheckpoint += 1
+        self.checkpoints.append([cp, self.reg[:], 0])
+        return cp
+
+    def _position(self, cp):
+        for i, (number, _, _) in enumerate(self.checkpoints):
+            if number == cp:
+                return i
+        raise MyError(f"reg_error: checkpoint({cp}) does not exist")
+
+    # 丢弃cp之前的检查点
+    def release(self, cp):
+        del self.checkpoints[:self._position(cp)]
+
+    # 检查点cp之后改变过的寄存器，返回[(编号, 原来的值, 现在的值)]
+    def changedSince(self, cp):
+        position = self._position(cp)
+        old = self.checkpoints[position][1]
+        mask = self.writeMask
+        for _, _, epochMask in self.checkpoints[position:-1]:
+            mask |= epochMask
+        return [(i, old[i], self.reg[i])
+                for i in range(len(self.reg)) if mask >> i & 1 and old[i] != self.reg[i]]
 
     def emit(self):
         print("\nRegisters:")
         for i in range(len(self.reg)//8):
             i = i*8
-            print(f"R{i}:{u2i(self.reg[i])}\tR{i+1}:{u2i(self.reg[i+1])}\t"
-                  f"R{i+2}:{u2i(self.reg[i+2])}\tR{i+3}:{u2i(self.reg[i+3])}\t"
-                  f"R{i+4}:{u2i(self.reg[i+4])}\tR{i+5}:{u2i(self.reg[i+5])}\t"
-                  f"R{i+6}:{u2i(self.reg[i+6])}\tR{i+7}:{u2i(self.reg[i+7])}")
+            print(f"R{i}:{self.reg[i]}\tR{i+1}:{self.reg[i+1]}\t"
+                  f"R{i+2}:{self.reg[i+2]}\tR{i+3}:{self.reg[i+3]}\t"
+                  f"R{i+4}:{self.reg[i+4]}\tR{i+5}:{self.reg[i+5]}\t"
+                  f"R{i+6}:{self.reg[i+6]}\tR{i+7}:{self.reg[i+7]}")
+        print("")
+
+    # 只输出检查点cp之后改变过的寄存器
+    def emitChanges(self, cp=0):
+        print("\nRegisters changes:")
+        for i, old, new in self.changedSince(cp):
+            print(f"R{i}: {old} -> {new}")
         print("")
 
 
 class ConditionCode:
+    __slots__ = ('ZF', 'SF', 'OF')
+
     def __init__(self):
         self.ZF = False
         self.SF = False
         self.OF = False
 
-    @property
-    def ZF(self):
-        return self._ZF
-
-    @ZF.setter
-    def ZF(self, value):
-        self._ZF = value
-
-    @property
-    def SF(self):
-        return self._SF
-
-    @SF.setter
-    def SF(self, value):
-        self._SF = value
-
-    @property
-    def OF(self):
-        return self._OF
-
-    @OF.setter
-    def OF(self, value):
-        self._OF = value
-
     def set(self, ZF, SF, OF):
         self.ZF = ZF
         self.SF = SF
         self.OF = OF
 
 
-def SelectPC(D_IR, d_valA, d_cnd, d_bAddr, D_NPC, f_IR, f_NPC):
-    D_opcode, _, _, _, _, D_funct, _, _ = decode(D_IR)
+# delaySlot为True时跳转指令后面的一条指令（延迟槽）总是执行：
+# 取到跳转指令时接着取延迟槽，跳转指令在译码阶段时决定延迟槽之后的PC
+def SelectPC(D_IR, d_valA, d_cnd, d_bAddr, D_NPC, f_IR, f_NPC, delaySlot=False):
+    D_opcode, _, _, _, _, D_funct, _, D_address = decode(D_IR)
     if D_opcode == RTYPE and D_funct == FJR:
         return d_valA
     elif D_opcode in [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
+        if delaySlot:
+            return d_bAddr if d_cnd else D_NPC + 4
         return d_bAddr if d_cnd else D_NPC  # d_valA是D_NPC
+    elif delaySlot and D_opcode in [IJ, IJAL]:
+        return D_NPC & 0b11110000000000000000000000000000 | (D_address << 2)
     elif (D_opcode == RTYPE and D_funct in [FADD, FSLL, FSYS]) \
             or D_opcode in [IADDI, ILW, ISW, IJ, IJAL]:
         f_opcode, _, _, _, _, f_funct, _, address = decode(f_IR)
-        if (f_opcode == RTYPE and f_funct == FADD) \
+        if (f_opcode == RTYPE and f_funct in [FADD, FSLL]) \
                 or f_opcode in [IADDI, ILW, ISW]:
             return f_NPC
+        elif delaySlot and (f_opcode == RTYPE and f_funct == FJR
+                            or f_opcode in [IJ, IJAL, IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]):
+            return f_NPC
         elif f_opcode in [IJ, IJAL]:
             return f_NPC & 0b11110000000000000000000000000000 | (address << 2)
         # 当无法预测下一个PC的时候，应该如何选择
-        elif f_opcode == RTYPE and f_funct in [FJR, FSLL, FSYS] \
+        elif f_opcode == RTYPE and f_funct in [FJR, FSYS] \
                 or f_opcode in [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
             return f_NPC - 4
         else:
@@ -268,10 +453,10 @@ def SelectPC(D_IR, d_valA, d_cnd, d_bAddr, D_NPC, f_IR, f_NPC):
 
 
 # 取指过程
-def Fetch(mem, PC, D_IR, d_valA, d_cnd, d_bAddr, D_NPC):
+def Fetch(mem, PC, D_IR, d_valA, d_cnd, d_bAddr, D_NPC, delaySlot=False):
     f_IR = mem.access(PC)
     f_NPC = PC + 4
-    f_PC = SelectPC(D_IR, d_valA, d_cnd, d_bAddr, D_NPC, f_IR, f_NPC)
+    f_PC = SelectPC(D_IR, d_valA, d_cnd, d_bAddr, D_NPC, f_IR, f_NPC, delaySlot)
     return f_IR, f_NPC, f_PC
 
 
@@ -329,45 +514,45 @@ def DstM(opcode, funct, rt, rd):
 def SignExtend(imm):
     if imm is None:
         return None
-    if imm > (1 << 15):
+    if imm >= (1 << 15):
         imm -= (1 << 16)
     return imm
 
 
-def FwdA(valA, d_srcA, e_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE):
+def FwdA(valA, d_srcA, E, e_valE, M, m_valM, W):
     if d_srcA is not None:
         # 从执行阶段进行转发
-        if d_srcA == e_dstE:
+        if d_srcA == E.dstE:
             return e_valE
         # 从访存阶段进行转发
-        if d_srcA == M_dstM:
+        if d_srcA == M.dstM:
             return m_valM
-        if d_srcA == M_dstE:
-            return M_valE
+        if d_srcA == M.dstE:
+            return M.valE
         # 从写回阶段进行转发
-        if d_srcA == W_dstM:
-            return W_valM
-        if d_srcA == W_dstE:
-            return W_valE
+        if d_srcA == W.dstM:
+            return W.valM
+        if d_srcA == W.dstE:
+            return W.valE
     return valA
 
 
 # 转发B
-def FwdB(valB, d_srcB, e_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE):
+def FwdB(valB, d_srcB, E, e_valE, M, m_valM, W):
     if d_srcB is not None:
         # 从执行阶段进行转发
-        if d_srcB == e_dstE:
+        if d_srcB == E.dstE:
             return e_valE
         # 从访存阶段进行转发
-        if d_srcB == M_dstM:
+        if d_srcB == M.dstM:
             return m_valM
-        if d_srcB == M_dstE:
-            return M_valE
+        if d_srcB == M.dstE:
+            return M.valE
         # 从写回阶段进行转发
-        if d_srcB == W_dstM:
-            return W_valM
-        if d_srcB == W_dstE:
-            return W_valE
+        if d_srcB == W.dstM:
+            return W.valM
+        if d_srcB == W.dstE:
+            return W.valE
     return valB
 
 
@@ -420,13 +605,14 @@ def Add(opcode, NPC, sImm):
     return bAddr
 
 
-def SelA(IR, valA, NPC):
+def SelA(IR, valA, NPC, delaySlot=False):
     opcode, _, _, _, _, funct, _, _ = decode(IR)
     if (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
             or opcode in [IADDI, ILW, ISW, IJ, IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
         return valA
     elif opcode == IJAL:
-        return NPC
+        # 有延迟槽时返回地址跳过延迟槽
+        return NPC + 4 if delaySlot else NPC
     # elif (opcode == RTYPE and funct in [FSLL, FSYS]) \
     #         or opcode in [IJ, IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
     #     return None
@@ -434,7 +620,8 @@ def SelA(IR, valA, NPC):
         raise MyError("invalid operation in Decode")
 
 
-def Decode(IR, regFile, NPC, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE):
+def Decode(D, regFile, E, e_valE, M, m_valM, W, delaySlot=False):
+    IR, NPC = D.IR, D.NPC
     opcode, rs, rt, rd, _, funct, imm, _ = decode(IR)
     # 寄存器控制
     d_srcA = SrcA(opcode, funct, rs)
@@ -446,8 +633,8 @@ def Decode(IR, regFile, NPC, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_d
     # 有符号扩展
     sImm = SignExtend(imm)
     # 转发A和B
-    valA = FwdA(valA, d_srcA, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE)
-    d_valB = FwdB(valB, d_srcB, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE)
+    valA = FwdA(valA, d_srcA, E, e_valE, M, m_valM, W)
+    d_valB = FwdB(valB, d_srcB, E, e_valE, M, m_valM, W)
     # 对转发后的valA和valB进行比较
     ZF, SF, OF = Comp(opcode, funct, valA, d_valB)
     # 判断是否跳转
@@ -455,7 +642,7 @@ def Decode(IR, regFile, NPC, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_d
     # 计算分支跳转地址
     bAddr = Add(opcode, NPC, sImm)
     # 选择A
-    d_valA = SelA(IR, valA, NPC)
+    d_valA = SelA(IR, valA, NPC, delaySlot)
     return d_valA, d_valB, sImm, cnd, bAddr, d_srcA, d_srcB, d_dstE, d_dstM
 
 
@@ -498,12 +685,19 @@ def ALU_fun(opcode, funct):
         raise MyError("invalid operation in Execute")
 
 
-# 定义算数逻辑单元，计算结果为补码（其表示为无符号数）
+# 把运算结果截断为32位有符号数
+def wrap(val):
+    if val > 0x7fffffff or val < -0x80000000:
+        val = ((val + 0x80000000) & 0xffffffff) - 0x80000000
+    return val
+
+
+# 定义算数逻辑单元，计算结果为32位有符号数，寄存器和内存中直接保存有符号数
 def ALU(aluA, aluB, aluFun):
     if aluFun == ALUADD:
-        return aluA + aluB
+        return wrap(aluA + aluB)
     elif aluFun == ALUSUB:
-        return aluA - aluB
+        return wrap(aluA - aluB)
     elif aluFun == ALUNOP:
         return None
 
@@ -586,11 +780,14 @@ def WriteBack(regFile, valE, valM, dstE, dstM):
 # *****************************
 # 流水线控制逻辑
 # *****************************
-def FetchControl(E_IR, E_dstM, d_srcA, d_srcB):
+def FetchControl(E_IR, E_dstM, d_srcA, d_srcB, M_wait):
     F_stall = False
     E_opcode, _, _, _, _, E_funct, _, _ = decode(E_IR)
     if E_opcode == ILW and E_dstM in [d_srcA, d_srcB]:
         F_stall = True
+    # 访存没有完成
+    if M_wait:
+        F_stall = True
 
     F_bubble = False
 
@@ -600,16 +797,17 @@ def FetchControl(E_IR, E_dstM, d_srcA, d_srcB):
     return F_stall, F_bubble
 
 
-def DecodeControl(D_IR, E_IR, E_dstM, d_srcA, d_srcB):
+def DecodeControl(D_IR, E_IR, E_dstM, d_srcA, d_srcB, M_wait, delaySlot=False):
     D_stall = False
     E_opcode, _, _, _, _, _, _, _ = decode(E_IR)
-    if E_opcode == ILW and E_dstM in [d_srcA, d_srcB]:
+    if (E_opcode == ILW and E_dstM in [d_srcA, d_srcB]) or M_wait:
         D_stall = True
 
     D_bubble = False
     D_opcode, _, _, _, _, D_funct, _, _ = decode(D_IR)
+    # 有延迟槽时取指阶段已经取到了延迟槽，不需要插入气泡
     if ((D_opcode == RTYPE and D_funct == FJR) or D_opcode in [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]) \
-            and not (E_opcode == ILW and E_dstM in [d_srcA, d_srcB]):
+            and not D_stall and not delaySlot:
         D_bubble = True
 
     if D_stall and D_bubble:
@@ -618,12 +816,15 @@ def DecodeControl(D_IR, E_IR, E_dstM, d_srcA, d_srcB):
     return D_stall, D_bubble
 
 
-def ExcuteControl(E_IR, E_dstM, d_srcA, d_srcB):
+def ExcuteControl(E_IR, E_dstM, d_srcA, d_srcB, M_wait):
     E_stall = False
+    # 访存没有完成时执行阶段的指令不能前进
+    if M_wait:
+        E_stall = True
 
     E_bubble = False
     E_opcode, _, _, _, _, E_funct, _, _ = decode(E_IR)
-    if E_opcode == ILW and E_dstM in [d_srcA, d_srcB]:
+    if E_opcode == ILW and E_dstM in [d_srcA, d_srcB] and not E_stall:
         E_bubble = True
 
     if E_stall and E_bubble:
@@ -632,30 +833,31 @@ def ExcuteControl(E_IR, E_dstM, d_srcA, d_srcB):
     return E_stall, E_bubble
 
 
-def AccessMemoryControl(M_IR, W_IR):
+# M_wait：访存阶段的lw/sw还需要更多周期才能完成
+# syscall不在访存阶段停顿，它要前进到写回阶段使处理器停机
+def AccessMemoryControl(M_IR, W_IR, M_wait):
     M_stall = False
+    if M_wait:
+        M_stall = True
 
     M_bubble = False
-    M_opcode, _, _, _, _, M_funct, _, _ = decode(M_IR)
-    if M_opcode == RTYPE and M_funct == FSYS:
-        M_stall = True
-    W_opcode, _, _, _, _, W_funct, _, _ = decode(W_IR)
-    if W_opcode == RTYPE and W_funct == FSYS:
-        M_stall = True
 
     if M_stall and M_bubble:
         raise MyError("Control Condition Error in AccessMemoryControl")
 
-    return False, False
+    return M_stall, M_bubble
 
 
-def WriteBackControl(W_IR):
+def WriteBackControl(W_IR, M_wait):
     W_stall = False
     W_opcode, _, _, _, _, W_funct, _, _ = decode(W_IR)
     if W_opcode == RTYPE and W_funct == FSYS:
         W_stall = True
 
+    # 访存没有完成时写回阶段插入气泡
     W_bubble = False
+    if M_wait and not W_stall:
+        W_bubble = True
 
     if W_stall and W_bubble:
         raise MyError("Control Condition Error in WriteBackControl")
@@ -663,128 +865,417 @@ def WriteBackControl(W_IR):
     return W_stall, W_bubble
 
 
+# *****************************
+# 流水线寄存器
+# 每个流水线寄存器的字段固定，用__slots__保存，整个流水线的状态可以用一个元组表示
+# *****************************
+class PipelineRegister:
+    __slots__ = ()
+
+    # 插入气泡：IR为nop，其余字段为None
+    def bubble(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.IR = 0
+
+    def snapshot(self):
+        return tuple([getattr(self, name) for name in self.__slots__])
+
+    def restore(self, values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def asdict(self):
+        return dict(zip(self.__slots__, self.snapshot()))
+
+
+class FetchRegister(PipelineRegister):
+    __slots__ = ('PC',)
+
+    def __init__(self, PC=None):
+        self.PC = PC
+
+    def bubble(self):
+        self.PC = None
+
+    def advance(self, PC):
+        self.PC = PC
+
+
+class DecodeRegister(PipelineRegister):
+    __slots__ = ('IR', 'PC', 'NPC')
+
+    def __init__(self):
+        self.bubble()
+
+    def advance(self, IR, PC, NPC):
+        self.IR = IR
+        self.PC = PC
+        self.NPC = NPC
+
+
+class ExecuteRegister(PipelineRegister):
+    __slots__ = ('IR', 'PC', 'valA', 'valB', 'sImm', 'dstE', 'dstM')
+
+    def __init__(self):
+        self.bubble()
+
+    def advance(self, IR, PC, valA, valB, sImm, dstE, dstM):
+        self.IR = IR
+        self.PC = PC
+        self.valA = valA
+        self.valB = valB
+        self.sImm = sImm
+        self.dstE = dstE
+        self.dstM = dstM
+
+
+class MemoryRegister(PipelineRegister):
+    __slots__ = ('IR', 'PC', 'valE', 'valB', 'dstE', 'dstM')
+
+    def __init__(self):
+        self.bubble()
+
+    def advance(self, IR, PC, valE, valB, dstE, dstM):
+        self.IR = IR
+        self.PC = PC
+        self.valE = valE
+        self.valB = valB
+        self.dstE = dstE
+        self.dstM = dstM
+
+
+class WriteBackRegister(PipelineRegister):
+    __slots__ = ('IR', 'PC', 'valE', 'valM', 'dstE', 'dstM')
+
+    def __init__(self):
+        self.bubble()
+
+    def advance(self, IR, PC, valE, valM, dstE, dstM):
+        self.IR = IR
+        self.PC = PC
+        self.valE = valE
+        self.valM = valM
+        self.dstE = dstE
+        self.dstM = dstM
+
+
 # 打印流水线寄存器的值
-def printPipelineRegisters(clock,W_PC, W_valE, W_valM, W_dstE, W_dstM,
-                           M_PC, M_valE, M_valB, M_dstE, M_dstM,
-                           E_PC, E_valA, E_valB, E_sImm, E_dstE, E_dstM,
-                           D_PC, D_NPC, F_PC):
+def printPipelineRegisters(clock, W, M, E, D, F):
     print("=" * 60)
     print(f"clock:{clock}")
-    # IR:{format(W_IR, '032b')}\t
-    # IR:{format(M_IR, '032b')}\t
-    # IR:{format(E_IR, '032b')}\t
-    # IR:{format(D_IR, '032b')}\t
-    print(f"W:[PC:{W_PC}\tW_dstE:{W_dstE}\tW_dstM:{W_dstM}\tW_valE:{W_valE}\tW_valM:{W_valM}]")
-    print(f"M:[PC:{M_PC}\tM_dstE:{M_dstE}\tM_dstM:{M_dstM}\tM_valE:{M_valE}\tM_valB:{M_valB}]")
-    print(f"E:[PC:{E_PC}\tE_dstE:{E_dstE}\tE_dstM:{E_dstM}\tE_valA:{E_valA}\tE_valB:{E_valB}\tE_sImm:{E_sImm}]")
-    print(f"D:[PC:{D_PC}\tD_NPC:{D_NPC}]")
-    print(f"F:[PC:{F_PC}]")
+    # IR:{format(W.IR, '032b')}\t
+    # IR:{format(M.IR, '032b')}\t
+    # IR:{format(E.IR, '032b')}\t
+    # IR:{format(D.IR, '032b')}\t
+    print(f"W:[PC:{W.PC}\tW_dstE:{W.dstE}\tW_dstM:{W.dstM}\tW_valE:{W.valE}\tW_valM:{W.valM}]")
+    print(f"M:[PC:{M.PC}\tM_dstE:{M.dstE}\tM_dstM:{M.dstM}\tM_valE:{M.valE}\tM_valB:{M.valB}]")
+    print(f"E:[PC:{E.PC}\tE_dstE:{E.dstE}\tE_dstM:{E.dstM}\tE_valA:{E.valA}\tE_valB:{E.valB}\tE_sImm:{E.sImm}]")
+    print(f"D:[PC:{D.PC}\tD_NPC:{D.NPC}]")
+    print(f"F:[PC:{F.PC}]")
 
 
 # *****************************
 # 定义处理器运行过程
 # *****************************
-def run(PC, imem, dmem, regFile):
-    clock = 0
-    # 流水线寄存器
-    W_IR = 0
-    W_PC = W_valE = W_valM = W_dstE = W_dstM = None
-    M_IR = 0
-    M_PC = M_valE = M_valB = M_dstE = M_dstM = None
-    E_IR = 0
-    E_PC = E_valA = E_valB = E_sImm = E_dstE = E_dstM = None
-    D_IR = 0
-    D_PC = D_NPC = None
-    F_PC = PC
-    clock = clock + 1
-    printPipelineRegisters(clock, W_PC, W_valE, W_valM, W_dstE, W_dstM,
-                           M_PC, M_valE, M_valB, M_dstE, M_dstM,
-                           E_PC, E_valA, E_valB, E_sImm, E_dstE, E_dstM,
-                           D_PC, D_NPC, F_PC)
-    # try:
-    while W_IR != FSYS and clock < 10000:
+class Simulator:
+    # 构造函数，可以传入已有的内存和寄存器堆
+    # loadLatency/storeLatency：lw/sw在访存阶段停留的周期数
+    # delaySlot：跳转指令后面的一条指令总是执行
+    # storeBufferDepth：写缓冲的项数，0表示sw在访存阶段直接写内存
+    # syscalls：syscall的服务（syscalls.SyscallHandler），为None时syscall只用于停机
+    def __init__(self, imem=None, dmem=None, regFile=None, trace=False, loadLatency=1, storeLatency=1,
+                 delaySlot=False, storeBufferDepth=0, syscalls=None):
+        self.imem = IMemory(256) if imem is None else imem
+        self.dmem = DMemory(1024) if dmem is None else dmem
+        self.regFile = RegFile() if regFile is None else regFile
+        self.CC = ConditionCode()
+        self.trace = trace
+        self.loadLatency = loadLatency
+        self.storeLatency = storeLatency
+        self.delaySlot = delaySlot
+        self.storeBufferDepth = storeBufferDepth
+        self.storeBuffer = StoreBuffer(storeBufferDepth, self.dmem, self.memoryLatency) if storeBufferDepth else None
+        self.syscalls = syscalls
+        # 每条指令在写回阶段完成时调用retireHook(PC, IR)
+        self.retireHook = None
+        # 不为None时记录每条进入译码阶段的指令的PC
+        self.fetchLog = None
+        # 不为None时每个周期调用activity.record统计各部件的活动，见energy.py
+        self.activity = None
+        # 流水线寄存器
+        self.W = WriteBackRegister()
+        self.M = MemoryRegister()
+        self.E = ExecuteRegister()
+        self.D = DecodeRegister()
+        self.F = FetchRegister()
+        self.reset()
+
+    # 清空流水线寄存器，从PC开始取指
+    def reset(self, PC=0):
+        self.clock = 1
+        self.retired = 0
+        # 访存阶段的指令还要停留的周期数（包括当前周期），0表示下一条指令刚进入访存阶段
+        self.memoryWait = 0
+        self.memoryValue = None
+        self.memoryStalls = 0
+        if self.storeBuffer is not None:
+            self.storeBuffer.reset()
+        # 译码阶段的syscall还要停留的周期数（包括当前周期），0表示还没有服务
+        self.syscallWait = 0
+        # 结束程序的syscall离开译码阶段之后不再让后面的指令前进
+        self.syscallExited = False
+        self.syscallStalls = 0
+        if self.syscalls is not None:
+            self.syscalls.reset()
+        self.W.bubble()
+        self.M.bubble()
+        self.E.bubble()
+        self.D.bubble()
+        self.F.advance(PC)
+        if self.trace:
+            self.printPipelineRegisters()
+
+    # 加载指令和数据
+    def load(self, program, data=None, PC=0):
+        self.imem.loadProgram(program)
+        if data is not None:
+            self.dmem.loadData(data)
+        self.reset(PC)
+
+    @property
+    def halted(self):
+        return self.W.IR == FSYS
+
+    # 同时给寄存器堆和数据内存建立检查点，返回(寄存器检查点, 内存检查点)
+    def checkpoint(self):
+        return self.regFile.checkpoint(), self.dmem.checkpoint()
+
+    # 输出检查点之后改变过的寄存器和内存，默认是程序开始以来
+    def emitChanges(self, cp=(0, 0)):
+        self.dmem.emitChanges(cp[1])
+        self.regFile.emitChanges(cp[0])
+
+    # 除寄存器堆和内存以外的全部状态
+    def saveState(self):
+        storeBuffer = self.storeBuffer.snapshot() if self.storeBuffer is not None else None
+        syscall = (self.syscallWait, self.syscallExited, self.syscallStalls)
+        return (self.clock, self.retired, self.memoryWait, self.memoryValue, self.memoryStalls, storeBuffer,
+                syscall, self.snapshot())
+
+    def restoreState(self, state):
+        self.clock, self.retired, self.memoryWait, self.memoryValue, self.memoryStalls, storeBuffer, \
+            syscall, snapshot = state
+        self.syscallWait, self.syscallExited, self.syscallStalls = syscall
+        if storeBuffer is not None:
+            self.storeBuffer.restore(storeBuffer)
+        self.restore(snapshot)
+
+    # 访存阶段的指令需要的周期数
+    def memoryLatency(self, IR, address):
+        opcode = IR >> 26
+        if opcode == ILW:
+            return self.loadLatency
+        if opcode == ISW:
+            return self.storeLatency
+        return 1
+
+    # *****************************
+    # 使用写缓冲时的访存
+    # sw放进缓冲后只在访存阶段停留一个周期，缓冲满时等待；lw命中缓冲时一个周期得到数据；
+    # syscall等缓冲写完才离开访存阶段，程序结束时内存是完整的
+    # 返回这个周期是否要继续等待，等待时memoryWait保持为0，下个周期重新尝试
+    # *****************************
+    def bufferedAccess(self, M):
+        buffer = self.storeBuffer
+        opcode = M.IR >> 26
+        if opcode == ISW:
+            if buffer.full:
+                buffer.fullStalls += 1
+                return True
+            buffer.push(M.IR, M.valE, M.valB)
+            self.memoryValue = M.valB
+            self.memoryWait = 1
+            return False
+        if opcode == ILW:
+            value = buffer.forward(M.valE)
+            if value is not None:
+                self.memoryValue = value
+                self.memoryWait = 1
+                return False
+        elif M.IR == FSYS and buffer.entries:
+            buffer.drainStalls += 1
+            return True
+        self.memoryValue = AccessMemory(M.IR, self.dmem, M.valE, M.valB)
+        self.memoryWait = self.memoryLatency(M.IR, M.valE)
+        return False
+
+    # 整个流水线的状态，可以直接比较、哈希或者保存
+    def snapshot(self):
+        return (self.W.snapshot(), self.M.snapshot(), self.E.snapshot(),
+                self.D.snapshot(), self.F.snapshot())
+
+    def restore(self, snapshot):
+        W, M, E, D, F = snapshot
+        self.W.restore(W)
+        self.M.restore(M)
+        self.E.restore(E)
+        self.D.restore(D)
+        self.F.restore(F)
+
+    def printPipelineRegisters(self):
+        printPipelineRegisters(self.clock, self.W, self.M, self.E, self.D, self.F)
+
+    # 一个时钟周期
+    def tick(self):
+        W, M, E, D, F = self.W, self.M, self.E, self.D, self.F
         # ============================================================
         # 时钟低电平
-        WriteBack(regFile, W_valE, W_valM, W_dstE, W_dstM)
-        m_valM = AccessMemory(M_IR, dmem, M_valE, M_valB)
-        e_valE = Execute(E_IR, E_valA, E_valB, E_sImm)
+        WriteBack(self.regFile, W.valE, W.valM, W.dstE, W.dstM)
+        if self.retireHook is not None and W.PC is not None:
+            self.retireHook(W.PC, W.IR)
+        # 指令刚进入访存阶段时访问内存，之后的周期保持读出的值
+        M_accessed = self.memoryWait == 0
+        M_blocked = False
+        if M_accessed:
+            if self.storeBuffer is None:
+                self.memoryValue = AccessMemory(M.IR, self.dmem, M.valE, M.valB)
+                self.memoryWait = self.memoryLatency(M.IR, M.valE)
+            else:
+                M_blocked = self.bufferedAccess(M)
+        m_valM = self.memoryValue
+        # syscall的服务：之前的指令全部完成、写缓冲写完之后在译码阶段进行，
+        # 服务需要的周期数由服务决定，这段时间后面的指令不能前进
+        D_syscall = self.syscalls is not None and D.IR == FSYS and D.PC is not None
+        if D_syscall and self.syscallWait == 0 and E.PC is None and M.PC is None \
+                and (self.storeBuffer is None or not self.storeBuffer.entries):
+            self.syscallWait = self.syscalls.service(self)
+        e_valE = Execute(E.IR, E.valA, E.valB, E.sImm)
         d_valA, d_valB, d_sImm, d_cnd, d_bAddr, d_srcA, d_srcB, d_dstE, d_dstM = \
-            Decode(D_IR, regFile, D_NPC, E_dstE, e_valE, M_dstM, m_valM, M_dstE, M_valE, W_dstM, W_valM, W_dstE, W_valE)
-        f_IR, f_NPC, f_PC = Fetch(imem, F_PC, D_IR, d_valA, d_cnd, d_bAddr, D_NPC)
+            Decode(D, self.regFile, E, e_valE, M, m_valM, W, self.delaySlot)
+        f_IR, f_NPC, f_PC = Fetch(self.imem, F.PC, D.IR, d_valA, d_cnd, d_bAddr, D.NPC, self.delaySlot)
         # ============================================================
         # 时钟高电平
         # 确定控制信号
-        W_stall, W_bubble = WriteBackControl(W_IR)
-        M_stall, M_bubble = AccessMemoryControl(M_IR, W_IR)
-        E_stall, E_bubble = ExcuteControl(E_IR, E_dstM, d_srcA, d_srcB)
-        D_stall, D_bubble = DecodeControl(D_IR, E_IR, E_dstM, d_srcA, d_srcB)
-        F_stall, F_bubble = FetchControl(E_IR, E_dstM, d_srcA, d_srcB)
+        M_wait = M_blocked or self.memoryWait > 1
+        if not M_blocked:
+            self.memoryWait -= 1
+        if M_wait:
+            self.memoryStalls += 1
+        W_stall, W_bubble = WriteBackControl(W.IR, M_wait)
+        M_stall, M_bubble = AccessMemoryControl(M.IR, W.IR, M_wait)
+        E_stall, E_bubble = ExcuteControl(E.IR, E.dstM, d_srcA, d_srcB, M_wait)
+        D_stall, D_bubble = DecodeControl(D.IR, E.IR, E.dstM, d_srcA, d_srcB, M_wait, self.delaySlot)
+        F_stall, F_bubble = FetchControl(E.IR, E.dstM, d_srcA, d_srcB, M_wait)
+        # 服务完成的syscall以nop继续流动，取指转到syscall的下一条指令（取指阶段一直在重复取syscall）；
+        # 结束程序的syscall保持原样，到写回阶段时停机
+        d_IR = D.IR
+        if D_syscall or self.syscallExited:
+            if self.syscallExited or self.syscallWait != 1:
+                D_stall = F_stall = True
+                D_bubble = False
+                E_bubble = not E_stall
+                self.syscallStalls += 1
+                if self.syscallWait > 1:
+                    self.syscallWait -= 1
+            else:
+                self.syscallWait = 0
+                if self.syscalls.exitCode is not None:
+                    self.syscallExited = True
+                else:
+                    d_IR = 0
+                    D_stall = F_stall = F_bubble = False
+                    D_bubble = True
+                    f_PC = D.NPC
+        if self.activity is not None:
+            self.activity.record(W, M, E, D, F, d_srcA, d_srcB, M_accessed and not M_blocked, M_wait,
+                                 D_stall, D_bubble, E_bubble, F_stall)
         # 更新写回寄存器
         if W_bubble:
-            W_IR = 0
-            W_PC = W_valE = W_valM = W_dstE = W_dstM = None
+            W.bubble()
         elif not W_stall:
-            W_IR = M_IR
-            W_PC = M_PC
-            W_valE = M_valE
-            W_valM = m_valM
-            W_dstE = M_dstE
-            W_dstM = M_dstM
+            W.advance(M.IR, M.PC, M.valE, m_valM, M.dstE, M.dstM)
+            if W.PC is not None:
+                self.retired += 1
         # 更新访存寄存器
         if M_bubble:
-            M_IR = 0
-            M_PC = M_valE = M_valB = M_dstE = M_dstM = None
+            M.bubble()
         elif not M_stall:
-            M_IR = E_IR
-            M_PC = E_PC
-            M_valE = e_valE
-            M_valB = E_valB
-            M_dstE = E_dstE
-            M_dstM = E_dstM
+            M.advance(E.IR, E.PC, e_valE, E.valB, E.dstE, E.dstM)
         # 更新执行寄存器
         if E_bubble:
-            E_IR = 0
-            E_PC = E_valA = E_valB = E_sImm = E_dstE = E_dstM = None
+            E.bubble()
         elif not E_stall:
-            E_IR = D_IR
-            E_PC = D_PC
-            E_valA = d_valA
-            E_valB = d_valB
-            E_sImm = d_sImm
-            E_dstE = d_dstE
-            E_dstM = d_dstM
+            E.advance(d_IR, D.PC, d_valA, d_valB, d_sImm, d_dstE, d_dstM)
         # 更新译码寄存器
         if D_bubble:
-            D_IR = 0
-            D_PC = D_NPC = None
+            D.bubble()
         elif not D_stall:
-            D_IR = f_IR
-            D_PC = F_PC
-            D_NPC = f_NPC
+            D.advance(f_IR, F.PC, f_NPC)
+            if self.fetchLog is not None:
+                self.fetchLog.append(F.PC)
         # 更新取指寄存器
         if F_bubble:
-            F_PC = None
+            F.bubble()
         elif not F_stall:
-            F_PC = f_PC
-        clock = clock + 1
-        printPipelineRegisters(clock, W_PC, W_valE, W_valM, W_dstE, W_dstM,
-                               M_PC, M_valE, M_valB, M_dstE, M_dstM,
-                               E_PC, E_valA, E_valB, E_sImm, E_dstE, E_dstM,
-                               D_PC, D_NPC, F_PC)
-    print(f"\nTotal Clock:{clock}")
-    # except Exception as e:
-    #     print(f"F_PC:{F_PC}")
-    #     print(e)
-    #     dmem.emit()
-    #     regFile.emit()
-
-
-# 初始化寄存器和内存
-PC = 0
-CC = ConditionCode()
-regFile = RegFile()
-imem = IMemory(256)
-dmem = DMemory(1024)
+            F.advance(f_PC)
+        # 写缓冲在后台写内存
+        if self.storeBuffer is not None:
+            self.storeBuffer.tick()
+        self.clock = self.clock + 1
+        if self.trace:
+            self.printPipelineRegisters()
+
+    # 运行n个时钟周期，遇到syscall提前停止
+    def step(self, n=1):
+        for _ in range(n):
+            if self.halted:
+                break
+            self.tick()
+        return self.clock
+
+    # 运行到syscall写回或者达到最大时钟数
+    def run(self, max_cycles=10000):
+        while not self.halted and self.clock < max_cycles:
+            self.tick()
+        return self.stats()
+
+    def stats(self):
+        stats = {
+            "core": "PIPE",
+            "cycles": self.clock,
+            "instructions": self.retired,
+            "CPI": self.clock / self.retired if self.retired else None,
+            "memoryStalls": self.memoryStalls,
+            "halted": self.halted,
+        }
+        if self.storeBuffer is not None:
+            stats["storeBuffer"] = self.storeBuffer.stats()
+        if self.syscalls is not None:
+            stats["syscalls"] = dict(self.syscalls.stats(), stalls=self.syscallStalls)
+        return stats
+
+    def state(self):
+        return {
+            "core": "PIPE",
+            "clock": self.clock,
+            "halted": self.halted,
+            "PC": self.F.PC,
+            "registers": list(self.regFile.reg),
+            "pipeline": {"W": self.W.asdict(), "M": self.M.asdict(), "E": self.E.asdict(),
+                         "D": self.D.asdict(), "F": self.F.asdict()},
+            "storeBuffer": [(address, data) for _, address, data in self.storeBuffer.entries]
+            if self.storeBuffer is not None else [],
+        }
+
+
+def run(PC, imem, dmem, regFile):
+    sim = Simulator(imem, dmem, regFile)
+    sim.trace = True
+    sim.reset(PC)
+    sim.run()
+    print(f"\nTotal Clock:{sim.clock}")
+
 
 # 加载指令和数据
 program_test = [
@@ -873,13 +1364,21 @@ program_unrolling10 = [
     0b00110000100000111111111111100000,  # bge $4, $3, -128
     0b00000000000000000000000000001100,  # syscall
 ]
-imem.loadProgram(program_unrolling10)
-# data = [3, 3, 4, 90]
-# dmem.loadData(data)
 
-# 运行程序
-run(PC, imem, dmem, regFile)
+if __name__ == "__main__":
+    # 初始化寄存器和内存
+    PC = 0
+    regFile = RegFile()
+    imem = IMemory(256)
+    dmem = DMemory(1024)
+
+    imem.loadProgram(program_unrolling10)
+    # data = [3, 3, 4, 90]
+    # dmem.loadData(data)
+
+    # 运行程序
+    run(PC, imem, dmem, regFile)
 
-# 输出内存和寄存器
-dmem.emit(32)
-regFile.emit()
+    # 输出内存和寄存器
+    dmem.emit(32)
+    regFile.emit()
@@ -41,18 +41,25 @@ class IMemory:
         return opcode, rs, rt, rd, shamt, funct, imm, target_address
 
 
+# 把无符号表示的32位数转换为有符号数
+def u2i(val):
+    if val >= (1 << 31):  # 负数
+        val = val - (1 << 32)
+    return val
+
+
 # 数据内存
 class DMemory:
     # 构造函数
     def __init__(self, size):
-        self.mem = array.array('I', [0] * size)
+        self.mem = array.array('i', [0] * size)
 
     def __len__(self):
         return len(self.mem)
 
     def loadData(self, data):
         for i in range(len(data)):
-            self.mem[i] = data[i]
+            self.mem[i] = u2i(data[i])
 
     # 访问内存
     def access(self, read, write, address, data):
@@ -73,6 +80,10 @@ class DMemory:
             self.mem[addr_div4] = data
             return data
 
+    # 不经过访存直接写一个字
+    def poke(self, index, value):
+        self.mem[index] = value
+
     def emit(self):
         print("\nDMemory:")
         for i in range(len(self.mem)):
@@ -83,7 +94,7 @@ class DMemory:
 class RegFile:
     # 构造函数
     def __init__(self):
-        self.reg = array.array('I', [0] * 32)
+        self.reg = array.array('i', [0] * 32)
 
     def read(self, srcA, srcB):
         valA = valB = None
@@ -99,6 +110,10 @@ class RegFile:
         if dstM != 0:
             self.reg[dstM] = valM
 
+    # 直接写一个寄存器
+    def poke(self, index, value):
+        self.reg[index] = value
+
     def emit(self):
         print("\nRegisters:")
         for i, value in enumerate(self.reg):
@@ -107,35 +122,13 @@ class RegFile:
 
 
 class ConditionCode:
+    __slots__ = ('ZF', 'SF', 'OF')
+
     def __init__(self):
         self.ZF = False
         self.SF = False
         self.OF = False
 
-    @property
-    def ZF(self):
-        return self._ZF
-
-    @ZF.setter
-    def ZF(self, value):
-        self._ZF = value
-
-    @property
-    def SF(self):
-        return self._SF
-
-    @SF.setter
-    def SF(self, value):
-        self._SF = value
-
-    @property
-    def OF(self):
-        return self._OF
-
-    @OF.setter
-    def OF(self, value):
-        self._OF = value
-
     def set(self, ZF, SF, OF):
         self.ZF = ZF
         self.SF = SF
@@ -148,18 +141,27 @@ IADDI = 0b001000
 ILW   = 0b100011
 ISW   = 0b101011
 IBNE  = 0b000101
+IBEQ  = 0b000100
+IBGT  = 0b001101  # 以下四个均不是MIPS中的编码规则
+IBGE  = 0b001100  #
+IBLT  = 0b000111  #
+IBLE  = 0b000110  #
 IJ    = 0b000010
 IJAL  = 0b000011
 
 # 函数码定义
 FADD  = 0b100000
 FJR   = 0b001000
+FSLL  = 0b000000  # nop = sll $0,$0,0
+FSYS  = 0b001100
 
 # 定义ALU的运算
 ALUNOP = 0
 ALUADD = 1
 ALUSUB = 2
 
+BRANCH = [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]
+
 
 # *****************************
 # 取指过程
@@ -174,9 +176,10 @@ def Fetch(mem, PC):
 # *****************************
 def SrcA(opcode, funct, rs):
     if (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [ILW, ISW, IADDI, IBNE]:
+    or opcode in [ILW, ISW, IADDI] + BRANCH:
         return rs
-    elif opcode in [IJ, IJAL]:
+    elif (opcode == RTYPE and funct in [FSLL, FSYS]) \
+    or opcode in [IJ, IJAL]:
         return None
     else:
         raise MyError("invalid operation in Decode")
@@ -184,9 +187,9 @@ def SrcA(opcode, funct, rs):
 
 def SrcB(opcode, funct, rt):
     if (opcode == RTYPE and funct == FADD) \
-    or opcode in [ISW, IBNE]:
+    or opcode in [ISW] + BRANCH:
         return rt
-    elif (opcode == RTYPE and funct == FJR) \
+    elif (opcode == RTYPE and funct in [FJR, FSLL, FSYS]) \
     or opcode in [IADDI, ILW, IJ, IJAL]:
         return None
     else:
@@ -196,22 +199,28 @@ def SrcB(opcode, funct, rt):
 def Decode(opcode, funct, regFile, rs, rt):
     # 寄存器控制
     srcA = SrcA(opcode, funct, rs)
-    srcB = SrcA(opcode, funct, rt)
+    srcB = SrcB(opcode, funct, rt)
     # 寄存器读
     valA, valB = regFile.read(srcA, srcB)
     return valA, valB
 
 
+def SignExtend(imm):
+    if imm >= (1 << 15):
+        imm -= (1 << 16)
+    return imm
+
+
 # *****************************
 # 执行阶段
 # *****************************
 def ALU_A(opcode, funct, valA, valP):
     if (opcode == RTYPE and funct == FADD) \
-    or opcode in [IADDI, ILW, ISW, IBNE]:
+    or opcode in [IADDI, ILW, ISW] + BRANCH:
         return valA
     elif opcode == IJAL:
         return valP
-    elif (opcode == RTYPE and funct == FJR) \
+    elif (opcode == RTYPE and funct in [FJR, FSLL, FSYS]) \
     or opcode == IJ:
         return None
     else:
@@ -220,13 +229,13 @@ def ALU_A(opcode, funct, valA, valP):
 
 def ALU_B(opcode, funct, valB, imm):
     if (opcode == RTYPE and funct == FADD) \
-    or opcode == IBNE:
+    or opcode in BRANCH:
         return valB
     elif opcode in [IADDI, ILW, ISW]:
-        return imm
+        return SignExtend(imm)
     elif opcode == IJAL:
         return 0
-    elif (opcode == RTYPE and funct == FJR) \
+    elif (opcode == RTYPE and funct in [FJR, FSLL, FSYS]) \
     or opcode == IJ:
         return None
     else:
@@ -237,9 +246,9 @@ def ALU_fun(opcode, funct):
     if (opcode == RTYPE and funct == FADD) \
     or opcode in [IADDI, ILW, ISW, IJAL]:
         return ALUADD
-    if opcode == IBNE:
+    if opcode in BRANCH:
         return ALUSUB
-    elif (opcode == RTYPE and funct == FJR) \
+    elif (opcode == RTYPE and funct in [FJR, FSLL, FSYS]) \
     or opcode == IJ:
         return ALUNOP
     else:
@@ -272,9 +281,9 @@ def ALU(aluA, aluB, aluFun):
 
 # 是否设置条件码寄存器
 def SetCC(opcode, funct):
-    if opcode == IBNE:
+    if opcode in BRANCH:
         return True
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
     or opcode in [IADDI, ILW, ISW, IJ, IJAL]:
         return False
     else:
@@ -285,7 +294,17 @@ def SetCC(opcode, funct):
 def Cond(opcode, funct, CC):
     if opcode == IBNE:
         return CC.ZF == False
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
+    elif opcode == IBEQ:
+        return CC.ZF
+    elif opcode == IBGT:
+        return not (CC.SF ^ CC.OF) and not CC.ZF
+    elif opcode == IBGE:
+        return not (CC.SF ^ CC.OF)
+    elif opcode == IBLT:
+        return CC.SF ^ CC.OF
+    elif opcode == IBLE:
+        return (CC.SF ^ CC.OF) or CC.ZF
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
     or opcode in [IADDI, ILW, ISW, IJ, IJAL]:
         return False
     else:
@@ -314,8 +333,8 @@ def Execute(opcode, funct, valA, valB, valP, imm, CC):
 def MReadControl(opcode, funct):
     if opcode == ILW:
         return True
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [IADDI, ISW, IJ, IJAL, IBNE]:
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
+    or opcode in [IADDI, ISW, IJ, IJAL] + BRANCH:
         return False
     else:
         raise MyError("invalid operation in AccessMemory")
@@ -325,8 +344,8 @@ def MReadControl(opcode, funct):
 def MWriteControl(opcode, funct):
     if opcode == ISW:
         return True
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [IADDI, ILW, IJ, IJAL, IBNE]:
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
+    or opcode in [IADDI, ILW, IJ, IJAL] + BRANCH:
         return False
     else:
         raise MyError("invalid operation in AccessMemory")
@@ -335,8 +354,8 @@ def MWriteControl(opcode, funct):
 def MemAddr(opcode, funct, valE):
     if opcode in [ILW, ISW]:
         return valE
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [IADDI, IJ, IJAL, IBNE]:
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
+    or opcode in [IADDI, IJ, IJAL] + BRANCH:
         return None
     else:
         raise MyError("invalid operation in AccessMemory")
@@ -345,8 +364,8 @@ def MemAddr(opcode, funct, valE):
 def MemData(opcode, funct, valB):
     if opcode == ISW:
         return valB
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [IADDI, ILW, IJ, IJAL, IBNE]:
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
+    or opcode in [IADDI, ILW, IJ, IJAL] + BRANCH:
         return None
     else:
         raise MyError("invalid operation in AccessMemory")
@@ -373,8 +392,8 @@ def DstE(opcode, funct, rt, rd):
         return rt
     elif opcode == IJAL:
         return 31
-    elif (opcode == RTYPE and funct == FJR) \
-    or opcode in [ILW, ISW, IJ, IBNE]:
+    elif (opcode == RTYPE and funct in [FJR, FSLL, FSYS]) \
+    or opcode in [ILW, ISW, IJ] + BRANCH:
         return 0
     else:
         raise MyError("invalid operation in WriteBack")
@@ -384,8 +403,8 @@ def DstE(opcode, funct, rt, rd):
 def DstM(opcode, funct, rt, rd):
     if opcode == ILW:
         return rt
-    elif (opcode == RTYPE and funct in [FADD, FJR]) \
-    or opcode in [IADDI, ISW, IJ, IJAL, IBNE]:
+    elif (opcode == RTYPE and funct in [FADD, FJR, FSLL, FSYS]) \
+    or opcode in [IADDI, ISW, IJ, IJAL] + BRANCH:
         return 0
     else:
         raise MyError("invalid operation in WriteBack")
@@ -403,17 +422,15 @@ def WriteBack(opcode, funct, regFile, rt, rd, valE, valM):
 # 更新PC
 # *****************************
 def UpdatePC(opcode, funct, valP, valA, address, imm, cnd):
-    if (opcode == RTYPE and funct == FADD) \
+    if (opcode == RTYPE and funct in [FADD, FSLL, FSYS]) \
             or opcode in [IADDI, ILW, ISW]:
         return valP
     elif opcode == RTYPE and funct == FJR:
         return valA
     elif opcode in [IJ, IJAL]:
         return valP & 0b11110000000000000000000000000000 | (address << 2)
-    elif opcode == IBNE:
-        if imm > (1 << 15):
-            imm -= (1 << 16)
-        return valP + (imm << 2) if cnd else valP
+    elif opcode in BRANCH:
+        return valP + (SignExtend(imm) << 2) if cnd else valP
     else:
         raise MyError("invalid operation in UpdatePC")
 
@@ -421,33 +438,135 @@ def UpdatePC(opcode, funct, valP, valA, address, imm, cnd):
 # *****************************
 # 定义处理器运行过程
 # *****************************
-def run(PC, imem, dmem, regFile, CC):
+class Simulator:
+    # 构造函数，可以传入已有的内存、寄存器堆和条件码
+    # delaySlot：跳转指令后面的一条指令（延迟槽）总是执行，之后才转到目标
+    # syscalls：syscall的服务（syscalls.SyscallHandler），为None时syscall只用于停机
+    def __init__(self, imem=None, dmem=None, regFile=None, CC=None, trace=False, delaySlot=False, syscalls=None):
+        self.imem = IMemory(256) if imem is None else imem
+        self.dmem = DMemory(1024) if dmem is None else dmem
+        self.regFile = RegFile() if regFile is None else regFile
+        self.CC = ConditionCode() if CC is None else CC
+        self.trace = trace
+        self.delaySlot = delaySlot
+        self.syscalls = syscalls
+        # 每条指令执行完成时调用retireHook(PC, IR)
+        self.retireHook = None
+        self.programLength = len(self.imem)
+        self.reset()
+
+    def reset(self, PC=0):
+        self.PC = PC
+        self.clock = 0
+        self.stopped = False
+        # 执行延迟槽之后要转到的PC
+        self.pendingPC = None
+        if self.syscalls is not None:
+            self.syscalls.reset()
+
+    # 加载指令和数据
+    def load(self, program, data=None, PC=0):
+        self.imem.loadProgram(program)
+        if data is not None:
+            self.dmem.loadData(data)
+        self.programLength = len(program)
+        self.reset(PC)
+
+    # 除寄存器堆和内存以外的全部状态
+    def saveState(self):
+        return self.PC, self.clock, self.stopped, self.pendingPC, (self.CC.ZF, self.CC.SF, self.CC.OF)
+
+    def restoreState(self, state):
+        self.PC, self.clock, self.stopped, self.pendingPC, CC = state
+        self.CC.set(*CC)
+
+    # 执行了syscall或者PC超出程序范围
+    @property
+    def halted(self):
+        return self.stopped or self.PC >= self.programLength * 4
+
+    # 执行一条指令
+    def tick(self):
+        PC = self.PC
+        valP, opcode, rs, rt, rd, shamt, funct, imm, address = Fetch(self.imem, PC)
+        valA, valB = Decode(opcode, funct, self.regFile, rs, rt)
+        # 有延迟槽时jal的返回地址跳过延迟槽
+        link = valP + 4 if self.delaySlot else valP
+        valE, cnd = Execute(opcode, funct, valA, valB, link, imm, self.CC)
+        valM = AccessMemory(opcode, funct, self.dmem, valE, valB)
+        WriteBack(opcode, funct, self.regFile, rt, rd, valE, valM)
+        # SEQ每条指令一个周期，服务的周期数不计入时钟
+        if opcode == RTYPE and funct == FSYS and self.syscalls is not None:
+            self.syscalls.service(self)
+        newPC = UpdatePC(opcode, funct, valP, valA, address, imm, cnd)
+        if self.pendingPC is not None:
+            self.PC, self.pendingPC = self.pendingPC, None
+        elif self.delaySlot and opcode in BRANCH:
+            # 分支不成立时从延迟槽之后继续
+            self.PC, self.pendingPC = valP, newPC if cnd else valP + 4
+        elif self.delaySlot and (opcode in [IJ, IJAL] or (opcode == RTYPE and funct == FJR)):
+            self.PC, self.pendingPC = valP, newPC
+        else:
+            self.PC = newPC
+        self.clock = self.clock + 1
+        if opcode == RTYPE and funct == FSYS and (self.syscalls is None or self.syscalls.exitCode is not None):
+            self.stopped = True
+        if self.retireHook is not None:
+            self.retireHook(PC, self.imem.mem[PC // 4])
+        if self.trace:
+            print(f"PC:{self.PC}")
+
+    # 执行n条指令，程序结束时提前停止
+    def step(self, n=1):
+        for _ in range(n):
+            if self.halted:
+                break
+            self.tick()
+        return self.clock
+
+    # SEQ每条指令一个时钟周期
+    def run(self, max_cycles=10000):
+        while not self.halted and self.clock < max_cycles:
+            self.tick()
+        return self.stats()
+
+    def stats(self):
+        stats = {
+            "core": "SEQ",
+            "cycles": self.clock,
+            "instructions": self.clock,
+            "CPI": 1.0 if self.clock else None,
+            "halted": self.halted,
+        }
+        if self.syscalls is not None:
+            stats["syscalls"] = self.syscalls.stats()
+        return stats
+
+    def state(self):
+        return {
+            "core": "SEQ",
+            "clock": self.clock,
+            "halted": self.halted,
+            "PC": self.PC,
+            "registers": list(self.regFile.reg),
+            "CC": {"ZF": self.CC.ZF, "SF": self.CC.SF, "OF": self.CC.OF},
+        }
+
+
+def run(PC, imem, dmem, regFile, CC, programLength):
+    sim = Simulator(imem, dmem, regFile, CC, trace=True)
+    sim.programLength = programLength
+    sim.reset(PC)
     try:
-        while(PC < len(program) * 4):
-            valP, opcode, rs, rt, rd, shamt, funct, imm, address = Fetch(imem, PC)
-            valA, valB = Decode(opcode, funct, regFile, rs, rt)
-            valE, cnd = Execute(opcode, funct, valA, valB, valP, imm, CC)
-            valM = AccessMemory(opcode, funct, dmem, valE, valB)
-            WriteBack(opcode, funct, regFile, rt, rd, valE, valM)
-            PC = UpdatePC(opcode, funct, valP, valA, address, imm, cnd)
-            # print("==================================================")
-            print(f"PC:{PC}")
-            # dmem.emit()
-            # regFile.emit()
+        while not sim.halted:
+            sim.tick()
     except Exception as e:
-        print(f"PC:{PC}")
+        print(f"PC:{sim.PC}")
         print(e)
         dmem.emit()
         regFile.emit()
 
 
-# 初始化寄存器和内存
-PC = 0
-CC = ConditionCode()
-regFile = RegFile()
-imem = IMemory(16)
-dmem = DMemory(16)
-
 # 加载指令和数据
 program = [
     0b00100000000001000000000000001100,  # addi $4, $0, 12
@@ -464,12 +583,22 @@ program = [
     0b00010100001001001111111111111011   # bne $1, $4, -20
 ]
 data = [3, 3, 4, 90]
-imem.loadProgram(program)
-dmem.loadData(data)
 
-# 运行程序
-run(PC, imem, dmem, regFile, CC)
 
-# 输出内存
-dmem.emit()
-regFile.emit()
\ No newline at end of file
+if __name__ == "__main__":
+    # 初始化寄存器和内存
+    PC = 0
+    CC = ConditionCode()
+    regFile = RegFile()
+    imem = IMemory(16)
+    dmem = DMemory(16)
+
+    imem.loadProgram(program)
+    dmem.loadData(data)
+
+    # 运行程序
+    run(PC, imem, dmem, regFile, CC, len(program))
+
+    # 输出内存
+    dmem.emit()
+    regFile.emit()
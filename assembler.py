@@ -32,6 +32,7 @@ opcodes = {
     'add': RTYPE,
     'jr': RTYPE,
     'sll': RTYPE,
+    'nop': RTYPE,
     'syscall': RTYPE,
 
     # I-type
@@ -58,6 +59,7 @@ functs = {
     'add': FADD,
     'jr': FJR,
     'sll': FSLL,
+    'nop': FSLL,  # nop = sll $0,$0,0
     'syscall': FSYS
 }
 
@@ -80,8 +82,8 @@ def assemble_instruction(instruction):
             rs = int(arguments[1].strip("$ "))
             rt = int(arguments[2].strip("$ "))
         if funct == FJR:
-            rs = int(parts[1].strip(" "))
-        if funct == FSLL:
+            rs = int(parts[1].strip("$ "))
+        if funct == FSLL and len(parts) > 1:
             arguments = parts[1].split(",")
             rd = int(arguments[0].strip("$ "))
             rt = int(arguments[1].strip("$ "))
@@ -126,6 +128,42 @@ def assemble(program):
     return assembled_code
 
 
+# 反汇编一条指令，输出格式和assemble_instruction的输入一致
+def disassemble(IR):
+    opcode = IR >> 26
+    rs = (IR >> 21) & 0b11111
+    rt = (IR >> 16) & 0b11111
+    rd = (IR >> 11) & 0b11111
+    shamt = (IR >> 6) & 0b11111
+    funct = IR & 0b111111
+    imm = IR & 0xffff
+    if imm >= (1 << 15):
+        imm -= (1 << 16)
+    if opcode == RTYPE:
+        if funct == FADD:
+            return f"add ${rd}, ${rs}, ${rt}"
+        if funct == FJR:
+            return f"jr ${rs}"
+        if funct == FSLL and IR == 0:
+            return "nop"
+        if funct == FSLL:
+            return f"sll ${rd}, ${rt}, {shamt}"
+        if funct == FSYS:
+            return "syscall"
+    elif opcode == IADDI:
+        return f"addi ${rt}, ${rs}, {imm}"
+    elif opcode in [ILW, ISW]:
+        name = "lw" if opcode == ILW else "sw"
+        return f"{name} ${rt}, {imm}(${rs})"
+    elif opcode in [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
+        name = [k for k, v in opcodes.items() if v == opcode][0]
+        return f"{name} ${rs}, ${rt}, {imm << 2}"
+    elif opcode in JTYPE:
+        name = "j" if opcode == IJ else "jal"
+        return f"{name} {(IR & 0x3ffffff) << 2}"
+    return f".word 0x{IR:08x}"
+
+
 def remove_comments_and_get_instructions(input_string):
     instructions = []
 
@@ -140,6 +178,541 @@ def remove_comments_and_get_instructions(input_string):
     return instructions
 
 
+# 汇编源程序字符串
+def assemble_source(source):
+    return assemble(remove_comments_and_get_instructions(source))
+
+
+# *****************************
+# 指令调度
+# 在每个基本块内重新排列指令，使lw后面紧跟的不是使用它结果的指令。
+# 依赖关系（读后写、写后读、写后写和可能重叠的访存）构成有向无环图，按关键路径做表调度；
+# 块末尾的跳转指令位置不变，所以各个块的位置和分支偏移都不用修改。
+# 块内只被addi r, r, c修改的寄存器r作为lw/sw的基址时，addi可以越过这些访存指令，
+# 同时修改它们的偏移量。代价模型和PIPE.py相同：lw后面紧跟使用其结果的指令时停顿一个周期。
+# *****************************
+BRANCHES = [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]
+
+
+def sign_extend(imm):
+    return imm - (1 << 16) if imm >= (1 << 15) else imm
+
+
+# 指令读写的寄存器，规则和PIPE.py的SrcA/SrcB/DstE/DstM相同
+def instruction_operands(IR):
+    opcode = IR >> 26
+    rs = (IR >> 21) & 0b11111
+    rt = (IR >> 16) & 0b11111
+    rd = (IR >> 11) & 0b11111
+    funct = IR & 0b111111
+    if opcode == RTYPE:
+        if funct == FADD:
+            return [rs, rt], [rd]
+        if funct == FJR:
+            return [rs], []
+        return [], []
+    if opcode in [IADDI, ILW]:
+        return [rs], [rt]
+    if opcode in [ISW] + BRANCHES:
+        return [rs, rt], []
+    if opcode == IJAL:
+        return [], [31]
+    return [], []
+
+
+# 改变控制流的指令，只能在基本块末尾
+def is_control(IR):
+    opcode = IR >> 26
+    funct = IR & 0b111111
+    return opcode in BRANCHES + JTYPE or (opcode == RTYPE and funct in [FJR, FSYS])
+
+
+# 划分基本块，返回[(开始, 结束)]，以指令编号表示
+def basic_blocks(program):
+    leaders = {0}
+    for i, IR in enumerate(program):
+        opcode = IR >> 26
+        if is_control(IR):
+            leaders.add(i + 1)
+        if opcode in BRANCHES:
+            leaders.add(i + 1 + sign_extend(IR & 0xffff))
+        if opcode in JTYPE:
+            leaders.add(IR & 0x3ffffff)
+    leaders = sorted(leader for leader in leaders if 0 <= leader < len(program))
+    return list(zip(leaders, leaders[1:] + [len(program)]))
+
+
+# lw后面紧跟使用其结果的指令的次数
+def count_stalls(program):
+    stalls = 0
+    for prev, IR in zip(program, program[1:]):
+        if prev >> 26 == ILW:
+            if (prev >> 16) & 0b11111 in instruction_operands(IR)[0]:
+                stalls += 1
+    return stalls
+
+
+# 基本块（不含末尾跳转指令）内的依赖图
+def block_dependences(body):
+    n = len(body)
+    operands = [instruction_operands(IR) for IR in body]
+    is_mem = [IR >> 26 in [ILW, ISW] for IR in body]
+    base = [(IR >> 21) & 0b11111 for IR in body]
+    offset = [sign_extend(IR & 0xffff) for IR in body]
+
+    # 只被addi r, r, c修改、并且不作为sw数据的寄存器
+    foldable = set()
+    for srcs, dsts in operands:
+        foldable.update(dsts)
+    for i, IR in enumerate(body):
+        for dst in operands[i][1]:
+            if not (IR >> 26 == IADDI and base[i] == dst):
+                foldable.discard(dst)
+        if IR >> 26 == ISW:
+            foldable.discard((IR >> 16) & 0b11111)
+    is_step = [IR >> 26 == IADDI and base[i] in foldable for i, IR in enumerate(body)]
+
+    # 每条访存指令之前基址寄存器累计加上的值
+    delta = [0] * n
+    total = {}
+    for i in range(n):
+        if is_step[i]:
+            total[base[i]] = total.get(base[i], 0) + offset[i]
+        elif is_mem[i]:
+            delta[i] = total.get(base[i], 0)
+
+    def may_alias(i, j):
+        if base[i] != base[j]:
+            return True
+        if base[i] in foldable:
+            return abs(offset[i] + delta[i] - offset[j] - delta[j]) < 4
+        if any(base[i] in operands[k][1] for k in range(i, j)):
+            return True
+        return abs(offset[i] - offset[j]) < 4
+
+    # 依赖图，latency为2表示lw和使用其结果的指令相邻时停顿
+    preds = [[] for _ in range(n)]
+    for j in range(n):
+        for i in range(j):
+            if (is_step[i] and is_mem[j] or is_mem[i] and is_step[j]) and base[i] == base[j]:
+                continue
+            srcs_i, dsts_i = operands[i]
+            srcs_j, dsts_j = operands[j]
+            raw = set(dsts_i) & set(srcs_j)
+            if raw or set(srcs_i) & set(dsts_j) or set(dsts_i) & set(dsts_j) \
+                    or (is_mem[i] and is_mem[j] and ISW in [body[i] >> 26, body[j] >> 26] and may_alias(i, j)):
+                preds[j].append((i, 2 if raw and body[i] >> 26 == ILW else 1))
+
+    return {"operands": operands, "is_mem": is_mem, "is_step": is_step, "base": base, "offset": offset,
+            "foldable": foldable, "delta": delta, "preds": preds}
+
+
+# 按order重新排列指令并修改访存指令的偏移量，偏移量超出范围时返回None
+def reorder_block(body, graph, order):
+    is_step, is_mem, base, offset = graph["is_step"], graph["is_mem"], graph["base"], graph["offset"]
+    reordered = []
+    total = {}
+    for i in order:
+        IR = body[i]
+        if is_step[i]:
+            total[base[i]] = total.get(base[i], 0) + offset[i]
+        elif is_mem[i] and base[i] in graph["foldable"]:
+            imm = offset[i] + graph["delta"][i] - total.get(base[i], 0)
+            if not -(1 << 15) <= imm < (1 << 15):
+                return None
+            IR = IR & ~0xffff | (imm & 0xffff)
+        reordered.append(IR)
+    return reordered
+
+
+def schedule_block(block):
+    terminator = block[-1] if is_control(block[-1]) else None
+    body = block[:-1] if terminator is not None else list(block)
+    n = len(body)
+    graph = block_dependences(body)
+    operands, preds = graph["operands"], graph["preds"]
+
+    # 关键路径长度作为优先级，跳转指令读的寄存器由lw产生时也计入
+    priority = [1] * n
+    if terminator is not None:
+        for i in range(n):
+            if body[i] >> 26 == ILW and operands[i][1][0] in instruction_operands(terminator)[0]:
+                priority[i] = 2
+    for j in reversed(range(n)):
+        for i, latency in preds[j]:
+            priority[i] = max(priority[i], priority[j] + latency)
+
+    # 表调度
+    order = []
+    done = [None] * n
+    time = 0
+    while len(order) < n:
+        ready = [j for j in range(n) if done[j] is None and all(done[i] is not None for i, _ in preds[j])]
+        earliest = {j: max([done[i] + latency for i, latency in preds[j]], default=0) for j in ready}
+        candidates = [j for j in ready if earliest[j] <= time] or ready
+        pick = max(candidates, key=lambda j: (priority[j], -j))
+        done[pick] = max(time, earliest[pick])
+        time = done[pick] + 1
+        order.append(pick)
+
+    scheduled = reorder_block(body, graph, order)
+    if scheduled is None:
+        return list(block)
+    if terminator is not None:
+        scheduled.append(terminator)
+    return scheduled
+
+
+# 调度整个程序，返回调度后的程序和报告
+def schedule(program):
+    scheduled = []
+    for start, end in basic_blocks(program):
+        block = list(program[start:end])
+        result = schedule_block(block)
+        scheduled += result if count_stalls(result) < count_stalls(block) else block
+    before = count_stalls(program)
+    after = count_stalls(scheduled)
+    return scheduled, {"stalls_before": before, "stalls_after": after, "stalls_removed": before - after}
+
+
+# *****************************
+# 循环展开
+# 识别以向后的条件分支结束、循环体内没有其他跳转的计数循环：
+# 分支比较的一个寄存器在循环体内只被一条addi r, r, c修改，另一个寄存器不变，
+# 并且进入循环前的基本块能确定两个寄存器的差是常数，从而算出循环次数。
+# 循环体复制factor份，除最后一份外，每份在循环体内先写后读的寄存器换成没有用到的寄存器；
+# r只作为访存基址时，各份的addi合并为一条，偏移量折叠进访存指令的立即数。
+# 循环次数不是factor的倍数时，余下的次数在循环前顺序执行。
+# 所有分支和跳转用指令编号表示目标，展开后重新计算偏移。
+# *****************************
+BRANCH_CONDITIONS = {
+    IBNE: lambda diff: diff != 0,
+    IBEQ: lambda diff: diff == 0,
+    IBGT: lambda diff: diff > 0,
+    IBGE: lambda diff: diff >= 0,
+    IBLT: lambda diff: diff < 0,
+    IBLE: lambda diff: diff <= 0,
+}
+
+# 可以用来改名的寄存器，不用at、k0、k1、gp、sp、fp和ra
+FREE_REGISTERS = list(range(2, 26))
+
+
+# 分支和跳转的目标，以指令编号表示
+def branch_target(index, IR):
+    opcode = IR >> 26
+    if opcode in BRANCHES:
+        return index + 1 + sign_extend(IR & 0xffff)
+    if opcode in JTYPE:
+        return IR & 0x3ffffff
+    return None
+
+
+# 修改指令用到的寄存器
+def rename_registers(IR, mapping):
+    opcode = IR >> 26
+    if opcode in JTYPE:
+        return IR
+    rs = (IR >> 21) & 0b11111
+    rt = (IR >> 16) & 0b11111
+    IR = IR & ~(0b1111111111 << 16) | mapping.get(rs, rs) << 21 | mapping.get(rt, rt) << 16
+    if opcode == RTYPE:
+        rd = (IR >> 11) & 0b11111
+        IR = IR & ~(0b11111 << 11) | mapping.get(rd, rd) << 11
+    return IR
+
+
+def set_immediate(IR, imm):
+    return IR & ~0xffff | (imm & 0xffff)
+
+
+# 在基本块内符号执行，每个寄存器的值表示为(进入基本块时的某个寄存器或None, 常数)
+def symbolic_values(block):
+    values = {0: (None, 0)}
+    for IR in block:
+        opcode = IR >> 26
+        rs = (IR >> 21) & 0b11111
+        rt = (IR >> 16) & 0b11111
+        rd = (IR >> 11) & 0b11111
+        get = lambda reg: values.get(reg, (reg, 0))
+        if opcode == IADDI:
+            symbol, const = get(rs)
+            values[rt] = (symbol, const + sign_extend(IR & 0xffff))
+        elif opcode == RTYPE and IR & 0b111111 == FADD:
+            (symbolA, constA), (symbolB, constB) = get(rs), get(rt)
+            if symbolA is not None and symbolB is not None:
+                values[rd] = (("unknown", rd, id(IR)), 0)
+            else:
+                values[rd] = (symbolA if symbolA is not None else symbolB, constA + constB)
+        else:
+            for dst in instruction_operands(IR)[1]:
+                values[dst] = (("unknown", dst, id(IR)), 0)
+    return values
+
+
+# 循环次数：第一次分支不成立时执行过的次数，diff是第一次进入循环时的比较差值
+def trip_count(opcode, diff, step, limit=1 << 24):
+    condition = BRANCH_CONDITIONS[opcode]
+    if not condition(diff + step):
+        return 1
+    if step == 0:
+        return None
+    if opcode == IBNE:
+        return -diff // step if -diff % step == 0 and -diff // step > 0 else None
+    if opcode == IBEQ:
+        return 2
+    # 其余比较随次数单调变化，二分查找第一次不成立的次数
+    if condition(diff + limit * step):
+        return None
+    low, high = 1, limit
+    while high - low > 1:
+        middle = (low + high) // 2
+        if condition(diff + middle * step):
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+# 分析以program[end]为结尾分支的循环，不能展开时返回None
+def analyze_loop(program, blocks, start, end):
+    body = program[start:end]
+    branch = program[end]
+    if any(is_control(IR) for IR in body):
+        return None
+    rs = (branch >> 21) & 0b11111
+    rt = (branch >> 16) & 0b11111
+    writes = {}
+    for i, IR in enumerate(body):
+        for dst in instruction_operands(IR)[1]:
+            writes.setdefault(dst, []).append(i)
+    induction = [reg for reg in (rs, rt) if reg in writes]
+    if rs == rt or len(induction) != 1:
+        return None
+    reg = induction[0]
+    if len(writes[reg]) != 1:
+        return None
+    step_index = writes[reg][0]
+    step_IR = body[step_index]
+    if step_IR >> 26 != IADDI or (step_IR >> 21) & 0b11111 != reg:
+        return None
+    step = sign_extend(step_IR & 0xffff)
+
+    # 进入循环前的基本块
+    preheader = [(a, b) for a, b in blocks if b == start]
+    if not preheader or is_control(program[start - 1]):
+        return None
+    values = symbolic_values(program[preheader[0][0]:start])
+    (symbolA, constA) = values.get(rs, (rs, 0))
+    (symbolB, constB) = values.get(rt, (rt, 0))
+    if symbolA != symbolB:
+        return None
+    count = trip_count(branch >> 26, constA - constB, step if reg == rs else -step)
+    if count is None:
+        return None
+
+    # 循环体内r只作为访存基址时才能折叠偏移量
+    foldable = True
+    for i, IR in enumerate(body):
+        srcs = instruction_operands(IR)[0]
+        if i != step_index and reg in srcs and not (IR >> 26 in [ILW, ISW] and srcs.count(reg) == 1
+                                                     and (IR >> 21) & 0b11111 == reg):
+            foldable = False
+
+    # 每次循环中先写后读的寄存器
+    local = []
+    seen = set()
+    for IR in body:
+        srcs, dsts = instruction_operands(IR)
+        seen.update(srcs)
+        for dst in dsts:
+            if dst not in seen and dst != reg and dst not in local:
+                local.append(dst)
+            seen.add(dst)
+    return {"reg": reg, "step": step, "step_index": step_index, "count": count,
+            "foldable": foldable, "local": local}
+
+
+# 生成factor份循环体，返回[(指令, 目标)]
+def unrolled_body(body, loop, factor, free):
+    reg, step, step_index = loop["reg"], loop["step"], loop["step_index"]
+    entries = []
+    for copy in range(factor):
+        mapping = {}
+        if copy < factor - 1 and len(free) >= len(loop["local"]):
+            mapping = dict(zip(loop["local"], free[:len(loop["local"])]))
+            del free[:len(loop["local"])]
+        for i, IR in enumerate(body):
+            if loop["foldable"] and i == step_index:
+                continue
+            IR = rename_registers(IR, mapping)
+            if loop["foldable"] and IR >> 26 in [ILW, ISW] and (IR >> 21) & 0b11111 == reg:
+                imm = sign_extend(IR & 0xffff) + copy * step + (step if i > step_index else 0)
+                if not -(1 << 15) <= imm < (1 << 15):
+                    return None
+                IR = set_immediate(IR, imm)
+            entries.append((IR, None))
+    if loop["foldable"]:
+        if not -(1 << 15) <= factor * step < (1 << 15):
+            return None
+        entries.append((set_immediate(body[step_index], factor * step), None))
+    return entries
+
+
+# 按目标编号重新计算分支偏移和跳转地址
+def relocate(entries, labels):
+    program = []
+    for index, (IR, target) in enumerate(entries):
+        if target is not None:
+            position = labels[target]
+            if IR >> 26 in BRANCHES:
+                offset = position - index - 1
+                if not -(1 << 15) <= offset < (1 << 15):
+                    return None
+                IR = set_immediate(IR, offset)
+            else:
+                IR = IR & ~0x3ffffff | position
+        program.append(IR)
+    return program
+
+
+# 展开程序中所有能展开的循环，返回展开后的程序和报告
+def unroll(program, factor, schedule_after=True):
+    program = list(program)
+    report = {"loops": []}
+    # jr的目标是运行时算出的地址，改变指令位置可能使它失效
+    if factor < 2 or any(IR >> 26 == RTYPE and IR & 0b111111 == FJR for IR in program):
+        return program, report
+    blocks = basic_blocks(program)
+    targets = [branch_target(i, IR) for i, IR in enumerate(program)]
+    loops = {}
+    for end, IR in enumerate(program):
+        start = targets[end]
+        if IR >> 26 not in BRANCHES or start is None or not 0 <= start <= end:
+            continue
+        # 循环中间和开头不能是其他跳转的目标
+        if any(start <= target <= end for i, target in enumerate(targets) if target is not None and i != end):
+            continue
+        loop = analyze_loop(program, blocks, start, end)
+        if loop is not None:
+            loops[start] = (end, loop)
+
+    used = set()
+    for IR in program:
+        srcs, dsts = instruction_operands(IR)
+        used.update(srcs + dsts)
+    free = [reg for reg in FREE_REGISTERS if reg not in used]
+
+    # [(指令, 目标)]，目标是原来的指令编号或者("loop", 循环开头)
+    entries = []
+    labels = {len(program): None}
+    index = 0
+    while index < len(program):
+        if index not in loops:
+            labels[index] = len(entries)
+            entries.append((program[index], targets[index]))
+            index += 1
+            continue
+        end, loop = loops[index]
+        body = program[index:end]
+        peeled = loop["count"] % factor
+        if loop["count"] < factor:
+            peeled = loop["count"]
+        unrolled = unrolled_body(body, loop, factor, free) if peeled < loop["count"] else []
+        if unrolled is None:
+            labels[index] = len(entries)
+            entries.append((program[index], targets[index]))
+            index += 1
+            continue
+        labels[index] = len(entries)
+        # 余下的次数顺序执行
+        for _ in range(peeled):
+            entries += [(IR, None) for IR in body]
+        if unrolled:
+            labels[("loop", index)] = len(entries)
+            entries += unrolled
+            entries.append((program[end], ("loop", index)))
+        labels[end] = len(entries) - 1
+        report["loops"].append({"head": index * 4, "trip_count": loop["count"], "factor": factor,
+                                "peeled": peeled, "folded": loop["foldable"]})
+        index = end + 1
+    labels[len(program)] = len(entries)
+
+    unrolled = relocate(entries, labels)
+    if unrolled is None:
+        return program, {"loops": []}
+    if schedule_after:
+        unrolled, report["schedule"] = schedule(unrolled)
+    return unrolled, report
+
+
+# *****************************
+# 填充延迟槽
+# 用于PIPE/SEQ的delaySlot模式：每条分支、j、jal和jr后面的一条指令总是执行。
+# 优先把同一基本块里与跳转指令无关、也没有被块内后续指令依赖的一条指令移到跳转指令后面，
+# 有多条可选时选停顿最少的；找不到时插入nop，并重新计算分支偏移和跳转地址。
+# *****************************
+NOP = 0
+
+
+def fill_block(block):
+    terminator = block[-1]
+    body = block[:-1]
+    graph = block_dependences(body)
+    operands = graph["operands"]
+    terminator_srcs, terminator_dsts = instruction_operands(terminator)
+    used = set()
+    for i in range(len(body)):
+        used.update(j for j, _ in graph["preds"][i])
+    best = None
+    for j in range(len(body)):
+        srcs, dsts = operands[j]
+        if j in used or set(dsts) & set(terminator_srcs) or set(terminator_dsts) & set(srcs + dsts):
+            continue
+        reordered = reorder_block(body, graph, [i for i in range(len(body)) if i != j] + [j])
+        if reordered is None:
+            continue
+        candidate = reordered[:-1] + [terminator, reordered[-1]]
+        if best is None or count_stalls(candidate) <= count_stalls(best):
+            best = candidate
+    return best
+
+
+# 返回填充后的程序和报告
+def fill_delay_slots(program):
+    program = list(program)
+    targets = [branch_target(i, IR) for i, IR in enumerate(program)]
+    has_jr = any(IR >> 26 == RTYPE and IR & 0b111111 == FJR for IR in program)
+    entries = []
+    labels = {}
+    filled = nops = 0
+    for start, end in basic_blocks(program):
+        labels[start] = len(entries)
+        block = program[start:end]
+        terminator = block[-1]
+        if not is_control(terminator) or terminator >> 26 == RTYPE and terminator & 0b111111 == FSYS:
+            entries += [(IR, targets[start + i]) for i, IR in enumerate(block)]
+            continue
+        result = fill_block(block)
+        if result is not None:
+            filled += 1
+            entries += [(IR, None) for IR in result[:-2]]
+            entries.append((terminator, targets[end - 1]))
+            entries.append((result[-1], None))
+        else:
+            # jr的目标是运行时算出的地址，插入指令会使它失效
+            if has_jr:
+                raise ValueError(f"cannot insert a nop after PC:{(end - 1) * 4} in a program that uses jr")
+            nops += 1
+            entries += [(IR, targets[start + i]) for i, IR in enumerate(block)]
+            entries.append((NOP, None))
+    labels[len(program)] = len(entries)
+    filled_program = relocate(entries, labels)
+    if filled_program is None:
+        raise ValueError("branch offset out of range after filling delay slots")
+    return filled_program, {"filled": filled, "nops": nops}
+
+
 loop_loop = """
     addi $1, $0, 999 # i = 999
     addi $2, $0, 1   # s = 1
@@ -220,12 +793,13 @@ loop_unrolling10 = """
     syscall
 """
 
-# 将字符串转换为汇编指令数组
-assembled_program = remove_comments_and_get_instructions(loop_unrolling10)
+if __name__ == "__main__":
+    # 将字符串转换为汇编指令数组
+    assembled_program = remove_comments_and_get_instructions(loop_unrolling10)
 
-# 转换为二进制指令
-binary_program = assemble(assembled_program)
+    # 转换为二进制指令
+    binary_program = assemble(assembled_program)
 
-# 打印汇编结果
-for i in range(len(binary_program)):
-    print(f"0b{format(binary_program[i], '032b')},  # {assembled_program[i]}")
+    # 打印汇编结果
+    for i in range(len(binary_program)):
+        print(f"0b{format(binary_program[i], '032b')},  # {assembled_program[i]}")
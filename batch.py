@@ -0,0 +1,119 @@
+import argparse
+import contextlib
+import itertools
+import sys
+from multiprocessing import Pool
+
+import PIPE
+import SEQ
+from sharedimage import SharedImage
+from runcache import stateDigest
+from main import PROGRAMS, DATA, loadProgram, loadData
+from assembler import fill_delay_slots
+
+# 每次运行的配置和默认值
+DEFAULT_CONFIG = {"core": "pipe", "loadLatency": 1, "storeLatency": 1, "delaySlot": False, "storeBufferDepth": 0}
+
+# 工作进程附加的程序镜像，delaySlot -> 镜像
+_images = None
+
+
+def attach(handles):
+    global _images
+    _images = {delaySlot: SharedImage.attach(handle) for delaySlot, handle in handles.items()}
+
+
+# 工作进程：用共享的镜像建立模拟器并运行
+def runJob(job):
+    config, PC, max_cycles = job
+    image = _images[config["delaySlot"]]
+    imem = image.imem(config["core"])
+    dmem = image.dmem(config["core"])
+    if config["core"] == "pipe":
+        sim = PIPE.Simulator(imem, dmem, loadLatency=config["loadLatency"],
+                             storeLatency=config["storeLatency"], delaySlot=config["delaySlot"],
+                             storeBufferDepth=config["storeBufferDepth"])
+    else:
+        sim = SEQ.Simulator(imem, dmem, delaySlot=config["delaySlot"])
+        # 没有经过load，程序长度按镜像里的指令数
+        sim.programLength = image.programLength
+    sim.reset(PC)
+    # 一个配置出错不影响其他配置，错误随结果返回
+    try:
+        stats = sim.run(max_cycles)
+    except (PIPE.MyError, SEQ.MyError) as e:
+        return {"error": str(e)}
+    stats["regDigest"] = stateDigest(sim.regFile.reg)
+    stats["memDigest"] = stateDigest(sim.dmem.mem)
+    stats["copied"] = not dmem.shared
+    return stats
+
+
+# *****************************
+# 同一个程序镜像在多个配置下并行运行
+# 指令和初始数据只写入共享内存一次，工作进程直接读共享的指令，
+# 数据内存第一次写时才复制，返回[(配置, 统计信息)]
+# 有delaySlot的配置时，父进程另外发布一个填充过延迟槽的镜像，程序不能填充时抛出ValueError
+# *****************************
+def runBatch(program, configs, data=None, PC=0, max_cycles=10000, processes=None, dmemSize=1024):
+    configs = [dict(DEFAULT_CONFIG, **config) for config in configs]
+    programs = {delaySlot: fill_delay_slots(program)[0] if delaySlot else program
+                for delaySlot in {config["delaySlot"] for config in configs}}
+    with contextlib.ExitStack() as stack:
+        handles = {delaySlot: stack.enter_context(SharedImage.publish(filled, data, dmemSize)).handle
+                   for delaySlot, filled in programs.items()}
+        with Pool(processes, initializer=attach, initargs=(handles,)) as pool:
+            results = pool.map(runJob, [(config, PC, max_cycles) for config in configs])
+    return list(zip(configs, results))
+
+
+# 命令行参数 name=v1,v2,... 的全部组合
+def parseConfigs(params):
+    grid = {}
+    for param in params:
+        name, _, values = param.partition("=")
+        if name not in DEFAULT_CONFIG:
+            raise SystemExit(f"unknown parameter: {name}")
+        if name == "core":
+            grid[name] = values.split(",")
+        elif name == "delaySlot":
+            grid[name] = [v in ["1", "true", "True"] for v in values.split(",")]
+        else:
+            grid[name] = [int(v) for v in values.split(",")]
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="同一个程序在多个配置下并行运行")
+    parser.add_argument("program", help=f"内置程序({', '.join(PROGRAMS)})或者汇编源文件")
+    parser.add_argument("params", nargs="*", metavar="NAME=V1,V2",
+                        help=f"运行的参数和取值：{', '.join(DEFAULT_CONFIG)}")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--dmem-size", type=int, default=1024, help="数据内存的字数")
+    parser.add_argument("--max-cycles", type=int, default=10000, help="最大时钟数")
+    parser.add_argument("--jobs", type=int, default=None, help="并行进程数，默认为CPU核数")
+    args = parser.parse_args(argv)
+
+    program = loadProgram(args.program)
+    data = loadData(args.data) if args.data else DATA.get(args.program)
+    try:
+        results = runBatch(program, parseConfigs(args.params), data, max_cycles=args.max_cycles,
+                           processes=args.jobs, dmemSize=args.dmem_size)
+    except ValueError as e:
+        raise SystemExit(f"error: {e}")
+    print(f"{'cycles':>8}{'instr':>8}  {'registers':16}  {'memory':16}  config")
+    failed = False
+    for config, stats in results:
+        described = " ".join(f"{k}={v}" for k, v in config.items() if v != DEFAULT_CONFIG[k]) or "default"
+        if "error" in stats:
+            failed = True
+            print(f"{'-':>8}{'-':>8}  error: {stats['error']}  {described}")
+            continue
+        print(f"{stats['cycles']:>8}{stats['instructions']:>8}  {stats['regDigest']}  {stats['memDigest']}  "
+              f"{described}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
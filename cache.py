@@ -0,0 +1,178 @@
+from PIPE import MyError
+
+
+# *****************************
+# 组相联数据缓存，只模拟命中和缺失，不保存数据
+# size字节，每块block字节，ways路，LRU替换，写分配
+# prefetcher: 预取器，每次访问后给出要预取的地址
+# fillLatency: 缺失或者预取时调入一块需要的周期数，只影响request返回的等待周期
+# *****************************
+class Cache:
+    def __init__(self, size=1024, block=16, ways=1, prefetcher=None, fillLatency=0):
+        if block & (block - 1) or size % (block * ways):
+            raise MyError(f"cache_error: invalid geometry size({size}) block({block}) ways({ways})")
+        self.size = size
+        self.block = block
+        self.ways = ways
+        self.setCount = size // (block * ways)
+        self.prefetcher = prefetcher
+        self.fillLatency = fillLatency
+        self.reset()
+
+    # 清空缓存和统计
+    def reset(self):
+        # 每组按最近使用的顺序保存标记，最近使用的在最后
+        self.sets = [[] for _ in range(self.setCount)]
+        self.hits = 0
+        self.misses = 0
+        # 预取进来还没有被访问过的块 -> 调入完成的周期
+        self.prefetched = {}
+        self.prefetches = 0
+        self.usefulPrefetches = 0
+        self.latePrefetches = 0
+        if self.prefetcher is not None:
+            self.prefetcher.reset()
+
+    # 访问一个地址，返回是否命中；缺失时把所在的块调入缓存
+    def access(self, address, write=False, PC=None, now=0):
+        return self.request(address, write, PC, now)[0]
+
+    # *****************************
+    # 带时间的访问，now是访问的周期，PC是访存指令的PC（没有时为None）
+    # 返回(是否命中, 还要等待的周期数)：命中为0，缺失为fillLatency，
+    # 预取的块还没有调入完成时算命中，等待剩下的周期
+    # *****************************
+    def request(self, address, write=False, PC=None, now=0):
+        blockAddr = address // self.block
+        tags = self.sets[blockAddr % self.setCount]
+        tag = blockAddr // self.setCount
+        wait = 0
+        # 第一次用到预取的块对预取器来说仍然是缺失，这样顺序访问可以一直预取下去
+        miss = False
+        if tag in tags:
+            tags.remove(tag)
+            tags.append(tag)
+            self.hits += 1
+            hit = True
+            ready = self.prefetched.pop(blockAddr, None)
+            if ready is not None:
+                miss = True
+                self.usefulPrefetches += 1
+                if ready > now:
+                    self.latePrefetches += 1
+                    wait = ready - now
+        else:
+            self.misses += 1
+            self.fill(blockAddr)
+            hit = False
+            miss = True
+            wait = self.fillLatency
+        if self.prefetcher is not None:
+            for target in self.prefetcher.observe(PC, address, self.block, miss):
+                self.prefetch(target // self.block, now)
+        return hit, wait
+
+    # 把一块放进缓存，替换最久没有使用的块
+    def fill(self, blockAddr):
+        index = blockAddr % self.setCount
+        tags = self.sets[index]
+        if len(tags) >= self.ways:
+            victim = tags.pop(0) * self.setCount + index
+            # 预取进来一直没有用到就被替换了
+            self.prefetched.pop(victim, None)
+        tags.append(blockAddr // self.setCount)
+
+    # 已经在缓存里的块不再预取
+    def prefetch(self, blockAddr, now):
+        if blockAddr < 0 or blockAddr // self.setCount in self.sets[blockAddr % self.setCount]:
+            return
+        self.prefetches += 1
+        self.fill(blockAddr)
+        self.prefetched[blockAddr] = now + self.fillLatency
+
+    def stats(self):
+        accesses = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "missRate": self.misses / accesses if accesses else None,
+        }
+        if self.prefetcher is not None:
+            useful = self.usefulPrefetches
+            stats["prefetch"] = {
+                "issued": self.prefetches,
+                "useful": useful,
+                "late": self.latePrefetches,
+                # 没有预取时会缺失的访问中被预取消除的比例
+                "coverage": useful / (useful + self.misses) if useful + self.misses else None,
+                # 预取的块中被用到的比例
+                "accuracy": useful / self.prefetches if self.prefetches else None,
+                # 用到的预取块中访问时已经调入完成的比例
+                "timeliness": (useful - self.latePrefetches) / useful if useful else None,
+            }
+        return stats
+
+
+# 预取器的种类，""表示不预取
+PREFETCHERS = ["", "nextline", "stride"]
+
+
+# *****************************
+# 下一块预取
+# 缺失或者第一次用到预取的块时预取后面degree块（带标记的顺序预取）
+# *****************************
+class NextLinePrefetcher:
+    def __init__(self, degree=1):
+        self.degree = degree
+
+    def reset(self):
+        pass
+
+    def observe(self, PC, address, block, miss):
+        if not miss:
+            return ()
+        return [address + block * i for i in range(1, self.degree + 1)]
+
+
+# *****************************
+# 按PC索引的步长预取
+# 表中每项记录[PC, 上一次的地址, 步长]，连续两次步长相同之后
+# 预取地址+步长*(distance..distance+degree-1)
+# 只用带PC的访问训练，没有PC的访问不预取
+# *****************************
+class StridePrefetcher:
+    def __init__(self, entries=64, degree=1, distance=1):
+        self.entries = entries
+        self.degree = degree
+        self.distance = distance
+        self.reset()
+
+    def reset(self):
+        self.table = [None] * self.entries
+
+    def observe(self, PC, address, block, miss):
+        if PC is None:
+            return ()
+        index = (PC >> 2) % self.entries
+        entry = self.table[index]
+        if entry is None or entry[0] != PC:
+            self.table[index] = [PC, address, 0]
+            return ()
+        stride = address - entry[1]
+        entry[1] = address
+        if stride == 0 or stride != entry[2]:
+            entry[2] = stride
+            return ()
+        return [address + stride * (self.distance + i) for i in range(self.degree)]
+
+
+def makePrefetcher(name, entries=64, degree=1, distance=1):
+    if name not in PREFETCHERS:
+        raise MyError(f"prefetch_error: invalid prefetcher({name})")
+    if degree < 1 or distance < 1:
+        raise MyError(f"prefetch_error: invalid degree({degree}) or distance({distance})")
+    if name == "nextline":
+        return NextLinePrefetcher(degree)
+    if name == "stride":
+        return StridePrefetcher(entries, degree, distance)
+    return None
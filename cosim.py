@@ -0,0 +1,179 @@
+import PIPE
+import SEQ
+from assembler import disassemble
+
+
+# 单个位置对摘要的贡献，值为0的位置不参与，所以全0的存储摘要为0
+def _mix(index, val):
+    return hash((index, val)) if val else 0
+
+
+# 对整个数组计算摘要，只在加载数据和报告分歧时使用
+def digest(mem):
+    result = 0
+    for i in range(len(mem)):
+        result ^= _mix(i, mem[i])
+    return result
+
+
+# *****************************
+# 带增量摘要的寄存器堆和数据内存
+# 每次写只更新被写位置的贡献，比较两个模型的状态只需比较两个整数
+# *****************************
+class PipeRegFile(PIPE.RegFile):
+    def __init__(self):
+        super().__init__()
+        self.digest = 0
+
+    def write(self, dstE, valE, dstM, valM):
+        old = [(dst, self.reg[dst]) for dst in (dstE, dstM) if dst is not None]
+        super().write(dstE, valE, dstM, valM)
+        for dst, val in old:
+            self.digest ^= _mix(dst, val) ^ _mix(dst, self.reg[dst])
+
+
+class SeqRegFile(SEQ.RegFile):
+    def __init__(self):
+        super().__init__()
+        self.digest = 0
+
+    def write(self, dstE, valE, dstM, valM):
+        old = [(dst, self.reg[dst]) for dst in (dstE, dstM) if dst != 0]
+        super().write(dstE, valE, dstM, valM)
+        for dst, val in old:
+            self.digest ^= _mix(dst, val) ^ _mix(dst, self.reg[dst])
+
+
+class PipeDMemory(PIPE.DMemory):
+    def __init__(self, size):
+        super().__init__(size)
+        self.digest = 0
+
+    def loadData(self, data):
+        super().loadData(data)
+        self.digest = digest(self.mem)
+
+    def access(self, read, write, address, data):
+        if not write:
+            return super().access(read, write, address, data)
+        index = address // 4
+        old = self.mem[index] if 0 <= index < len(self.mem) else 0
+        result = super().access(read, write, address, data)
+        self.digest ^= _mix(index, old) ^ _mix(index, self.mem[index])
+        return result
+
+
+class SeqDMemory(SEQ.DMemory):
+    def __init__(self, size):
+        super().__init__(size)
+        self.digest = 0
+
+    def loadData(self, data):
+        super().loadData(data)
+        self.digest = digest(self.mem)
+
+    def access(self, read, write, address, data):
+        if not write:
+            return super().access(read, write, address, data)
+        index = address // 4
+        old = self.mem[index] if 0 <= index < len(self.mem) else 0
+        result = super().access(read, write, address, data)
+        self.digest ^= _mix(index, old) ^ _mix(index, self.mem[index])
+        return result
+
+
+# 第一次分歧的信息
+class Divergence:
+    def __init__(self, reason, clock, retired, PC, IR, seqPC, registers, memory):
+        self.reason = reason
+        self.clock = clock
+        self.retired = retired
+        self.PC = PC
+        self.IR = IR
+        self.seqPC = seqPC
+        # [(编号, PIPE的值, SEQ的值)]
+        self.registers = registers
+        # [(地址, PIPE的值, SEQ的值)]
+        self.memory = memory
+
+    def __str__(self):
+        lines = [f"divergence after instruction {self.retired} (clock {self.clock}): {self.reason}",
+                 f"  PIPE PC:{self.PC}\t{disassemble(self.IR)}"]
+        if self.seqPC != self.PC:
+            lines.append(f"  SEQ  PC:{self.seqPC}")
+        for i, pipeVal, seqVal in self.registers:
+            lines.append(f"  R{i}: PIPE={pipeVal}\tSEQ={seqVal}")
+        for address, pipeVal, seqVal in self.memory:
+            lines.append(f"  0x{format(address, '08x')}: PIPE={pipeVal}\tSEQ={seqVal}")
+        return "\n".join(lines)
+
+
+# *****************************
+# SEQ和PIPE锁步运行
+# PIPE每在写回阶段完成一条指令，SEQ执行一条指令，然后比较体系结构状态
+# *****************************
+class CoSimulator:
+    def __init__(self, imemSize=256, dmemSize=1024, delaySlot=False):
+        self.pipe = PIPE.Simulator(PIPE.IMemory(imemSize), PipeDMemory(dmemSize), PipeRegFile(),
+                                   delaySlot=delaySlot)
+        self.seq = SEQ.Simulator(SEQ.IMemory(imemSize), SeqDMemory(dmemSize), SeqRegFile(),
+                                 delaySlot=delaySlot)
+        self.pipe.retireHook = self.onRetire
+        self.retired = 0
+        self.divergence = None
+
+    def load(self, program, data=None, PC=0):
+        self.pipe.load(program, data, PC)
+        self.seq.load(program, data, PC)
+        self.retired = 0
+        self.divergence = None
+
+    def onRetire(self, PC, IR):
+        if self.divergence is not None:
+            return
+        seqPC = self.seq.PC
+        if self.seq.halted:
+            self.report("SEQ halted", PC, IR, seqPC)
+            return
+        self.seq.tick()
+        self.retired += 1
+        if seqPC != PC:
+            self.report("PC differs", PC, IR, seqPC)
+        elif self.pipe.regFile.digest != self.seq.regFile.digest:
+            self.report("registers differ", PC, IR, seqPC)
+        elif self.pipe.dmem.digest != self.seq.dmem.digest:
+            self.report("memory differs", PC, IR, seqPC)
+
+    # 发现分歧时才逐个比较寄存器和内存，找出不同的位置
+    def report(self, reason, PC, IR, seqPC):
+        pipeReg, seqReg = self.pipe.regFile.reg, self.seq.regFile.reg
+        registers = [(i, pipeReg[i], seqReg[i])
+                     for i in range(len(pipeReg)) if pipeReg[i] != seqReg[i]]
+        pipeMem, seqMem = self.pipe.dmem.mem, self.seq.dmem.mem
+        memory = [(i * 4, pipeMem[i], seqMem[i])
+                  for i in range(min(len(pipeMem), len(seqMem))) if pipeMem[i] != seqMem[i]]
+        self.divergence = Divergence(reason, self.pipe.clock, self.retired, PC, IR, seqPC, registers, memory)
+
+    # 运行到PIPE停机、出现分歧或者达到最大时钟数，返回第一次分歧，没有分歧返回None
+    def run(self, max_cycles=10000):
+        pipe = self.pipe
+        while not pipe.halted and pipe.clock < max_cycles and self.divergence is None:
+            pipe.tick()
+        # PIPE停机时写回阶段是syscall，SEQ也应该正好执行到这条syscall
+        if pipe.halted and self.divergence is None:
+            self.onRetire(pipe.W.PC, pipe.W.IR)
+            if self.divergence is None and not self.seq.halted:
+                self.report("SEQ did not halt", pipe.W.PC, pipe.W.IR, self.seq.PC)
+        return self.divergence
+
+
+def check(program, data=None, max_cycles=10000):
+    cosim = CoSimulator()
+    cosim.load(program, data)
+    return cosim.run(max_cycles)
+
+
+if __name__ == "__main__":
+    for name in ["program_test", "program_loop", "program_unrolling4", "program_unrolling10"]:
+        divergence = check(getattr(PIPE, name))
+        print(f"{name}: {'ok' if divergence is None else divergence}")
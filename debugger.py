@@ -0,0 +1,190 @@
+from PIPE import MyError
+from assembler import disassemble
+
+# 数据断点的访问类型
+WATCH_READ = 1
+WATCH_WRITE = 2
+
+
+# 一次停下的原因
+class Stop:
+    def __init__(self, reason, clock, PC=None, IR=None, location=None, value=None):
+        self.reason = reason
+        self.clock = clock
+        self.PC = PC
+        self.IR = IR
+        # 寄存器编号或者内存地址
+        self.location = location
+        self.value = value
+
+    def __str__(self):
+        text = f"{self.reason} (clock {self.clock})"
+        if self.reason == "breakpoint":
+            text += f": PC:{self.PC}\t{disassemble(self.IR)}"
+        elif self.reason == "register":
+            text += f": R{self.location}={self.value}"
+        elif self.reason in ["read", "write"]:
+            text += f": 0x{format(self.location, '08x')}={self.value}"
+        return text
+
+
+# 恢复实例上原来的方法，previous为None时恢复类上的方法
+def restoreMethod(obj, name, previous):
+    if previous is None:
+        obj.__dict__.pop(name, None)
+    else:
+        setattr(obj, name, previous)
+
+
+# 检查断点的地址，返回位图的下标
+def slot(kind, address, size):
+    if address < 0 or address >= size * 4:
+        raise MyError(f"{kind}_error: address({address}) out of length of {kind}({size * 4})")
+    if address % 4 != 0:
+        raise MyError(f"{kind}_error: address({address}) is not a multiple of four")
+    return address // 4
+
+
+# *****************************
+# 断点和数据断点
+# PC、寄存器和内存地址都用预先计算的位图标记，只有被标记的位置需要额外判断；
+# 没有设置任何断点时不安装任何钩子，模拟器以原来的速度运行
+# *****************************
+class Debugger:
+    def __init__(self, sim):
+        self.sim = sim
+        # PC断点，每条指令一个字节
+        self.breakpoints = bytearray(len(sim.imem))
+        self.breakpointCount = 0
+        # 寄存器条件：位掩码和每个寄存器的条件
+        self.registerMask = 0
+        self.registerConditions = {}
+        # 数据断点，每个字一个字节，值为WATCH_READ|WATCH_WRITE的组合
+        self.watchpoints = bytearray(len(sim.dmem))
+        self.watchpointCount = 0
+        self.stop = None
+        self.retireHook = None
+        # 安装在实例上的钩子和安装前实例上的方法（None表示类上的方法）
+        self.registerHook = self.previousWrite = None
+        self.memoryHook = self.previousAccess = None
+        self.install()
+
+    # *****************************
+    # 设置和删除断点
+    # *****************************
+    def breakAt(self, PC):
+        i = slot("imem", PC, len(self.breakpoints))
+        if not self.breakpoints[i]:
+            self.breakpoints[i] = 1
+            self.breakpointCount += 1
+        self.install()
+
+    def clearBreak(self, PC):
+        i = slot("imem", PC, len(self.breakpoints))
+        if self.breakpoints[i]:
+            self.breakpoints[i] = 0
+            self.breakpointCount -= 1
+        self.install()
+
+    # 寄存器被写入满足条件的值时停下，condition是整数或者判断函数
+    def breakOnRegister(self, reg, condition):
+        if not callable(condition):
+            value = condition
+            condition = lambda val: val == value
+        self.registerConditions[reg] = condition
+        self.registerMask |= 1 << reg
+        self.install()
+
+    def clearRegister(self, reg):
+        self.registerConditions.pop(reg, None)
+        self.registerMask &= ~(1 << reg)
+        self.install()
+
+    def watch(self, address, kind=WATCH_WRITE):
+        i = slot("dmem", address, len(self.watchpoints))
+        if not self.watchpoints[i]:
+            self.watchpointCount += 1
+        self.watchpoints[i] |= kind
+        self.install()
+
+    def unwatch(self, address):
+        i = slot("dmem", address, len(self.watchpoints))
+        if self.watchpoints[i]:
+            self.watchpoints[i] = 0
+            self.watchpointCount -= 1
+        self.install()
+
+    # *****************************
+    # 钩子：只在有对应断点时安装在实例上，包装安装时实例上的方法，这样可以和TimeTravel、MemoryTracer同时使用；
+    # 断点全部删除后恢复原来的方法，之后又有别的钩子包装了这个钩子时保留它（没有断点时直接调用原来的方法）
+    # *****************************
+    def install(self):
+        sim = self.sim
+        if self.breakpointCount and sim.retireHook != self.onRetire:
+            self.retireHook = sim.retireHook
+            sim.retireHook = self.onRetire
+        elif not self.breakpointCount and sim.retireHook == self.onRetire:
+            sim.retireHook = self.retireHook
+            self.retireHook = None
+
+        regFile = sim.regFile
+        if self.registerMask and self.registerHook is None:
+            self.previousWrite = regFile.__dict__.get("write")
+            self.registerHook = regFile.write = self.makeRegisterWrite(regFile)
+        elif not self.registerMask and regFile.__dict__.get("write") is self.registerHook is not None:
+            restoreMethod(regFile, "write", self.previousWrite)
+            self.registerHook = self.previousWrite = None
+
+        dmem = sim.dmem
+        if self.watchpointCount and self.memoryHook is None:
+            self.previousAccess = dmem.__dict__.get("access")
+            self.memoryHook = dmem.access = self.makeMemoryAccess(dmem)
+        elif not self.watchpointCount and dmem.__dict__.get("access") is self.memoryHook is not None:
+            restoreMethod(dmem, "access", self.previousAccess)
+            self.memoryHook = self.previousAccess = None
+
+    def onRetire(self, PC, IR):
+        if self.retireHook is not None:
+            self.retireHook(PC, IR)
+        if self.breakpoints[PC >> 2] and self.stop is None:
+            self.stop = Stop("breakpoint", self.sim.clock, PC, IR)
+
+    def makeRegisterWrite(self, regFile):
+        write = regFile.write
+
+        def checkedWrite(dstE, valE, dstM, valM):
+            write(dstE, valE, dstM, valM)
+            for dst in (dstE, dstM):
+                # PIPE用None、SEQ用0表示不写寄存器
+                if dst and self.registerMask >> dst & 1 and self.stop is None \
+                        and self.registerConditions[dst](regFile.reg[dst]):
+                    self.stop = Stop("register", self.sim.clock, location=dst, value=regFile.reg[dst])
+
+        return checkedWrite
+
+    def makeMemoryAccess(self, dmem):
+        access = dmem.access
+
+        def checkedAccess(read, write, address, data):
+            result = access(read, write, address, data)
+            if (read or write) and self.watchpoints[address >> 2] and self.stop is None:
+                kind = WATCH_READ if read else WATCH_WRITE
+                if self.watchpoints[address >> 2] & kind:
+                    self.stop = Stop("read" if read else "write", self.sim.clock,
+                                     location=address, value=dmem.mem[address >> 2])
+            return result
+
+        return checkedAccess
+
+    # 运行到断点、停机或者达到最大时钟数，返回停下的原因，没有命中断点返回None
+    def run(self, max_cycles=10000):
+        sim = self.sim
+        self.stop = None
+        if not (self.breakpointCount or self.registerMask or self.watchpointCount):
+            sim.run(max_cycles)
+            return None
+        while not sim.halted and sim.clock < max_cycles:
+            sim.tick()
+            if self.stop is not None:
+                return self.stop
+        return None
@@ -0,0 +1,288 @@
+import argparse
+import json
+import sys
+
+import PIPE
+from PIPE import decode, ALU_fun, ALUNOP, ILW, ISW, MyError
+from main import PROGRAMS, DATA, loadProgram, loadData
+
+# 统计的事件
+# fetch: 读指令内存，regRead/regWrite: 寄存器堆的读口和写口，alu: ALU运算，
+# forward: 转发多路选择器选中转发通路（没有选寄存器堆），memRead/memWrite: 读写数据内存，
+# latch: 写流水线寄存器（停顿的寄存器不写）
+EVENTS = ["fetch", "regRead", "regWrite", "alu", "forward", "memRead", "memWrite", "latch"]
+STAGES = ["F", "D", "E", "M", "W"]
+# 每个阶段每个周期的状态：有指令并且前进、有指令但是停顿、气泡、取到的指令被丢弃（只有取指阶段）
+STATES = ["busy", "stall", "idle", "squash"]
+# 转发的来源，和FwdA/FwdB的判断顺序相同
+PATHS = ["e", "m", "M", "W"]
+
+# 每个事件的动态能量（pJ）和每个周期的静态能量（pJ），只用于相对比较
+DEFAULT_ENERGY = {
+    "fetch": 8.0,
+    "regRead": 1.2,
+    "regWrite": 1.6,
+    "alu": 2.5,
+    "forward": 0.3,
+    "memRead": 12.0,
+    "memWrite": 14.0,
+    "latch": 0.6,
+}
+DEFAULT_LEAKAGE = 4.0
+# 时钟频率（MHz）
+DEFAULT_FREQUENCY = 500
+
+# 按IR缓存是否使用ALU
+_usesALU = {}
+
+
+def usesALU(IR):
+    used = _usesALU.get(IR)
+    if used is None:
+        opcode, _, _, _, _, funct, _, _ = decode(IR)
+        used = _usesALU[IR] = ALU_fun(opcode, funct) != ALUNOP
+    return used
+
+
+# 转发多路选择器选中的来源，None表示寄存器堆
+def forwardPath(src, E, M, W):
+    if src == E.dstE:
+        return "e"
+    if src == M.dstM:
+        return "m"
+    if src == M.dstE:
+        return "M"
+    if src == W.dstM or src == W.dstE:
+        return "W"
+    return None
+
+
+# *****************************
+# PIPE的部件活动计数
+# 安装为sim.activity，PIPE每个周期在确定控制信号之后、更新流水线寄存器之前调用record。
+# 每个事件分别记录总次数和其中浪费的次数：停顿时重复的读寄存器、ALU运算和取指，
+# 被丢弃的取指，以及写入流水线寄存器的气泡
+# lw从写缓冲转发数据时也算一次读数据内存
+# *****************************
+class ActivityCounters:
+    def __init__(self, sim):
+        self.sim = sim
+        self.reset()
+        sim.activity = self
+
+    def reset(self):
+        self.cycles = 0
+        self.events = dict.fromkeys(EVENTS, 0)
+        self.wasted = dict.fromkeys(EVENTS, 0)
+        self.stages = {stage: dict.fromkeys(STATES, 0) for stage in STAGES}
+        self.paths = dict.fromkeys(PATHS, 0)
+
+    def detach(self):
+        if self.sim.activity is self:
+            self.sim.activity = None
+
+    def record(self, W, M, E, D, F, d_srcA, d_srcB, accessed, M_wait, D_stall, D_bubble, E_bubble, F_stall):
+        events, wasted, stages = self.events, self.wasted, self.stages
+        self.cycles += 1
+        # 写回阶段
+        if W.PC is None:
+            stages["W"]["idle"] += 1
+        else:
+            stages["W"]["busy"] += 1
+            events["regWrite"] += (W.dstE is not None) + (W.dstM is not None)
+        # 写回寄存器每个周期都写，访存没有完成时写入气泡
+        events["latch"] += 1
+        if M_wait or M.PC is None:
+            wasted["latch"] += 1
+
+        # 访存阶段
+        if M.PC is None:
+            stages["M"]["idle"] += 1
+        else:
+            stages["M"]["stall" if M_wait else "busy"] += 1
+            if accessed:
+                opcode = M.IR >> 26
+                if opcode == ILW:
+                    events["memRead"] += 1
+                elif opcode == ISW:
+                    events["memWrite"] += 1
+
+        # 执行阶段，访存没有完成时ALU重复计算
+        if E.PC is None:
+            stages["E"]["idle"] += 1
+        else:
+            stages["E"]["stall" if M_wait else "busy"] += 1
+            if usesALU(E.IR):
+                events["alu"] += 1
+                if M_wait:
+                    wasted["alu"] += 1
+        # 访存寄存器接收执行阶段的指令
+        if not M_wait:
+            events["latch"] += 1
+            if E.PC is None:
+                wasted["latch"] += 1
+
+        # 译码阶段，停顿时重复读寄存器堆和选择转发
+        if D.PC is None:
+            stages["D"]["idle"] += 1
+        else:
+            stages["D"]["stall" if D_stall else "busy"] += 1
+            for src in (d_srcA, d_srcB):
+                if src is None:
+                    continue
+                events["regRead"] += 1
+                path = forwardPath(src, E, M, W)
+                if path is not None:
+                    events["forward"] += 1
+                    self.paths[path] += 1
+                if D_stall:
+                    wasted["regRead"] += 1
+                    if path is not None:
+                        wasted["forward"] += 1
+        # 执行寄存器：加载使用冒险时写入气泡
+        if not M_wait:
+            events["latch"] += 1
+            if E_bubble or D.PC is None:
+                wasted["latch"] += 1
+
+        # 取指阶段，停顿时重复取指，译码阶段是跳转指令时取到的指令被丢弃
+        if F.PC is None:
+            stages["F"]["idle"] += 1
+        else:
+            events["fetch"] += 1
+            if F_stall:
+                stages["F"]["stall"] += 1
+                wasted["fetch"] += 1
+            elif D_bubble:
+                stages["F"]["squash"] += 1
+                wasted["fetch"] += 1
+            else:
+                stages["F"]["busy"] += 1
+        # 译码寄存器和取指寄存器
+        if not D_stall:
+            events["latch"] += 1
+            if D_bubble:
+                wasted["latch"] += 1
+        if not F_stall:
+            events["latch"] += 1
+
+    # 每个阶段有指令并且前进的周期比例
+    def utilization(self):
+        return {stage: counts["busy"] / self.cycles if self.cycles else None
+                for stage, counts in self.stages.items()}
+
+    def stats(self):
+        return {
+            "cycles": self.cycles,
+            "events": dict(self.events),
+            "wasted": dict(self.wasted),
+            "stages": {stage: dict(counts) for stage, counts in self.stages.items()},
+            "forwarding": dict(self.paths),
+            "utilization": self.utilization(),
+        }
+
+
+# *****************************
+# 能量和功耗估计
+# 动态能量是各事件次数乘以每次的能量，静态能量和周期数成正比
+# 返回的能量单位为nJ，时间为us，功耗为mW，能量延迟积为nJ*us
+# *****************************
+class EnergyModel:
+    def __init__(self, energy=None, leakage=DEFAULT_LEAKAGE, frequency=DEFAULT_FREQUENCY):
+        energy = energy or {}
+        for event in energy:
+            if event not in DEFAULT_ENERGY:
+                raise MyError(f"energy_error: unknown event({event})")
+        self.energy = dict(DEFAULT_ENERGY, **energy)
+        self.leakage = leakage
+        self.frequency = frequency
+
+    def estimate(self, counters):
+        dynamic = sum(counters.events[event] * self.energy[event] for event in EVENTS) / 1000
+        wasted = sum(counters.wasted[event] * self.energy[event] for event in EVENTS) / 1000
+        static = counters.cycles * self.leakage / 1000
+        total = dynamic + static
+        time = counters.cycles / self.frequency
+        return {
+            "energy": total,
+            "dynamicEnergy": dynamic,
+            "staticEnergy": static,
+            "wastedEnergy": wasted,
+            "time": time,
+            "power": total / time if time else None,
+            "edp": total * time,
+            "breakdown": {event: counters.events[event] * self.energy[event] / 1000 for event in EVENTS},
+        }
+
+
+# 能量表文件：JSON对象，事件名 -> pJ，"leakage"是每个周期的静态能量
+def loadEnergyTable(path):
+    with open(path) as f:
+        table = json.load(f)
+    leakage = table.pop("leakage", DEFAULT_LEAKAGE)
+    return table, leakage
+
+
+# 运行一个程序并统计活动，返回(统计信息, 计数器)
+def measure(program, data=None, max_cycles=100000, **options):
+    sim = PIPE.Simulator(**options)
+    sim.load(program, data)
+    counters = ActivityCounters(sim)
+    stats = sim.run(max_cycles)
+    counters.detach()
+    return stats, counters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PIPE的部件活动、能量和能量延迟积")
+    parser.add_argument("programs", nargs="*", default=["loop", "unrolling4", "unrolling10"],
+                        help=f"比较的程序：内置程序({', '.join(PROGRAMS)})或者汇编源文件")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--energy", help="能量表文件（JSON，事件名 -> pJ，leakage为每周期静态能量）")
+    parser.add_argument("--frequency", type=float, default=DEFAULT_FREQUENCY, help="时钟频率（MHz）")
+    parser.add_argument("--load-latency", type=int, default=1, help="lw在访存阶段停留的周期数")
+    parser.add_argument("--store-latency", type=int, default=1, help="sw在访存阶段停留的周期数")
+    parser.add_argument("--store-buffer", type=int, default=0, metavar="DEPTH", help="写缓冲的项数")
+    parser.add_argument("--max-cycles", type=int, default=100000, help="最大时钟数")
+    parser.add_argument("--detail", action="store_true", help="输出每个程序的事件次数和各阶段的状态")
+    parser.add_argument("--json", action="store_true", help="以JSON输出全部结果")
+    args = parser.parse_args(argv)
+
+    energy, leakage = loadEnergyTable(args.energy) if args.energy else (None, DEFAULT_LEAKAGE)
+    model = EnergyModel(energy, leakage, args.frequency)
+    results = {}
+    for name in args.programs:
+        program = loadProgram(name)
+        data = loadData(args.data) if args.data else DATA.get(name)
+        stats, counters = measure(program, data, args.max_cycles, loadLatency=args.load_latency,
+                                  storeLatency=args.store_latency, storeBufferDepth=args.store_buffer)
+        results[name] = {"stats": stats, "activity": counters.stats(), "estimate": model.estimate(counters)}
+
+    if args.json:
+        json.dump(results, sys.stdout)
+        print()
+        return 0
+    print(f"{'program':16}{'cycles':>8}{'instr':>8}{'energy/nJ':>11}{'wasted':>8}{'power/mW':>10}"
+          f"{'EDP/nJ*us':>11}  utilization F/D/E/M/W")
+    for name, result in results.items():
+        stats, estimate = result["stats"], result["estimate"]
+        utilization = "/".join(f"{value:.2f}" for value in result["activity"]["utilization"].values())
+        print(f"{name:16}{stats['cycles']:>8}{stats['instructions']:>8}{estimate['energy']:>11.2f}"
+              f"{estimate['wastedEnergy'] / estimate['energy']:>8.1%}{estimate['power']:>10.2f}"
+              f"{estimate['edp']:>11.2f}  {utilization}")
+    if args.detail:
+        for name, result in results.items():
+            activity = result["activity"]
+            print(f"\n{name}")
+            for event in EVENTS:
+                print(f"  {event:10}{activity['events'][event]:>8}  wasted {activity['wasted'][event]:>6}  "
+                      f"{result['estimate']['breakdown'][event]:>8.2f} nJ")
+            for stage in STAGES:
+                counts = activity["stages"][stage]
+                print(f"  {stage}: " + " ".join(f"{state}={counts[state]}" for state in STATES))
+            print("  forwarding: " + " ".join(f"{path}={count}" for path, count in activity["forwarding"].items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
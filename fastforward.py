@@ -0,0 +1,267 @@
+import PIPE
+from PIPE import decode, SrcA, SrcB, DstE, DstM, SignExtend, Comp, Cond, Add, SelA, Execute, AccessMemory, MyError
+from PIPE import RTYPE, ISW, IJ, IJAL, IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE, FJR, FSYS
+
+BRANCH = [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]
+
+# 不知道的PC，不等于任何指令的PC
+UNKNOWN = -1
+
+# fetchLog超过这个长度还没有找到循环就重新开始记录
+LOG_LIMIT = 1 << 16
+
+# 同一个控制状态快进失败这么多次以后不再尝试
+FAILURE_LIMIT = 8
+
+
+# *****************************
+# 稳态循环的快进
+# 向后跳转的指令进入译码阶段时记录流水线的控制状态（各阶段的PC和访存剩余周期），
+# 同一个控制状态第二次出现说明两次之间是一轮循环，这一轮的周期数、退休指令数和进入译码阶段的指令序列都已知。
+# 之后的迭代只要进入流水线的指令序列相同，时序就完全相同，所以逐条函数式执行指令并检查PC序列，
+# 每完成一轮就把时钟加上一轮的周期数；序列不同时回到最后一轮结束的位置，
+# 按函数式执行的结果恢复流水线寄存器里的数据，然后继续逐周期模拟。
+# 时钟数、退休指令数和最终状态都和逐周期模拟相同。
+# 访存周期和地址有关（重写了memoryLatency）、使用写缓冲、统计部件活动、提供syscall服务
+# 或者安装了retireHook时不快进。
+# *****************************
+class FastForward:
+    def __init__(self, sim):
+        self.sim = sim
+        self.skips = 0
+        self.skippedCycles = 0
+        self.skippedInstructions = 0
+        # 控制状态 -> [失败次数, 还要跳过的次数]，快进成功以后也保留
+        self.backoff = {}
+        self.reset()
+
+    def reset(self):
+        # 控制状态 -> (时钟, 退休指令数, 访存停顿数, fetchLog的长度)
+        self.seen = {}
+        self.sim.fetchLog = []
+
+    @property
+    def enabled(self):
+        sim = self.sim
+        return sim.retireHook is None and sim.storeBuffer is None and sim.activity is None \
+            and sim.syscalls is None and type(sim).memoryLatency is PIPE.Simulator.memoryLatency \
+            and "access" not in vars(sim.imem) and "access" not in vars(sim.dmem)
+
+    # 决定之后时序的全部状态：流水线寄存器里的IR由PC决定
+    def controlState(self):
+        sim = self.sim
+        return sim.memoryWait, sim.F.PC, sim.D.PC, sim.E.PC, sim.M.PC, sim.W.PC
+
+    def run(self, max_cycles=10000):
+        sim = self.sim
+        self.backoff = {}
+        self.reset()
+        enabled = self.enabled
+        while not sim.halted and sim.clock < max_cycles:
+            log = sim.fetchLog
+            count = len(log)
+            sim.tick()
+            if enabled and count and len(log) > count and log[-1] < log[count - 1]:
+                self.observe(max_cycles)
+        sim.fetchLog = None
+        return self.stats()
+
+    def stats(self):
+        stats = self.sim.stats()
+        stats["fastForward"] = {
+            "skips": self.skips,
+            "cycles": self.skippedCycles,
+            "instructions": self.skippedInstructions,
+        }
+        return stats
+
+    # 向后跳转之后
+    def observe(self, max_cycles):
+        sim = self.sim
+        log = sim.fetchLog
+        key = self.controlState()
+        previous = self.seen.get(key)
+        self.seen[key] = (sim.clock, sim.retired, sim.memoryStalls, len(log))
+        if previous is None:
+            if len(log) > LOG_LIMIT:
+                self.reset()
+            return
+        backoff = self.backoff.get(key)
+        if backoff is not None and (backoff[0] >= FAILURE_LIMIT or backoff[1] > 0):
+            backoff[1] -= 1
+            return
+        clock, retired, memoryStalls, index = previous
+        path = log[index:]
+        cycles = sim.clock - clock
+        if len(path) != sim.retired - retired or not path:
+            return
+        iterations = self.skip(path, (max_cycles - sim.clock) // cycles)
+        if not iterations:
+            failures = backoff[0] + 1 if backoff is not None else 1
+            self.backoff[key] = [failures, (1 << failures) - 1]
+            return
+        # 失败次数只算连续的
+        self.backoff.pop(key, None)
+        sim.clock += iterations * cycles
+        sim.retired += iterations * len(path)
+        sim.memoryStalls += iterations * (sim.memoryStalls - memoryStalls)
+        self.skips += 1
+        self.skippedCycles += iterations * cycles
+        self.skippedInstructions += iterations * len(path)
+        # 跳过的指令不在fetchLog里，以前的记录不能再用
+        self.reset()
+
+    # *****************************
+    # 函数式执行
+    # 每条指令返回(valA, valB, valE, valM, 寄存器撤销记录, 内存撤销记录)
+    # valA是SelA之后的值，和流水线寄存器里的字段一致
+    # *****************************
+    def next(self, PC, control, target):
+        if self.pending is not None:
+            self.nextPC, self.pending = self.pending, None
+        elif not control:
+            self.nextPC = PC + 4
+        elif self.delaySlot:
+            # 先执行延迟槽
+            self.nextPC, self.pending = PC + 4, target if target is not None else PC + 8
+        else:
+            self.nextPC = target if target is not None else PC + 4
+
+    def write(self, dstE, valE, dstM, valM):
+        regs = self.regs
+        regUndo = []
+        if dstE is not None:
+            regUndo.append((dstE, regs[dstE]))
+            regs[dstE] = valE
+        if dstM is not None:
+            regUndo.append((dstM, regs[dstM]))
+            regs[dstM] = valM
+        return regUndo
+
+    def execute(self, PC):
+        sim = self.sim
+        regs = self.regs
+        try:
+            IR = sim.imem.access(PC)
+            opcode, rs, rt, rd, _, funct, imm, address = decode(IR)
+            if opcode == RTYPE and funct == FSYS:
+                return None
+            srcA = SrcA(opcode, funct, rs)
+            srcB = SrcB(opcode, funct, rt)
+            valA = regs[srcA] if srcA is not None else None
+            valB = regs[srcB] if srcB is not None else None
+            sImm = SignExtend(imm)
+            cnd = Cond(opcode, funct, *Comp(opcode, funct, valA, valB))
+            NPC = PC + 4
+            valA = SelA(IR, valA, NPC, self.delaySlot)
+            valE = Execute(IR, valA, valB, sImm)
+            memUndo = None
+            if opcode == ISW:
+                memUndo = (valE // 4, sim.dmem.mem[valE // 4])
+            valM = AccessMemory(IR, sim.dmem, valE, valB)
+        except (MyError, IndexError):
+            return None
+        regUndo = self.write(DstE(opcode, funct, rt, rd), valE, DstM(opcode, funct, rt, rd), valM)
+        if opcode in BRANCH:
+            self.next(PC, True, Add(opcode, NPC, sImm) if cnd else None)
+        elif opcode in [IJ, IJAL]:
+            self.next(PC, True, NPC & 0b11110000000000000000000000000000 | (address << 2))
+        elif opcode == RTYPE and funct == FJR:
+            self.next(PC, True, valA)
+        else:
+            self.next(PC, False, None)
+        return valA, valB, valE, valM, regUndo, memUndo
+
+    # 已经写回或者已经访存的指令：结果取自流水线寄存器，不再访存
+    # 条件分支和jr的操作数已经不在流水线里，它们决定的PC是UNKNOWN
+    def complete(self, stage):
+        sim = self.sim
+        opcode, _, _, _, _, funct, _, address = decode(stage.IR)
+        if stage is sim.W:
+            valE, valM = stage.valE, stage.valM
+        else:
+            valE, valM = stage.valE, sim.memoryValue
+        regUndo = self.write(stage.dstE, valE, stage.dstM, valM)
+        if opcode in BRANCH or opcode == RTYPE and funct == FJR:
+            self.next(stage.PC, True, UNKNOWN)
+        elif opcode in [IJ, IJAL]:
+            self.next(stage.PC, True, stage.PC + 4 & 0b11110000000000000000000000000000 | (address << 2))
+        else:
+            self.next(stage.PC, False, None)
+        return None, None, valE, valM, regUndo, None
+
+    # 从后往前撤销，protected里的指令只撤销寄存器
+    def undo(self, records, protected=()):
+        regs = self.regs
+        for i in range(len(records) - 1, -1, -1):
+            _, _, _, _, regUndo, memUndo = records[i]
+            for index, old in reversed(regUndo):
+                regs[index] = old
+            if memUndo is not None and i not in protected:
+                self.sim.dmem.poke(*memUndo)
+
+    # *****************************
+    # 从当前周期开始跳过最多limit轮循环，返回跳过的轮数
+    # 函数式执行从写回阶段的指令开始，先执行流水线里的指令，再按path逐条检查和执行。
+    # 落地时流水线里的指令和现在PC相同、位置相同，
+    # 寄存器堆是写回阶段的指令之前的状态，内存包括写回阶段（和已经访存的访存阶段）的指令，
+    # 为了检查这些指令决定的下一个PC，要多执行一条指令再撤销
+    # *****************************
+    def skip(self, path, limit):
+        if limit < 1:
+            return 0
+        sim = self.sim
+        W, M, E = sim.W, sim.M, sim.E
+        accessed = sim.memoryWait > 0
+        window = [stage for stage in (W, M, E, sim.D) if stage.PC is not None]
+        if not window:
+            return 0
+        done = [stage is W or stage is M and accessed for stage in window]
+        protected = [i for i in range(len(window)) if done[i]]
+        self.regs = list(sim.regFile.reg)
+        self.delaySlot = sim.delaySlot
+        self.pending = None
+        records = []
+        for stage, completed in zip(window, done):
+            record = self.complete(stage) if completed else self.execute(stage.PC)
+            if record is None:
+                self.undo(records)
+                return 0
+            records.append(record)
+
+        size = len(window)
+        k = len(path)
+        PC = self.nextPC
+        executed = 0
+        iterations = 0
+        while iterations < limit and PC == path[executed % k]:
+            record = self.execute(PC)
+            if record is None:
+                break
+            records.append(record)
+            PC = self.nextPC
+            executed += 1
+            # 已经检查到第n轮之后的第一条指令，并且流水线里的指令全部换过
+            n = (executed - 1) // k
+            if n and (executed - 1) % k == 0 and n * k >= size:
+                iterations = n
+                del records[:-size - 1]
+
+        if not iterations:
+            self.undo(records)
+            return 0
+        self.undo(records, protected)
+        regFile = sim.regFile
+        for i, value in enumerate(self.regs):
+            if regFile.reg[i] != value:
+                regFile.poke(i, value)
+        for stage, (valA, valB, valE, valM, _, _) in zip(window, records):
+            if stage is W:
+                W.valE, W.valM = valE, valM
+            elif stage is M:
+                M.valE, M.valB = valE, valB
+                if accessed:
+                    sim.memoryValue = valM
+            elif stage is E:
+                E.valA, E.valB = valA, valB
+        return iterations
@@ -0,0 +1,206 @@
+import argparse
+import contextlib
+import json
+import sys
+
+import PIPE
+import SEQ
+from cosim import CoSimulator
+from runcache import RunCache
+from memtrace import MemoryTracer
+from tracefile import CODECS
+from fastforward import FastForward
+from syscalls import SyscallHandler, ConsoleDevice
+from debugger import Debugger, WATCH_READ, WATCH_WRITE
+from assembler import assemble_source, schedule, unroll, fill_delay_slots
+
+# 内置程序
+PROGRAMS = {
+    "test": PIPE.program_test,
+    "loop": PIPE.program_loop,
+    "unrolling4": PIPE.program_unrolling4,
+    "unrolling10": PIPE.program_unrolling10,
+    "seq": SEQ.program,
+}
+# 内置程序附带的初始数据
+DATA = {
+    "seq": SEQ.data,
+}
+
+
+# 读取程序：内置程序名或者汇编源文件
+def loadProgram(name):
+    if name in PROGRAMS:
+        return PROGRAMS[name]
+    with open(name) as f:
+        return assemble_source(f.read())
+
+
+# 读取数据文件，每行一个整数
+def loadData(path):
+    with open(path) as f:
+        return [int(line, 0) for line in f.read().split()]
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="MIPS子集处理器模拟器")
+    parser.add_argument("program", nargs="?", default="unrolling10",
+                        help=f"内置程序({', '.join(PROGRAMS)})或者汇编源文件")
+    parser.add_argument("--core", choices=["pipe", "seq"], default="pipe", help="处理器模型")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--max-cycles", type=int, default=10000, help="最大时钟数")
+    parser.add_argument("--load-latency", type=int, default=1, help="PIPE中lw在访存阶段停留的周期数")
+    parser.add_argument("--store-latency", type=int, default=1, help="PIPE中sw在访存阶段停留的周期数")
+    parser.add_argument("--store-buffer", type=int, default=0, metavar="DEPTH",
+                        help="PIPE中写缓冲的项数，sw不等写内存完成，lw可以从缓冲转发数据，0表示不用写缓冲")
+    parser.add_argument("--dump-mem", type=int, default=32, help="结束时输出的内存字数")
+    parser.add_argument("--dump", choices=["full", "changes"], default="full",
+                        help="结束时输出全部内存和寄存器，或者只输出改变过的部分（只用于PIPE）")
+    parser.add_argument("--quiet", action="store_true", help="不输出每个周期的状态和结束时的内存、寄存器")
+    parser.add_argument("--break", dest="breaks", type=lambda x: int(x, 0), action="append", default=[],
+                        metavar="PC", help="PC断点，命中时输出后继续运行")
+    parser.add_argument("--watch", type=lambda x: int(x, 0), action="append", default=[],
+                        metavar="ADDR", help="数据断点，读写该地址时输出后继续运行")
+    parser.add_argument("--unroll", type=int, default=1, metavar="FACTOR", help="运行前按FACTOR展开计数循环")
+    parser.add_argument("--schedule", action="store_true", help="运行前在基本块内调度指令，减少lw的停顿")
+    parser.add_argument("--delay-slot", action="store_true",
+                        help="跳转指令后面的一条指令总是执行，运行前自动填充延迟槽")
+    parser.add_argument("--fast-forward", action="store_true",
+                        help="PIPE检测到稳态循环时函数式执行并直接累加周期数，结果和逐周期模拟相同")
+    parser.add_argument("--mem-trace", metavar="PATH", help="把每次取指和数据访存记录到压缩的轨迹文件")
+    parser.add_argument("--mem-trace-codec", choices=list(CODECS), default="zlib", help="访存轨迹的压缩方式")
+    parser.add_argument("--cosim", action="store_true", help="SEQ和PIPE锁步运行，报告第一次分歧")
+    parser.add_argument("--run-cache", metavar="PATH",
+                        help="整次运行的结果缓存文件，命中时直接给出结束状态，不输出每个周期的状态")
+    parser.add_argument("--stats", choices=["text", "json"], default="text", help="统计信息的输出格式")
+    parser.add_argument("--syscalls", action="store_true",
+                        help="syscall按$2的服务号提供输出、读写文件描述符和周期数等服务，exit/exit2才停机")
+    parser.add_argument("--syscall-latency", type=int, default=1, help="PIPE中每次syscall服务的周期数")
+    parser.add_argument("--stdin", metavar="PATH", help="程序的标准输入文件，默认是主机的标准输入")
+    parser.add_argument("--stdout", metavar="PATH", help="程序的标准输出文件，默认是主机的标准输出")
+    args = parser.parse_args(argv)
+    # SEQ的内存和寄存器堆不记录检查点
+    if args.dump == "changes" and args.core != "pipe":
+        parser.error("--dump changes requires --core pipe")
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    program = loadProgram(args.program)
+    data = loadData(args.data) if args.data else DATA.get(args.program)
+    # 展开、调度和填充延迟槽的报告输出到stderr，不影响--stats json的输出
+    if args.unroll > 1:
+        program, report = unroll(program, args.unroll, schedule_after=False)
+        for loop in report["loops"]:
+            print(f"Unrolled: loop at PC:{loop['head']} x{loop['factor']}, "
+                  f"{loop['trip_count']} iterations, {loop['peeled']} peeled", file=sys.stderr)
+    if args.schedule:
+        program, report = schedule(program)
+        print(f"Scheduled: {report['stalls_removed']} load-use stalls removed "
+              f"({report['stalls_before']} -> {report['stalls_after']})", file=sys.stderr)
+    if args.delay_slot:
+        try:
+            program, report = fill_delay_slots(program)
+        except ValueError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 2
+        print(f"Delay slots: {report['filled']} filled, {report['nops']} nops", file=sys.stderr)
+
+    if args.cosim:
+        cosim = CoSimulator(delaySlot=args.delay_slot)
+        cosim.load(program, data)
+        divergence = cosim.run(args.max_cycles)
+        print("no divergence" if divergence is None else divergence)
+        return 0 if divergence is None else 1
+
+    # --stdin和--stdout打开的文件在返回时关闭
+    with contextlib.ExitStack() as files:
+        syscalls = None
+        if args.syscalls:
+            stdin = files.enter_context(open(args.stdin, "rb")) if args.stdin else None
+            stdout = files.enter_context(open(args.stdout, "wb")) if args.stdout else None
+            syscalls = SyscallHandler(ConsoleDevice(stdin, stdout), args.syscall_latency)
+        if args.core == "pipe":
+            sim = PIPE.Simulator(trace=not args.quiet, loadLatency=args.load_latency,
+                                 storeLatency=args.store_latency, delaySlot=args.delay_slot,
+                                 storeBufferDepth=args.store_buffer, syscalls=syscalls)
+        else:
+            sim = SEQ.Simulator(trace=not args.quiet, delaySlot=args.delay_slot, syscalls=syscalls)
+        sim.load(program, data)
+        # 运行中的错误（比如取指越过指令内存）报告出来，不输出traceback
+        try:
+            if args.breaks or args.watch:
+                debugger = Debugger(sim)
+                for PC in args.breaks:
+                    debugger.breakAt(PC)
+                for address in args.watch:
+                    debugger.watch(address, WATCH_READ | WATCH_WRITE)
+            tracer = MemoryTracer(sim, args.mem_trace, args.mem_trace_codec) if args.mem_trace else None
+            if args.breaks or args.watch:
+                stop = debugger.run(args.max_cycles)
+                while stop is not None:
+                    print(stop)
+                    stop = debugger.run(args.max_cycles)
+            # syscall的输入输出不能从缓存重现
+            if args.run_cache and not (args.breaks or args.watch or tracer or syscalls):
+                with RunCache(args.run_cache) as cache:
+                    stats = cache.run(sim, program, data, args.max_cycles)
+            elif args.fast_forward and args.core == "pipe":
+                stats = FastForward(sim).run(args.max_cycles)
+            else:
+                stats = sim.run(args.max_cycles)
+        except (PIPE.MyError, SEQ.MyError) as e:
+            if syscalls is not None:
+                syscalls.close()
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        if tracer is not None:
+            tracer.close()
+            print(f"Memory trace: {tracer.count} accesses -> {args.mem_trace}", file=sys.stderr)
+        if syscalls is not None:
+            syscalls.close()
+            # 关闭时才把缓冲的输出写给主机
+            stats["syscalls"].update(syscalls.stats())
+
+        if not args.quiet:
+            if args.core == "pipe" and args.dump == "changes":
+                sim.emitChanges()
+            elif args.core == "pipe":
+                sim.dmem.emit(args.dump_mem)
+                sim.regFile.emit()
+            else:
+                sim.dmem.emit()
+                sim.regFile.emit()
+
+        if args.stats == "json":
+            json.dump(stats, sys.stdout)
+            print()
+        else:
+            print(f"\nTotal Clock:{stats['cycles']}")
+            print(f"Instructions:{stats['instructions']}")
+            if "memoryStalls" in stats:
+                print(f"Memory Stalls:{stats['memoryStalls']}")
+            if "storeBuffer" in stats:
+                buffer = stats["storeBuffer"]
+                print(f"Store Buffer:{buffer['stores']} stores, {buffer['forwardHits']} forwarded loads, "
+                      f"{buffer['fullStalls']} full stalls, {buffer['drainStalls']} drain stalls, "
+                      f"max occupancy {buffer['maxOccupancy']}/{buffer['depth']}")
+            if "syscalls" in stats:
+                calls = stats["syscalls"]["calls"]
+                print(f"Syscalls:{sum(calls.values())} calls"
+                      + "".join(f", {name} {count}" for name, count in calls.items())
+                      + (f", {stats['syscalls']['stalls']} stall cycles" if "stalls" in stats["syscalls"] else ""))
+                print(f"Exit Code:{stats['syscalls']['exitCode']}")
+            if "fastForward" in stats:
+                print(f"Fast-forwarded:{stats['fastForward']['cycles']} cycles, "
+                      f"{stats['fastForward']['instructions']} instructions")
+
+    # 有syscall时用程序exit2的退出码作为进程的退出码
+    if "syscalls" in stats:
+        return stats["syscalls"]["exitCode"] or 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
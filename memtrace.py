@@ -0,0 +1,129 @@
+import argparse
+import sys
+
+from tracefile import TraceWriter, TraceReader
+from cache import Cache
+
+# 访存轨迹的字段：周期、种类、地址、字节数
+FIELDS = ["cycle", "kind", "address", "size"]
+
+# 访存的种类
+KIND_FETCH = 0
+KIND_LOAD = 1
+KIND_STORE = 2
+KINDS = ["fetch", "load", "store"]
+
+# 指令和数据都按字访问
+WORD = 4
+
+
+# *****************************
+# 记录访存轨迹
+# 在模拟器的指令内存和数据内存实例上包装access，每次访问追加一条(周期, 种类, 地址, 字节数)，
+# 写入时只有一次列表追加，差分和压缩在凑满一块时进行
+# PIPE每个周期取一次指令，包括停顿时重复的取指；SEQ的周期就是指令数
+# *****************************
+class MemoryTracer:
+    def __init__(self, sim, path, codec="zlib", blockSize=65536):
+        self.sim = sim
+        self.writer = TraceWriter(path, FIELDS, codec, blockSize)
+        append = self.writer.append
+        imem, dmem = sim.imem, sim.dmem
+        # 已经有的实例级包装（例如数据断点）继续生效
+        self.previous = imem.__dict__.get("access"), dmem.__dict__.get("access")
+        fetch, access = imem.access, dmem.access
+
+        def tracedFetch(address):
+            append(sim.clock, KIND_FETCH, address, WORD)
+            return fetch(address)
+
+        def tracedAccess(read, write, address, data):
+            if read or write:
+                append(sim.clock, KIND_STORE if write else KIND_LOAD, address, WORD)
+            return access(read, write, address, data)
+
+        imem.access = tracedFetch
+        dmem.access = tracedAccess
+
+    @property
+    def count(self):
+        return self.writer.count + len(self.writer.records)
+
+    # 恢复原来的access并写完最后一块
+    def close(self):
+        if self.writer.file is None:
+            return
+        for memory, previous in zip((self.sim.imem, self.sim.dmem), self.previous):
+            if previous is None:
+                memory.__dict__.pop("access", None)
+            else:
+                memory.access = previous
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# 逐条返回(周期, 种类, 地址, 字节数)
+def load(path):
+    return TraceReader(path)
+
+
+# *****************************
+# 离线的缓存实验
+# 读一遍轨迹，同时送给所有配置的缓存，kinds是送给缓存的访存种类
+# configs是Cache的参数字典，返回每个配置的统计
+# *****************************
+def simulateCaches(path, configs, kinds=(KIND_LOAD, KIND_STORE)):
+    caches = [Cache(**config) for config in configs]
+    selected = [kind in kinds for kind in range(len(KINDS))]
+    for _, kindColumn, addresses, _ in load(path).blocks():
+        for kind, address in zip(kindColumn, addresses):
+            if selected[kind]:
+                write = kind == KIND_STORE
+                for cache in caches:
+                    cache.access(address, write)
+    return [cache.stats() for cache in caches]
+
+
+# 每种访存的次数
+def summary(path):
+    counts = [0] * len(KINDS)
+    cycles = 0
+    for cycleColumn, kindColumn, _, _ in load(path).blocks():
+        for cycle, kind in zip(cycleColumn, kindColumn):
+            counts[kind] += 1
+            cycles = cycle
+    return dict(zip(KINDS, counts), cycles=cycles)
+
+
+# 命令行参数 size,block,ways
+def parseCache(text):
+    size, block, ways = (int(v) for v in text.split(","))
+    return {"size": size, "block": block, "ways": ways}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用访存轨迹离线模拟缓存")
+    parser.add_argument("trace", help="main.py --mem-trace记录的轨迹文件")
+    parser.add_argument("--cache", type=parseCache, action="append", default=[], metavar="SIZE,BLOCK,WAYS",
+                        help="缓存配置，可以重复")
+    parser.add_argument("--kind", choices=["data", "fetch", "all"], default="data", help="送给缓存的访存种类")
+    args = parser.parse_args(argv)
+
+    for name, value in summary(args.trace).items():
+        print(f"{name}: {value}")
+    kinds = {"data": (KIND_LOAD, KIND_STORE), "fetch": (KIND_FETCH,), "all": (KIND_FETCH, KIND_LOAD, KIND_STORE)}
+    configs = args.cache
+    for config, stats in zip(configs, simulateCaches(args.trace, configs, kinds[args.kind])):
+        missRate = "-" if stats["missRate"] is None else f"{stats['missRate']:.4f}"
+        print(f"size={config['size']} block={config['block']} ways={config['ways']}: "
+              f"hits={stats['hits']} misses={stats['misses']} missRate={missRate}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import argparse
+import sys
+
+import PIPE
+from PIPE import ILW, ISW
+from cache import Cache, makePrefetcher
+from memtrace import parseCache
+from main import PROGRAMS, DATA, loadProgram, loadData
+
+
+# *****************************
+# 带数据缓存和预取的PIPE
+# 重写memoryLatency：lw/sw在loadLatency/storeLatency之外还要等缓存返回的周期数，
+# 缺失是missLatency，预取的块还没有调入完成时是剩下的周期数
+# 只有lw训练步长预取器；reset时缓存和预取器一起清空
+# *****************************
+class CachedSimulator(PIPE.Simulator):
+    def __init__(self, imem=None, dmem=None, regFile=None, trace=False, loadLatency=1, storeLatency=1,
+                 delaySlot=False, storeBufferDepth=0, cacheSize=1024, cacheBlock=16, cacheWays=1, missLatency=10,
+                 prefetcher="", prefetchEntries=64, prefetchDegree=1, prefetchDistance=1):
+        # runcache.simulatorConfig用这些参数区分配置
+        self.cacheConfig = {"size": cacheSize, "block": cacheBlock, "ways": cacheWays, "missLatency": missLatency,
+                            "prefetcher": prefetcher, "entries": prefetchEntries, "degree": prefetchDegree,
+                            "distance": prefetchDistance}
+        self.cache = Cache(cacheSize, cacheBlock, cacheWays,
+                           makePrefetcher(prefetcher, prefetchEntries, prefetchDegree, prefetchDistance), missLatency)
+        super().__init__(imem, dmem, regFile, trace, loadLatency, storeLatency, delaySlot, storeBufferDepth)
+
+    def reset(self, PC=0):
+        super().reset(PC)
+        self.cache.reset()
+
+    def memoryLatency(self, IR, address):
+        latency = super().memoryLatency(IR, address)
+        opcode = IR >> 26
+        if opcode == ILW:
+            latency += self.cache.request(address, False, self.M.PC, self.clock)[1]
+        elif opcode == ISW:
+            latency += self.cache.request(address, True, None, self.clock)[1]
+        return latency
+
+    def stats(self):
+        stats = super().stats()
+        stats["cache"] = self.cache.stats()
+        return stats
+
+
+# 比例保留三位小数，没有时输出-
+def ratio(value):
+    return "-" if value is None else f"{value:.3f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="数据预取器的评估：同一组程序在不同预取器下运行PIPE")
+    parser.add_argument("programs", nargs="*", default=["loop", "unrolling4", "unrolling10"],
+                        help=f"内置程序({', '.join(PROGRAMS)})或者汇编源文件")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--cache", type=parseCache, default={"size": 1024, "block": 16, "ways": 1},
+                        metavar="SIZE,BLOCK,WAYS", help="数据缓存")
+    parser.add_argument("--miss-latency", type=int, default=10, help="缺失或者预取调入一块的周期数")
+    parser.add_argument("--prefetcher", default="none,nextline,stride", help="比较的预取器，逗号分隔")
+    parser.add_argument("--entries", type=int, default=64, help="步长预取表的项数")
+    parser.add_argument("--degree", type=int, default=1, help="每次预取的块数")
+    parser.add_argument("--distance", type=int, default=1, help="步长预取提前的步数")
+    parser.add_argument("--max-cycles", type=int, default=100000, help="最大时钟数")
+    args = parser.parse_args(argv)
+
+    prefetchers = ["" if name == "none" else name for name in args.prefetcher.split(",")]
+    print(f"{'program':16}{'prefetcher':12}{'cycles':>8}{'CPI':>8}{'missRate':>10}"
+          f"{'issued':>8}{'coverage':>10}{'accuracy':>10}{'timeliness':>12}")
+    for name in args.programs:
+        program = loadProgram(name)
+        data = loadData(args.data) if args.data else DATA.get(name)
+        for prefetcher in prefetchers:
+            sim = CachedSimulator(cacheSize=args.cache["size"], cacheBlock=args.cache["block"],
+                                  cacheWays=args.cache["ways"], missLatency=args.miss_latency,
+                                  prefetcher=prefetcher, prefetchEntries=args.entries,
+                                  prefetchDegree=args.degree, prefetchDistance=args.distance)
+            sim.load(program, data)
+            stats = sim.run(args.max_cycles)
+            cache = stats["cache"]
+            prefetch = cache.get("prefetch", {})
+            print(f"{name:16}{prefetcher or 'none':12}{stats['cycles']:>8}{ratio(stats['CPI']):>8}"
+                  f"{ratio(cache['missRate']):>10}{prefetch.get('issued', 0):>8}"
+                  f"{ratio(prefetch.get('coverage')):>10}{ratio(prefetch.get('accuracy')):>10}"
+                  f"{ratio(prefetch.get('timeliness')):>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
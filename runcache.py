@@ -0,0 +1,230 @@
+import argparse
+import array
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+import types
+import zlib
+
+import PIPE
+import SEQ
+
+# 影响运行结果的模拟器参数
+CONFIG_ATTRIBUTES = ["loadLatency", "storeLatency", "delaySlot", "storeBufferDepth"]
+
+
+# 对能转换为JSON的值计算摘要
+def digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# 模块源代码的摘要，模型改变后缓存自动失效
+def sourceDigest(*modules):
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+# 从modules出发能找到的本项目模块（与PIPE.py在同一目录下），按名字排序
+def projectModules(*modules):
+    root = os.path.dirname(os.path.abspath(PIPE.__file__))
+    found = {}
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        path = getattr(module, "__file__", None)
+        if module.__name__ in found or path is None or os.path.dirname(os.path.abspath(path)) != root:
+            continue
+        found[module.__name__] = module
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                pending.append(value)
+            elif getattr(value, "__module__", None) in sys.modules:
+                pending.append(sys.modules[value.__module__])
+    return [found[name] for name in sorted(found)]
+
+
+# 模拟器的类和部件（比如syscall服务）所在的模块，以及它们用到的本项目模块
+def simulatorModules(sim):
+    classes = list(type(sim).__mro__) + [type(value) for value in vars(sim).values()]
+    modules = [sys.modules[cls.__module__] for cls in classes if cls.__module__ in sys.modules]
+    return projectModules(*modules, PIPE, SEQ)
+
+
+# 模拟器的类型、存储大小和参数
+# 子类可以用cacheConfig给出额外的参数（比如prefetch.CachedSimulator的缓存和预取器）
+def simulatorConfig(sim):
+    config = {name: getattr(sim, name) for name in CONFIG_ATTRIBUTES if hasattr(sim, name)}
+    extra = getattr(sim, "cacheConfig", None)
+    if extra is not None:
+        config["cacheConfig"] = extra
+    config["core"] = f"{type(sim).__module__}.{type(sim).__name__}"
+    config["imem"] = len(sim.imem)
+    config["dmem"] = len(sim.dmem)
+    return config
+
+
+# 寄存器堆或者数据内存内容的摘要
+def stateDigest(values):
+    return hashlib.sha256(array.array('i', values).tobytes()).hexdigest()[:16]
+
+
+def pack(values):
+    return zlib.compress(array.array('i', values).tobytes())
+
+
+def unpack(blob):
+    values = array.array('i')
+    values.frombytes(zlib.decompress(blob))
+    return values
+
+
+# *****************************
+# 整次运行的结果缓存
+# 按(程序, 初始数据, 模拟器配置, 最大时钟数, 模拟器源代码版本)的摘要保存结束时的统计信息、
+# 源代码版本包括模拟器的类所在的模块和它们用到的本项目模块，子类或者部件的代码改变时结果也失效；
+# 寄存器堆和数据内存，命中时不再模拟
+# 保存在一个sqlite文件里，WAL模式加上忙等待超时，多个进程可以同时读写
+# 总大小超过maxBytes时按最近使用时间淘汰
+# *****************************
+class RunCache:
+    def __init__(self, path=".run-cache.sqlite", maxBytes=64 << 20, timeout=30.0):
+        self.path = path
+        self.maxBytes = maxBytes
+        # PIPE和SEQ的版本，info用来统计过期的结果
+        self.version = sourceDigest(PIPE, SEQ)
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS runs (
+            key TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            stats TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            memory BLOB NOT NULL,
+            regDigest TEXT NOT NULL,
+            memDigest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            lastUsed REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS runsLastUsed ON runs (lastUsed)")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 模拟器源代码的版本，按模块缓存
+    def simulatorVersion(self, sim):
+        modules = tuple(simulatorModules(sim))
+        version = self.versions.get(modules)
+        if version is None:
+            version = self.versions[modules] = sourceDigest(*modules)
+        return version
+
+    def key(self, sim, program, data, max_cycles, PC=0):
+        return digest([simulatorConfig(sim), list(program), list(data or []), max_cycles, PC,
+                       self.simulatorVersion(sim)])
+
+    # 返回{"stats", "registers", "memory", "regDigest", "memDigest"}，没有时返回None
+    def get(self, key):
+        row = self.db.execute("SELECT stats, registers, memory, regDigest, memDigest FROM runs WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE runs SET lastUsed = ? WHERE key = ?", (time.time(), key))
+        stats, registers, memory, regDigest, memDigest = row
+        return {
+            "stats": json.loads(stats),
+            "registers": unpack(registers),
+            "memory": unpack(memory),
+            "regDigest": regDigest,
+            "memDigest": memDigest,
+        }
+
+    def put(self, key, stats, registers, memory, version=None):
+        row = (key, version or self.version, json.dumps(stats), pack(registers), pack(memory),
+               stateDigest(registers), stateDigest(memory))
+        size = sum(len(value) for value in row)
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            self.db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            row + (size, time.time()))
+            self.evict()
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    # 删除最久没有使用的结果，直到总大小不超过maxBytes
+    def evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM runs").fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM runs ORDER BY lastUsed").fetchall():
+            self.db.execute("DELETE FROM runs WHERE key = ?", (key,))
+            total -= size
+            if total <= self.maxBytes:
+                break
+
+    def clear(self):
+        self.db.execute("DELETE FROM runs")
+
+    def info(self):
+        count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM runs").fetchone()
+        stale = self.db.execute("SELECT COUNT(*) FROM runs WHERE version != ?", (self.version,)).fetchone()[0]
+        return {"entries": count, "bytes": size, "stale": stale, "maxBytes": self.maxBytes,
+                "version": self.version}
+
+    # 加载并运行，命中时把结束时的寄存器堆和数据内存写回模拟器，返回统计信息
+    def run(self, sim, program, data=None, max_cycles=10000, PC=0):
+        sim.load(program, data, PC)
+        key = self.key(sim, program, data, max_cycles, PC)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            for i, value in enumerate(result["registers"]):
+                if sim.regFile.reg[i] != value:
+                    sim.regFile.poke(i, value)
+            for i, value in enumerate(result["memory"]):
+                if sim.dmem.mem[i] != value:
+                    sim.dmem.poke(i, value)
+            return result["stats"]
+        self.misses += 1
+        stats = sim.run(max_cycles)
+        self.put(key, stats, sim.regFile.reg, sim.dmem.mem, self.simulatorVersion(sim))
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="整次运行结果缓存的维护")
+    parser.add_argument("path", nargs="?", default=".run-cache.sqlite", help="缓存文件")
+    parser.add_argument("--clear", action="store_true", help="删除全部结果")
+    parser.add_argument("--max-bytes", type=int, default=64 << 20, help="缓存的最大字节数，超过时淘汰")
+    args = parser.parse_args(argv)
+    with RunCache(args.path, args.max_bytes) as cache:
+        if args.clear:
+            cache.clear()
+        else:
+            cache.db.execute("BEGIN IMMEDIATE")
+            cache.evict()
+            cache.db.execute("COMMIT")
+        for name, value in cache.info().items():
+            print(f"{name}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+from multiprocessing import Pool
+
+import PIPE
+import SEQ
+from PIPE import MyError
+from runcache import digest, pack, unpack
+from workloads import GENERATORS, generate
+from main import PROGRAMS, DATA, loadProgram, loadData
+
+MAGIC = b"CKPT1\n"
+# 每个检查点：指令位置、PC、压缩后的寄存器和内存的字节数
+CHECKPOINT_HEADER = struct.Struct("<qqI")
+
+
+# 函数式执行到第position条指令之前的体系结构状态
+class Checkpoint:
+    __slots__ = ('position', 'PC', 'reg', 'mem')
+
+    def __init__(self, position, PC, reg, mem):
+        self.position = position
+        self.PC = PC
+        self.reg = reg
+        self.mem = mem
+
+
+# *****************************
+# 函数式执行生成的检查点
+# 第i个区间从第i*interval条指令开始，详细模拟从它之前warmup条指令的检查点开始，
+# 所以检查点保存在i*interval-warmup（不小于0）的位置；instructions是整个程序的指令数
+# *****************************
+class CheckpointSet:
+    def __init__(self, interval, warmup, checkpoints, instructions, halted, key):
+        self.interval = interval
+        self.warmup = warmup
+        self.checkpoints = checkpoints
+        self.instructions = instructions
+        self.halted = halted
+        # 程序、数据和内存大小的摘要，读取时用来判断检查点是否还能用
+        self.key = key
+
+    # 区间i详细模拟的起点
+    def start(self, i):
+        position = max(0, i * self.interval - self.warmup)
+        for checkpoint in self.checkpoints:
+            if checkpoint.position == position:
+                return checkpoint
+        raise MyError(f"sampling_error: no checkpoint at instruction({position})")
+
+    def __len__(self):
+        return (self.instructions + self.interval - 1) // self.interval
+
+    def save(self, path):
+        header = json.dumps({"interval": self.interval, "warmup": self.warmup, "instructions": self.instructions,
+                             "halted": self.halted, "key": self.key, "count": len(self.checkpoints)}).encode()
+        with open(path, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header)) + header)
+            for checkpoint in self.checkpoints:
+                blob = pack(checkpoint.reg + checkpoint.mem)
+                f.write(CHECKPOINT_HEADER.pack(checkpoint.position, checkpoint.PC, len(blob)))
+                f.write(blob)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise MyError(f"sampling_error: {path} is not a checkpoint file")
+            length, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+            checkpoints = []
+            for _ in range(header["count"]):
+                position, PC, length = CHECKPOINT_HEADER.unpack(f.read(CHECKPOINT_HEADER.size))
+                values = unpack(f.read(length))
+                checkpoints.append(Checkpoint(position, PC, values[:32], values[32:]))
+        return cls(header["interval"], header["warmup"], checkpoints, header["instructions"], header["halted"],
+                   header["key"])
+
+
+def checkpointKey(program, data, dmemSize):
+    return digest({"program": list(program), "data": list(data or []), "dmem": dmemSize})
+
+
+# *****************************
+# 函数式执行
+# 用SEQ运行整个程序（每个周期一条指令），在需要的位置复制寄存器堆和数据内存
+# 没有在max_instructions条指令内结束时，只对已经执行的部分分区间
+# *****************************
+def functionalPass(program, data=None, interval=100000, warmup=1000, dmemSize=1024, max_instructions=10 ** 9):
+    if interval < 1 or warmup < 0:
+        raise MyError(f"sampling_error: invalid interval({interval}) or warmup({warmup})")
+    sim = SEQ.Simulator(SEQ.IMemory(max(256, len(program))), SEQ.DMemory(dmemSize))
+    sim.load(program, data)
+    checkpoints = [Checkpoint(0, sim.PC, sim.regFile.reg[:], sim.dmem.mem[:])]
+    i = 1
+    while not sim.halted:
+        position = i * interval - warmup
+        i += 1
+        if position <= 0:
+            continue
+        if position > max_instructions:
+            break
+        sim.run(position)
+        if sim.halted:
+            break
+        checkpoints.append(Checkpoint(position, sim.PC, sim.regFile.reg[:], sim.dmem.mem[:]))
+    sim.run(max_instructions)
+    return CheckpointSet(interval, warmup, checkpoints, sim.clock, sim.halted,
+                         checkpointKey(program, data, dmemSize))
+
+
+# 工作进程里的程序，每个进程只传一次
+_program = None
+
+
+def setProgram(program):
+    global _program
+    _program = program
+
+
+# 运行到退休count条指令或者停机，返回时钟
+def runUntil(sim, count):
+    while sim.retired < count and not sim.halted:
+        sim.tick()
+    return sim.clock
+
+
+# *****************************
+# 工作进程：从检查点开始详细模拟一个区间
+# 先模拟warmup条指令，不计周期，再模拟区间内的指令；第一个区间从复位开始计时，
+# 所以预热足够时各区间的周期数之和等于逐周期模拟整个程序的周期数
+# *****************************
+def simulateInterval(job):
+    index, start, end, checkpoint, options = job
+    sim = PIPE.Simulator(PIPE.IMemory(max(256, len(_program))), PIPE.DMemory(len(checkpoint.mem)), **options)
+    sim.load(_program, checkpoint.mem, checkpoint.PC)
+    sim.regFile.reg[:] = checkpoint.reg
+    warmup = start - checkpoint.position
+    begin = 0 if start == 0 else runUntil(sim, warmup)
+    finish = runUntil(sim, warmup + end - start)
+    return {
+        "index": index,
+        "start": start,
+        "instructions": sim.retired - warmup,
+        "cycles": finish - begin,
+        "warmupCycles": begin,
+        "halted": sim.halted,
+    }
+
+
+# *****************************
+# 按检查点分区间并行详细模拟，把各区间的周期数加起来
+# sampleEvery > 1时只模拟每sampleEvery个区间中的第一个，其余区间的周期数按模拟过的区间的平均CPI估计
+# options是PIPE.Simulator的参数（loadLatency、storeLatency、storeBufferDepth）
+# *****************************
+def sampledRun(program, data=None, interval=100000, warmup=1000, processes=None, sampleEvery=1, dmemSize=1024,
+               max_instructions=10 ** 9, checkpoints=None, **options):
+    started = time.perf_counter()
+    if checkpoints is None:
+        checkpoints = functionalPass(program, data, interval, warmup, dmemSize, max_instructions)
+    functional = time.perf_counter() - started
+
+    total = checkpoints.instructions
+    jobs = [(i, i * checkpoints.interval, min((i + 1) * checkpoints.interval, total), checkpoints.start(i), options)
+            for i in range(0, len(checkpoints), sampleEvery)]
+    started = time.perf_counter()
+    if processes == 1:
+        setProgram(program)
+        results = [simulateInterval(job) for job in jobs]
+    else:
+        with Pool(processes, initializer=setProgram, initargs=(program,)) as pool:
+            results = pool.map(simulateInterval, jobs)
+    detailed = time.perf_counter() - started
+
+    cycles = sum(result["cycles"] for result in results)
+    simulated = sum(result["instructions"] for result in results)
+    if simulated < total:
+        cycles = round(cycles * total / simulated) if simulated else 0
+    return {
+        "core": "PIPE",
+        "cycles": cycles,
+        "instructions": total,
+        "CPI": cycles / total if total else None,
+        "halted": checkpoints.halted,
+        "estimated": simulated < total,
+        "intervals": results,
+        "checkpoints": len(checkpoints.checkpoints),
+        "functionalSeconds": functional,
+        "detailedSeconds": detailed,
+    }
+
+
+# 读取检查点文件，文件不存在或者和程序、参数不符时重新执行函数式模拟并写入文件
+def loadOrMakeCheckpoints(path, program, data, interval, warmup, dmemSize, max_instructions):
+    if os.path.exists(path):
+        checkpoints = CheckpointSet.load(path)
+        if checkpoints.key == checkpointKey(program, data, dmemSize) and checkpoints.interval == interval \
+                and checkpoints.warmup == warmup:
+            return checkpoints, True
+    checkpoints = functionalPass(program, data, interval, warmup, dmemSize, max_instructions)
+    checkpoints.save(path)
+    return checkpoints, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="从检查点分区间并行详细模拟PIPE，合计整个程序的周期数")
+    parser.add_argument("program", help=f"内置程序({', '.join(PROGRAMS)})、生成的程序({', '.join(GENERATORS)})"
+                                        "或者汇编源文件")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--size", type=int, help="生成的程序的规模")
+    parser.add_argument("--passes", type=int, help="生成的程序的重复次数")
+    parser.add_argument("--seed", type=int, default=0, help="生成的程序的随机数种子")
+    parser.add_argument("--interval", type=int, default=100000, help="每个区间的指令数")
+    parser.add_argument("--warmup", type=int, default=1000, help="每个区间之前预热的指令数")
+    parser.add_argument("--sample-every", type=int, default=1, metavar="N",
+                        help="每N个区间只详细模拟一个，其余按平均CPI估计")
+    parser.add_argument("--jobs", type=int, default=None, help="并行进程数，默认为CPU核数")
+    parser.add_argument("--checkpoints", metavar="PATH", help="检查点文件，已有并且匹配时跳过函数式模拟")
+    parser.add_argument("--dmem-size", type=int, default=1024, help="数据内存的字数")
+    parser.add_argument("--max-instructions", type=int, default=10 ** 9, help="函数式模拟的最大指令数")
+    parser.add_argument("--load-latency", type=int, default=1, help="lw在访存阶段停留的周期数")
+    parser.add_argument("--store-latency", type=int, default=1, help="sw在访存阶段停留的周期数")
+    parser.add_argument("--store-buffer", type=int, default=0, metavar="DEPTH", help="写缓冲的项数")
+    parser.add_argument("--compare", action="store_true", help="再完整地逐周期模拟一次，比较周期数和耗时")
+    parser.add_argument("--detail", action="store_true", help="输出每个区间的周期数")
+    parser.add_argument("--json", action="store_true", help="以JSON输出统计信息")
+    args = parser.parse_args(argv)
+
+    if args.program in GENERATORS:
+        workload = generate(args.program, args.size, args.passes, args.seed, dmemWords=args.dmem_size)
+        program, data = workload.program, workload.data
+    else:
+        program = loadProgram(args.program)
+        data = DATA.get(args.program)
+    if args.data:
+        data = loadData(args.data)
+    options = {"loadLatency": args.load_latency, "storeLatency": args.store_latency,
+               "storeBufferDepth": args.store_buffer}
+
+    checkpoints, reused = None, False
+    started = time.perf_counter()
+    if args.checkpoints:
+        checkpoints, reused = loadOrMakeCheckpoints(args.checkpoints, program, data, args.interval, args.warmup,
+                                                    args.dmem_size, args.max_instructions)
+    functional = time.perf_counter() - started
+    stats = sampledRun(program, data, args.interval, args.warmup, args.jobs, args.sample_every, args.dmem_size,
+                       args.max_instructions, checkpoints, **options)
+    if args.checkpoints:
+        stats["functionalSeconds"] = functional
+    if args.compare:
+        started = time.perf_counter()
+        sim = PIPE.Simulator(PIPE.IMemory(max(256, len(program))), PIPE.DMemory(args.dmem_size), **options)
+        sim.load(program, data)
+        full = sim.run(1 << 62)
+        stats["full"] = {"cycles": full["cycles"], "instructions": full["instructions"],
+                         "seconds": time.perf_counter() - started}
+
+    if args.json:
+        json.dump(stats, sys.stdout)
+        print()
+        return 0
+    if args.detail:
+        print(f"{'interval':>8}{'start':>12}{'instr':>10}{'cycles':>10}{'CPI':>8}")
+        for result in stats["intervals"]:
+            CPI = result["cycles"] / result["instructions"] if result["instructions"] else 0
+            print(f"{result['index']:>8}{result['start']:>12}{result['instructions']:>10}{result['cycles']:>10}"
+                  f"{CPI:>8.3f}")
+    print(f"Total Clock:{stats['cycles']}{' (estimated)' if stats['estimated'] else ''}")
+    print(f"Instructions:{stats['instructions']}")
+    print(f"Intervals:{len(stats['intervals'])} simulated, {stats['checkpoints']} checkpoints"
+          f"{' (reused)' if reused else ''}")
+    print(f"Functional pass:{stats['functionalSeconds']:.2f}s, detailed:{stats['detailedSeconds']:.2f}s")
+    if args.compare:
+        full = stats["full"]
+        error = (stats["cycles"] - full["cycles"]) / full["cycles"] if full["cycles"] else 0
+        print(f"Full simulation:{full['cycles']} cycles, {full['seconds']:.2f}s, error {error:+.4%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
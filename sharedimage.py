@@ -0,0 +1,131 @@
+import array
+from multiprocessing import shared_memory
+
+import PIPE
+import SEQ
+from PIPE import MyError, u2i
+
+
+# *****************************
+# 放在共享内存里的程序镜像
+# 指令和初始数据按32位字连续存放，指令在前，数据在后；
+# 指令部分补0到指令内存的大小，数据部分的长度就是数据内存的大小
+# 父进程publish一次，工作进程按handle附加，不复制镜像
+# *****************************
+class SharedImage:
+    def __init__(self, shm, programLength, imemLength, dataLength, owner):
+        self.shm = shm
+        self.programLength = programLength
+        self.imemLength = imemLength
+        self.dataLength = dataLength
+        self.owner = owner
+        words = memoryview(shm.buf)[:(imemLength + dataLength) * 4]
+        self.program = words[:imemLength * 4].cast('I').toreadonly()
+        self.data = words[imemLength * 4:].cast('i').toreadonly()
+        words.release()
+
+    # 创建共享内存并写入镜像，imemSize/dmemSize是指令内存和数据内存的最少字数
+    @classmethod
+    def publish(cls, program, data=None, dmemSize=1024, imemSize=256):
+        data = data or []
+        if len(data) > dmemSize:
+            raise MyError(f"image_error: data({len(data)}) out of length of dmem({dmemSize})")
+        imemLength = max(len(program), imemSize)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, (imemLength + dmemSize) * 4))
+        words = memoryview(shm.buf)
+        words[:imemLength * 4] = array.array('I', list(program) + [0] * (imemLength - len(program))).tobytes()
+        words[imemLength * 4:(imemLength + dmemSize) * 4] = \
+            array.array('i', list(map(u2i, data)) + [0] * (dmemSize - len(data))).tobytes()
+        words.release()
+        return cls(shm, len(program), imemLength, dmemSize, owner=True)
+
+    # 可以传给工作进程的句柄
+    @property
+    def handle(self):
+        return self.shm.name, self.programLength, self.imemLength, self.dataLength
+
+    @classmethod
+    def attach(cls, handle):
+        name, programLength, imemLength, dataLength = handle
+        return cls(shared_memory.SharedMemory(name=name), programLength, imemLength, dataLength, owner=False)
+
+    # 指令内存直接使用共享的指令，core是"pipe"或者"seq"
+    def imem(self, core="pipe"):
+        return (PipeSharedIMemory if core == "pipe" else SeqSharedIMemory)(self.program)
+
+    def dmem(self, core="pipe"):
+        return (PipeSharedDMemory if core == "pipe" else SeqSharedDMemory)(self.data)
+
+    # 先释放所有视图再关闭，发布者同时删除共享内存
+    def close(self):
+        self.program.release()
+        self.data.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# *****************************
+# 只读的指令内存，直接读共享内存（发布时已经补0到指令内存的大小）
+# *****************************
+class SharedIMemory:
+    def __init__(self, words):
+        self.mem = words
+
+    def loadProgram(self, program):
+        raise MyError("imem_error: shared instruction memory is read-only")
+
+
+class PipeSharedIMemory(SharedIMemory, PIPE.IMemory):
+    pass
+
+
+class SeqSharedIMemory(SharedIMemory, SEQ.IMemory):
+    pass
+
+
+# *****************************
+# 第一次写时才复制的数据内存
+# 在此之前mem是共享的初始数据的只读视图
+# *****************************
+class SharedDMemory:
+    def __init__(self, words):
+        self.shared = True
+        self.mem = words
+
+    # 复制一份私有的数据
+    def unshare(self):
+        if self.shared:
+            mem = array.array('i')
+            mem.frombytes(self.mem.tobytes())
+            self.mem = mem
+            self.shared = False
+
+    def loadData(self, data):
+        self.unshare()
+        super().loadData(data)
+
+    def access(self, read, write, address, data):
+        if write and self.shared:
+            self.unshare()
+        return super().access(read, write, address, data)
+
+    def poke(self, index, value):
+        self.unshare()
+        super().poke(index, value)
+
+
+class PipeSharedDMemory(SharedDMemory, PIPE.DMemory):
+    def __init__(self, words):
+        super().__init__(words)
+        self.clearCheckpoints()
+
+
+class SeqSharedDMemory(SharedDMemory, SEQ.DMemory):
+    pass
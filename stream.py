@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+STAGES = ["W", "M", "E", "D", "F"]
+
+
+# *****************************
+# 以asyncio异步生成器的方式输出PIPE每个周期的状态
+# 模拟在工作线程里运行，每every个周期产生一个样本。
+# 队列里最多maxsize个样本：drop=True时队列满就丢弃样本，模拟不会等待；
+# drop=False时模拟线程等待消费者，模拟速度跟随消费者。
+# delta=True时样本只包含和上一个送出的样本相比改变的字段。
+# *****************************
+class Stream:
+    def __init__(self, sim, every=1, delta=False, maxsize=64, drop=True, max_cycles=10000):
+        self.sim = sim
+        self.every = every
+        self.delta = delta
+        self.maxsize = maxsize
+        self.drop = drop
+        self.max_cycles = max_cycles
+        self.produced = 0
+        self.dropped = 0
+
+    def __aiter__(self):
+        return self.samples()
+
+    # 完整样本
+    def sample(self):
+        sim = self.sim
+        pipeline = sim.snapshot()
+        return {
+            "clock": sim.clock,
+            "retired": sim.retired,
+            "halted": sim.halted,
+            "pipeline": dict(zip(STAGES, pipeline)),
+            "registers": list(sim.regFile.reg),
+        }
+
+    # 和上一个送出的样本相比改变的部分
+    def deltaSample(self, sample, previous):
+        registers = sample["registers"]
+        pipeline = sample["pipeline"]
+        return {
+            "clock": sample["clock"],
+            "retired": sample["retired"],
+            "halted": sample["halted"],
+            "pipeline": {stage: pipeline[stage] for stage in STAGES
+                         if pipeline[stage] != previous["pipeline"][stage]},
+            "registers": {i: registers[i] for i in range(len(registers))
+                          if registers[i] != previous["registers"][i]},
+        }
+
+    # 工作线程：运行模拟并把样本交给事件循环
+    def work(self, loop, queue, slots, stopping):
+        sim = self.sim
+        previous = None
+
+        def wait():
+            while not slots.acquire(timeout=0.1):
+                if stopping.is_set():
+                    return False
+            return True
+
+        def send():
+            nonlocal previous
+            sample = self.sample()
+            item = sample if previous is None or not self.delta else self.deltaSample(sample, previous)
+            previous = sample
+            self.produced += 1
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        try:
+            while not sim.halted and sim.clock < self.max_cycles and not stopping.is_set():
+                sim.step(self.every)
+                if self.drop and not slots.acquire(blocking=False):
+                    self.dropped += 1
+                    continue
+                if not self.drop and not wait():
+                    return
+                send()
+            # 最后的状态即使被丢弃过也一定送出
+            if (previous is None or previous["clock"] != sim.clock) and wait():
+                send()
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+
+    async def samples(self):
+        loop = asyncio.get_running_loop()
+        # 样本数量由slots限制，所以asyncio的队列本身不需要限制大小
+        queue = asyncio.Queue()
+        slots = threading.Semaphore(self.maxsize)
+        stopping = threading.Event()
+        worker = threading.Thread(target=self.work, args=(loop, queue, slots, stopping), daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                slots.release()
+                yield item
+        finally:
+            stopping.set()
+            await loop.run_in_executor(None, worker.join)
+
+
+async def collect(sim, **kwargs):
+    return [sample async for sample in Stream(sim, **kwargs)]
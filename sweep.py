@@ -0,0 +1,169 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import cache
+import timing
+from runcache import digest, sourceDigest, projectModules
+from timing import TimingConfig
+from main import PROGRAMS, DATA, loadProgram, loadData
+
+# 硬件代价的相对单位
+# 转发通路：比较器和多路选择器的输入，执行和访存阶段的通路比锁存器的通路长
+FORWARDING_COST = {"e": 2, "m": 2, "M": 1, "W": 1}
+# 在译码阶段确定分支需要额外的比较器
+BRANCH_STAGE_COST = {"D": 2, "E": 0}
+PREDICTOR_COST = {"stall": 0, "nottaken": 1, "taken": 1, "bimodal": 2}
+PREFETCHER_COST = {"": 0, "nextline": 1, "stride": 2}
+
+
+def cost(config):
+    total = sum(FORWARDING_COST[path] for path in config.forwarding)
+    total += BRANCH_STAGE_COST[config.branchStage]
+    total += PREDICTOR_COST[config.predictor]
+    if config.predictor == "bimodal":
+        total += config.predictorEntries / 64
+    if config.cacheSize:
+        total += config.cacheSize / 256 + config.cacheWays - 1
+        total += PREFETCHER_COST[config.prefetcher]
+        if config.prefetcher == "stride":
+            total += config.prefetchEntries / 64
+    # 访存越快代价越高
+    total += 4 / config.loadLatency + 2 / config.storeLatency
+    return total
+
+
+# 参数网格的全部组合
+def points(grid):
+    names = list(grid)
+    for values in itertools.product(*[grid[name] for name in names]):
+        yield TimingConfig(**dict(zip(names, values)))
+
+
+# 工作进程：重放轨迹
+def simulate(args):
+    path, config = args
+    return timing.replay(timing.load(path), TimingConfig(**config))
+
+
+def writeJSON(path, value):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
+
+
+# *****************************
+# 设计空间扫描
+# 同一个程序和数据只记录一次指令轨迹，每个配置的结果按(程序摘要, 数据摘要, 配置摘要)
+# 保存在cacheDir里，重新扫描时只模拟没有结果的配置，其余配置用多进程并行重放
+# *****************************
+class Sweep:
+    def __init__(self, cacheDir=".sweep-cache", processes=None, max_instructions=1000000):
+        self.cacheDir = cacheDir
+        self.processes = processes
+        self.max_instructions = max_instructions
+        self.simulated = 0
+        self.cached = 0
+        # 轨迹由timing.record用SEQ记录，结果由timing和cache重放，它们用到的模块都算在版本里
+        self.version = sourceDigest(*projectModules(timing, cache))
+        os.makedirs(os.path.join(cacheDir, "traces"), exist_ok=True)
+        os.makedirs(os.path.join(cacheDir, "results"), exist_ok=True)
+
+    def tracePath(self, program, data):
+        name = f"{digest(program)}-{digest(data or [])}-{self.max_instructions}-{self.version}.trace"
+        path = os.path.join(self.cacheDir, "traces", name)
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            timing.record(tmp, program, data, max_instructions=self.max_instructions)
+            os.replace(tmp, path)
+        return path
+
+    def resultPath(self, program, data, config):
+        key = [digest(program), digest(data or []), digest(config.asdict()),
+               self.max_instructions, self.version]
+        return os.path.join(self.cacheDir, "results", f"{digest(key)}.json")
+
+    # 返回[(配置, 结果)]，顺序和configs相同
+    def run(self, program, configs, data=None):
+        configs = list(configs)
+        results = [None] * len(configs)
+        missing = []
+        for i, config in enumerate(configs):
+            path = self.resultPath(program, data, config)
+            if os.path.exists(path):
+                with open(path) as f:
+                    results[i] = json.load(f)
+            else:
+                missing.append(i)
+        self.cached += len(configs) - len(missing)
+        self.simulated += len(missing)
+        if missing:
+            trace = self.tracePath(program, data)
+            jobs = [(trace, configs[i].asdict()) for i in missing]
+            with Pool(self.processes) as pool:
+                for i, stats in zip(missing, pool.map(simulate, jobs)):
+                    results[i] = stats
+                    writeJSON(self.resultPath(program, data, configs[i]), stats)
+        return list(zip(configs, results))
+
+
+# 周期数和代价的Pareto前沿：没有其他配置同时更便宜且不更慢
+def pareto(results):
+    front = []
+    best = None
+    for config, stats in sorted(results, key=lambda r: (cost(r[0]), r[1]["cycles"])):
+        if best is None or stats["cycles"] < best:
+            front.append((config, stats))
+            best = stats["cycles"]
+    return front
+
+
+def printTable(results, front, everything=False):
+    print(f"{'':2}{'cycles':>8}{'CPI':>8}{'cost':>8}  config")
+    rows = results if everything else front
+    front = [id(config) for config, _ in front]
+    for config, stats in sorted(rows, key=lambda r: (cost(r[0]), r[1]["cycles"])):
+        mark = "*" if id(config) in front else ""
+        print(f"{mark:2}{stats['cycles']:>8}{stats['CPI']:>8.3f}{cost(config):>8.2f}  {config.describe()}")
+
+
+# 命令行参数 name=v1,v2,... 转换为网格，整数自动转换，"none"表示空字符串
+def parseGrid(params):
+    grid = {}
+    for param in params:
+        name, _, values = param.partition("=")
+        if name not in TimingConfig().asdict():
+            raise SystemExit(f"unknown parameter: {name}")
+        grid[name] = [int(v) if v.lstrip("-").isdigit() else "" if v == "none" else v
+                      for v in values.split(",")]
+    return grid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="微结构参数的设计空间扫描")
+    parser.add_argument("program", help=f"内置程序({', '.join(PROGRAMS)})或者汇编源文件")
+    parser.add_argument("params", nargs="*", metavar="NAME=V1,V2",
+                        help="扫描的参数和取值，参数名同TimingConfig")
+    parser.add_argument("--data", help="初始数据文件，每行一个整数")
+    parser.add_argument("--cache-dir", default=".sweep-cache", help="轨迹和结果的缓存目录")
+    parser.add_argument("--jobs", type=int, default=None, help="并行进程数，默认为CPU核数")
+    parser.add_argument("--max-instructions", type=int, default=1000000, help="记录的最大指令数")
+    parser.add_argument("--all", action="store_true", help="输出全部配置，Pareto前沿用*标出")
+    args = parser.parse_args(argv)
+
+    program = loadProgram(args.program)
+    data = loadData(args.data) if args.data else DATA.get(args.program)
+    grid = parseGrid(args.params)
+    sweep = Sweep(args.cache_dir, args.jobs, args.max_instructions)
+    results = sweep.run(program, points(grid), data)
+    printTable(results, pareto(results), args.all)
+    print(f"\n{len(results)} points: {sweep.simulated} simulated, {sweep.cached} cached")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
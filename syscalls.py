@@ -0,0 +1,188 @@
+import sys
+
+from PIPE import MyError, u2i
+
+# 服务号放在$2，参数放在$4、$5、$6，返回值放在$2（和MARS的编号相同）
+REG_V0 = 2
+REG_A0 = 4
+REG_A1 = 5
+REG_A2 = 6
+
+SYS_PRINT_INT = 1
+SYS_EXIT = 10
+SYS_PRINT_CHAR = 11
+SYS_EXIT2 = 17
+SYS_CYCLES = 30
+SYS_READ = 63
+SYS_WRITE = 64
+
+SERVICES = {
+    SYS_PRINT_INT: "printInt",
+    SYS_EXIT: "exit",
+    SYS_PRINT_CHAR: "printChar",
+    SYS_EXIT2: "exit2",
+    SYS_CYCLES: "cycles",
+    SYS_READ: "read",
+    SYS_WRITE: "write",
+}
+
+# 文件描述符
+STDIN = 0
+STDOUT = 1
+STDERR = 2
+
+
+# *****************************
+# 带缓冲的控制台/文件设备
+# 输出先放在每个文件描述符的缓冲里，超过bufferSize字节或者close时才一次写给主机；
+# 输入每次向主机读一整块，之后的read从预读的数据里取
+# stdin/stdout/stderr是二进制文件，默认是主机的标准输入输出
+# *****************************
+class ConsoleDevice:
+    def __init__(self, stdin=None, stdout=None, stderr=None, bufferSize=1 << 16):
+        self.bufferSize = bufferSize
+        self.inputs = {STDIN: stdin if stdin is not None else sys.stdin.buffer}
+        self.outputs = {STDOUT: stdout if stdout is not None else sys.stdout.buffer,
+                        STDERR: stderr if stderr is not None else sys.stderr.buffer}
+        self.written = {fd: bytearray() for fd in self.outputs}
+        self.readAhead = {fd: bytearray() for fd in self.inputs}
+        self.eof = {fd: False for fd in self.inputs}
+        # 向主机写和读的次数
+        self.hostWrites = 0
+        self.hostReads = 0
+
+    # 返回写入的字节数，不能写的描述符返回-1
+    def write(self, fd, data):
+        buffer = self.written.get(fd)
+        if buffer is None:
+            return -1
+        buffer += data
+        if len(buffer) >= self.bufferSize:
+            self.flush(fd)
+        return len(data)
+
+    # 最多读count字节，文件结束时返回空，不能读的描述符返回None
+    def read(self, fd, count):
+        buffer = self.readAhead.get(fd)
+        if buffer is None:
+            return None
+        while len(buffer) < count and not self.eof[fd]:
+            file = self.inputs[fd]
+            chunk = getattr(file, "read1", file.read)(self.bufferSize)
+            self.hostReads += 1
+            if not chunk:
+                self.eof[fd] = True
+            buffer += chunk
+        data = bytes(buffer[:count])
+        del buffer[:count]
+        return data
+
+    def flush(self, fd=None):
+        for number in ([fd] if fd is not None else list(self.written)):
+            buffer = self.written[number]
+            if not buffer:
+                continue
+            file = self.outputs[number]
+            # 和模拟器自己用print输出的内容保持顺序
+            if file is sys.stdout.buffer:
+                sys.stdout.flush()
+            file.write(buffer)
+            file.flush()
+            self.hostWrites += 1
+            buffer.clear()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# *****************************
+# syscall的服务
+# PIPE在syscall之前的指令全部完成（包括写缓冲）之后，在译码阶段调用service，
+# 然后syscall在译码阶段停留latency(服务号)个周期；SEQ在执行syscall时调用service
+# latency是整数或者{服务号: 周期数}，没有列出的服务为1个周期
+# service返回这次服务的周期数；exit/exit2结束程序，返回码放在exitCode
+# *****************************
+class SyscallHandler:
+    def __init__(self, device=None, latency=1):
+        self.device = ConsoleDevice() if device is None else device
+        self.latencies = latency if isinstance(latency, dict) else {}
+        self.defaultLatency = 1 if isinstance(latency, dict) else latency
+        self.reset()
+
+    # 模拟器reset时调用，设备里还没有写出的内容保留
+    def reset(self):
+        self.exitCode = None
+        self.counts = dict.fromkeys(SERVICES.values(), 0)
+
+    def latency(self, code):
+        return self.latencies.get(code, self.defaultLatency)
+
+    # 两种寄存器堆表示不写的方式不同（None和0），dstE和dstM相同时都只写这一个寄存器
+    def setResult(self, sim, value):
+        value = u2i(value & 0xffffffff)
+        sim.regFile.write(REG_V0, value, REG_V0, value)
+
+    # 检查缓冲区在数据内存范围内并按字对齐，返回起始字的编号
+    def checkBuffer(self, sim, address, count):
+        if address % 4 or address < 0 or count < 0 or address + count > len(sim.dmem.mem) * 4:
+            raise MyError(f"syscall_error: buffer(address={address}, count={count}) out of dmem")
+        return address // 4
+
+    def service(self, sim):
+        reg = sim.regFile.reg
+        code = reg[REG_V0]
+        name = SERVICES.get(code)
+        if name is None:
+            raise MyError(f"syscall_error: unknown service({code})")
+        self.counts[name] += 1
+        latency = self.latency(code)
+        a0, a1, a2 = reg[REG_A0], reg[REG_A1], reg[REG_A2]
+        device = self.device
+        if code == SYS_PRINT_INT:
+            device.write(STDOUT, str(a0).encode())
+        elif code == SYS_PRINT_CHAR:
+            device.write(STDOUT, bytes([a0 & 0xff]))
+        elif code == SYS_EXIT:
+            self.exitCode = 0
+        elif code == SYS_EXIT2:
+            self.exitCode = a0
+        elif code == SYS_CYCLES:
+            self.setResult(sim, sim.clock)
+        elif code == SYS_WRITE:
+            # 字节按小端序从字里取出
+            start = self.checkBuffer(sim, a1, a2)
+            words = sim.dmem.mem[start:start + (a2 + 3) // 4]
+            data = b"".join(word.to_bytes(4, "little", signed=True) for word in words)[:a2]
+            self.setResult(sim, device.write(a0, data))
+        elif code == SYS_READ:
+            start = self.checkBuffer(sim, a1, a2)
+            data = device.read(a0, a2)
+            if data is None:
+                self.setResult(sim, -1)
+                return latency
+            # 最后一个字没有读满时保留原来的高位字节
+            for i in range(0, len(data), 4):
+                chunk = data[i:i + 4]
+                if len(chunk) < 4:
+                    old = sim.dmem.mem[start + i // 4].to_bytes(4, "little", signed=True)
+                    chunk += old[len(chunk):]
+                sim.dmem.access(False, True, a1 + i, int.from_bytes(chunk, "little", signed=True))
+            self.setResult(sim, len(data))
+        return latency
+
+    def close(self):
+        self.device.close()
+
+    def stats(self):
+        return {
+            "calls": {name: count for name, count in self.counts.items() if count},
+            "exitCode": self.exitCode,
+            "hostWrites": self.device.hostWrites,
+            "hostReads": self.device.hostReads,
+        }
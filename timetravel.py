@@ -0,0 +1,171 @@
+# 估算内存占用用的大小（字节）
+ENTRY_BYTES = 64
+WRITE_BYTES = 32
+
+# 撤销记录的种类
+UNDO_REG = 0
+UNDO_MEM = 1
+
+
+# 完整快照：时钟、其余状态、寄存器和内存的副本
+class Snapshot:
+    __slots__ = ('clock', 'state', 'reg', 'mem')
+
+    def __init__(self, sim):
+        self.clock = sim.clock
+        self.state = sim.saveState()
+        self.reg = sim.regFile.reg[:]
+        self.mem = sim.dmem.mem[:]
+
+    def size(self):
+        return (len(self.reg) + len(self.mem)) * 4 + ENTRY_BYTES
+
+
+# *****************************
+# 反向调试
+# 每隔interval个周期保存一个完整快照，快照之后每个周期记录一条撤销记录：
+# 周期开始时的状态，以及这个周期里被覆盖的寄存器和内存的旧值。
+# 退回最近快照之后的周期只需要撤销，更早的周期恢复一个快照再向前重放。
+# 占用超过budget字节时，隔一个删除较早的快照。
+# *****************************
+class TimeTravel:
+    def __init__(self, sim, interval=1000, budget=16 << 20):
+        self.sim = sim
+        self.interval = interval
+        self.budget = budget
+        self.snapshots = [Snapshot(sim)]
+        self.snapshotBytes = self.snapshots[0].size()
+        # [(周期开始时的状态, [(种类, 编号, 旧值)])]
+        self.undo = []
+        self.undoBytes = 0
+        self.writes = None
+        self.install()
+
+    # 在寄存器堆和内存的实例上安装记录旧值的写操作，包装实例上已有的方法（比如Debugger的钩子）
+    # 只记录TimeTravel.tick里的写，直接调用sim.tick时不记录
+    def install(self):
+        regFile, dmem = self.sim.regFile, self.sim.dmem
+        self.previous = regFile.__dict__.get("write"), dmem.__dict__.get("access")
+        write, access = regFile.write, dmem.access
+
+        def recordedWrite(dstE, valE, dstM, valM):
+            if self.writes is not None:
+                for dst in (dstE, dstM):
+                    # PIPE用None、SEQ用0表示不写寄存器
+                    if dst:
+                        self.writes.append((UNDO_REG, dst, regFile.reg[dst]))
+            write(dstE, valE, dstM, valM)
+
+        def recordedAccess(read, write, address, data):
+            if write and self.writes is not None and 0 <= address >> 2 < len(dmem.mem):
+                self.writes.append((UNDO_MEM, address >> 2, dmem.mem[address >> 2]))
+            return access(read, write, address, data)
+
+        self.hooks = regFile.write, dmem.access = recordedWrite, recordedAccess
+
+    # 恢复安装前的方法；之后又有别的钩子包装了这里的钩子时保留它，只是不再记录
+    def uninstall(self):
+        self.writes = None
+        for obj, name, hook, previous in zip((self.sim.regFile, self.sim.dmem), ("write", "access"),
+                                             self.hooks, self.previous):
+            if obj.__dict__.get(name) is not hook:
+                continue
+            if previous is None:
+                obj.__dict__.pop(name, None)
+            else:
+                setattr(obj, name, previous)
+
+    # *****************************
+    # 向前运行
+    # *****************************
+    def tick(self):
+        sim = self.sim
+        if sim.clock - self.snapshots[-1].clock >= self.interval:
+            self.takeSnapshot()
+        self.writes = []
+        entry = (sim.saveState(), self.writes)
+        sim.tick()
+        self.writes = None
+        self.undo.append(entry)
+        self.undoBytes += ENTRY_BYTES + WRITE_BYTES * len(entry[1])
+
+    def step(self, n=1):
+        for _ in range(n):
+            if self.sim.halted:
+                break
+            self.tick()
+        return self.sim.clock
+
+    def run(self, max_cycles=10000):
+        while not self.sim.halted and self.sim.clock < max_cycles:
+            self.tick()
+        return self.sim.stats()
+
+    def takeSnapshot(self):
+        snapshot = Snapshot(self.sim)
+        self.snapshots.append(snapshot)
+        self.snapshotBytes += snapshot.size()
+        # 快照之前的撤销记录可以由快照加重放代替
+        self.undo = []
+        self.undoBytes = 0
+        self.thin()
+
+    # 超过预算时隔一个删除较早的快照，保留第一个和最后一个
+    def thin(self):
+        while self.snapshotBytes + self.undoBytes > self.budget and len(self.snapshots) > 2:
+            removed = self.snapshots[1:-1:2]
+            del self.snapshots[1:-1:2]
+            self.snapshotBytes -= sum(snapshot.size() for snapshot in removed)
+
+    # *****************************
+    # 向后运行
+    # *****************************
+    def back(self, n=1):
+        return self.goto(self.sim.clock - n)
+
+    # 回到第clock个周期开始时的状态
+    def goto(self, clock):
+        sim = self.sim
+        start = self.snapshots[0].clock
+        if clock < start:
+            clock = start
+        if clock > sim.clock:
+            self.step(clock - sim.clock)
+            return sim.clock
+        last = self.snapshots[-1].clock
+        if clock >= last and sim.clock - clock <= len(self.undo):
+            while sim.clock > clock:
+                self.undoCycle()
+            return sim.clock
+        # 恢复不晚于clock的最近快照，然后重放
+        snapshot = [snapshot for snapshot in self.snapshots if snapshot.clock <= clock][-1]
+        self.restoreSnapshot(snapshot)
+        self.step(clock - sim.clock)
+        return sim.clock
+
+    def undoCycle(self):
+        state, writes = self.undo.pop()
+        self.undoBytes -= ENTRY_BYTES + WRITE_BYTES * len(writes)
+        regFile, dmem = self.sim.regFile, self.sim.dmem
+        for kind, index, old in reversed(writes):
+            if kind == UNDO_REG:
+                regFile.poke(index, old)
+            else:
+                dmem.poke(index, old)
+        self.sim.restoreState(state)
+
+    def restoreSnapshot(self, snapshot):
+        sim = self.sim
+        regFile, dmem = sim.regFile, sim.dmem
+        for i in range(len(snapshot.reg)):
+            if regFile.reg[i] != snapshot.reg[i]:
+                regFile.poke(i, snapshot.reg[i])
+        for i in range(len(snapshot.mem)):
+            if dmem.mem[i] != snapshot.mem[i]:
+                dmem.poke(i, snapshot.mem[i])
+        sim.restoreState(snapshot.state)
+        # 快照之后的快照和撤销记录都作废了
+        while self.snapshots[-1] is not snapshot:
+            self.snapshotBytes -= self.snapshots.pop().size()
+        self.undo = []
+        self.undoBytes = 0
@@ -0,0 +1,291 @@
+import os
+import sys
+import tempfile
+
+import PIPE
+import SEQ
+from PIPE import decode, SrcA, SrcB, DstE, DstM, RTYPE, ILW, ISW, IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE, IJ, IJAL, FJR, FSYS
+from tracefile import TraceWriter, TraceReader
+from cache import Cache, makePrefetcher
+
+# 指令轨迹的字段：PC、指令、访存地址（不访存的指令沿用上一个地址）、是否跳转
+FIELDS = ["PC", "IR", "address", "taken"]
+
+# 分支预测的方式
+PREDICTORS = ["stall", "nottaken", "taken", "bimodal"]
+
+# 指令的种类
+KIND_OTHER = 0
+KIND_LOAD = 1
+KIND_STORE = 2
+KIND_BRANCH = 3
+KIND_JR = 4
+KIND_SYS = 5
+KIND_JUMP = 6
+
+
+# *****************************
+# 记录指令轨迹
+# 用SEQ执行一遍程序，每条指令记录一条(PC, IR, 访存地址, 是否跳转)
+# *****************************
+def record(path, program, data=None, PC=0, max_instructions=1000000, codec="zlib"):
+    sim = SEQ.Simulator(SEQ.IMemory(max(256, len(program))))
+    sim.load(program, data, PC)
+    dmem = sim.dmem
+    access = type(dmem).access
+    address = 0
+
+    # 在数据内存的实例上记录访存地址
+    def recordedAccess(read, write, addr, data):
+        nonlocal address
+        if read or write:
+            address = addr
+        return access(dmem, read, write, addr, data)
+
+    dmem.access = recordedAccess
+    with TraceWriter(path, FIELDS, codec) as writer:
+        while not sim.halted and sim.clock < max_instructions:
+            PC = sim.PC
+            sim.tick()
+            writer.append(PC, sim.imem.mem[PC >> 2], address, int(sim.PC != PC + 4))
+    return sim.clock
+
+
+def load(path):
+    return TraceReader(path)
+
+
+# *****************************
+# 时序模型的配置
+# branchStage: 条件分支和jr在哪个阶段确定下一个PC，"D"或"E"
+# forwarding: 打开的转发通路，对应FwdA/FwdB的数据来源：
+#   "e"是执行阶段的e_valE，"m"是访存阶段读出的m_valM，"M"是M.valE，"W"是W.valE/W.valM
+#   寄存器堆先写后读，所以关掉"W"不影响时序
+# loadLatency/storeLatency: lw/sw在访存阶段停留的周期数，有缓存时是命中的周期数
+# predictor: 条件分支的处理方式
+#   "stall"等到分支确定再取指，"nottaken"/"taken"静态预测，
+#   "bimodal"用predictorEntries个2位饱和计数器预测，预测错误时等到分支确定再取指
+#   jr总是等到确定再取指
+# cacheSize/cacheBlock/cacheWays: 数据缓存，cacheSize为0表示没有缓存
+# missLatency: 缓存缺失额外的周期数
+# prefetcher: 数据预取器，""/"nextline"/"stride"，预取的块missLatency个周期之后才能用
+# prefetchEntries/prefetchDegree/prefetchDistance: 步长表的项数、每次预取的块数、步长预取提前的步数
+# fetchStages/executeStages/memoryStages: 取指、执行、访存阶段拆成的子阶段数，译码和写回总是一个阶段
+#   指令在取指的最后一个子阶段才得到IR，j/jal的目标要等到这时；
+#   ALU的结果在执行的最后一个子阶段结束时才有，"e"通路从这里转发；
+#   "M"通路从访存的第一个子阶段转发ALU结果，"m"通路在访存的最后一个子阶段结束时转发读出的值
+# 默认配置就是PIPE.py的流水线
+# *****************************
+class TimingConfig:
+    def __init__(self, branchStage="D", forwarding="emMW", loadLatency=1, storeLatency=1,
+                 predictor="stall", predictorEntries=64,
+                 cacheSize=0, cacheBlock=16, cacheWays=1, missLatency=10,
+                 fetchStages=1, executeStages=1, memoryStages=1,
+                 prefetcher="", prefetchEntries=64, prefetchDegree=1, prefetchDistance=1):
+        if branchStage not in ["D", "E"]:
+            raise PIPE.MyError(f"timing_error: invalid branch stage({branchStage})")
+        if predictor not in PREDICTORS:
+            raise PIPE.MyError(f"timing_error: invalid predictor({predictor})")
+        for name, stages in [("fetch", fetchStages), ("execute", executeStages), ("memory", memoryStages)]:
+            if stages < 1:
+                raise PIPE.MyError(f"timing_error: invalid {name} stages({stages})")
+        self.branchStage = branchStage
+        for path in forwarding:
+            if path not in "emMW":
+                raise PIPE.MyError(f"timing_error: invalid forwarding path({path})")
+        self.forwarding = "".join(path for path in "emMW" if path in forwarding)
+        self.loadLatency = loadLatency
+        self.storeLatency = storeLatency
+        self.predictor = predictor
+        self.predictorEntries = predictorEntries
+        self.cacheSize = cacheSize
+        self.cacheBlock = cacheBlock
+        self.cacheWays = cacheWays
+        self.missLatency = missLatency
+        self.fetchStages = fetchStages
+        self.executeStages = executeStages
+        self.memoryStages = memoryStages
+        makePrefetcher(prefetcher, prefetchEntries, prefetchDegree, prefetchDistance)
+        self.prefetcher = prefetcher
+        self.prefetchEntries = prefetchEntries
+        self.prefetchDegree = prefetchDegree
+        self.prefetchDistance = prefetchDistance
+
+    def asdict(self):
+        return dict(self.__dict__)
+
+    # 和默认配置不同的参数
+    def describe(self):
+        defaults = TimingConfig().asdict()
+        return " ".join(f"{k}={v!r}" for k, v in self.asdict().items() if v != defaults[k]) or "default"
+
+    def __repr__(self):
+        return "TimingConfig(" + ", ".join(f"{k}={v!r}" for k, v in self.asdict().items()) + ")"
+
+
+# 按IR缓存的指令种类和用到的寄存器
+_classified = {}
+
+
+def classify(IR):
+    info = _classified.get(IR)
+    if info is None:
+        opcode, rs, rt, rd, _, funct, _, _ = decode(IR)
+        srcs = tuple(src for src in (SrcA(opcode, funct, rs), SrcB(opcode, funct, rt)) if src is not None)
+        if opcode == ILW:
+            kind = KIND_LOAD
+        elif opcode == ISW:
+            kind = KIND_STORE
+        elif opcode in [IBNE, IBEQ, IBGT, IBGE, IBLT, IBLE]:
+            kind = KIND_BRANCH
+        elif opcode == RTYPE and funct == FJR:
+            kind = KIND_JR
+        elif opcode == RTYPE and funct == FSYS:
+            kind = KIND_SYS
+        elif opcode in [IJ, IJAL]:
+            kind = KIND_JUMP
+        else:
+            kind = KIND_OTHER
+        info = _classified[IR] = (kind, srcs, DstE(opcode, funct, rt, rd), DstM(opcode, funct, rt, rd))
+    return info
+
+
+# *****************************
+# 轨迹驱动的时序模型
+# 对每条指令计算它进入每个（子）阶段的周期，满足：
+#   按顺序流动：进入下一阶段不早于进入本阶段加上在本阶段停留的周期数
+#   结构冲突：前一条指令离开某阶段之后才能进入该阶段
+#   数据冲突：在译码阶段的最后一个周期读到操作数（寄存器堆或者转发）
+#   控制冲突：条件分支（预测错误时）和jr确定下一个PC之后才能取下一条指令，j/jal在取指结束时确定
+# 阶段按F1..Fn, D, E1..En, M1..Mn, W排列，默认配置下的结果和PIPE.py逐周期模拟的时钟数一致
+# *****************************
+def replay(records, config=None):
+    if config is None:
+        config = TimingConfig()
+    # 各阶段在时间数组中的位置
+    D = config.fetchStages
+    E = D + 1
+    lastE = D + config.executeStages
+    M = lastE + 1
+    lastM = lastE + config.memoryStages
+    W = lastM + 1
+    forwardE = "e" in config.forwarding
+    forwardM = "M" in config.forwarding
+    forwardLoad = "m" in config.forwarding
+    resolve = E if config.branchStage == "D" else M
+    loadLatency, storeLatency = config.loadLatency, config.storeLatency
+    predictor = config.predictor
+    counters = [1] * config.predictorEntries
+    cache = None
+    if config.cacheSize:
+        prefetcher = makePrefetcher(config.prefetcher, config.prefetchEntries, config.prefetchDegree,
+                                    config.prefetchDistance)
+        cache = Cache(config.cacheSize, config.cacheBlock, config.cacheWays, prefetcher, config.missLatency)
+
+    # 每个寄存器的值最早可以在哪个周期被译码阶段读到
+    ready = [0] * 32
+    prev = [0] * (W + 1)
+    fetchReady = 1
+    count = 0
+    dataStalls = controlStalls = memoryStalls = 0
+    branches = mispredictions = 0
+    for PC, IR, address, taken in records:
+        kind, srcs, dstE, dstM = classify(IR)
+        t = [0] * (W + 1)
+        t[0] = max(prev[1], fetchReady)
+        controlStalls += t[0] - prev[1] if count else 0
+        for s in range(1, E):
+            t[s] = max(t[s - 1] + 1, prev[s + 1])
+        start = max(t[D] + 1, prev[E + 1])
+        t[E] = start
+        for src in srcs:
+            if ready[src] >= t[E]:
+                t[E] = ready[src] + 1
+        dataStalls += t[E] - start
+        for s in range(E + 1, W):
+            t[s] = max(t[s - 1] + 1, prev[s + 1])
+        if kind == KIND_LOAD or kind == KIND_STORE:
+            occupancy = loadLatency if kind == KIND_LOAD else storeLatency
+            # 只有lw训练步长预取器，和prefetch.CachedSimulator一致
+            if cache is not None:
+                occupancy += cache.request(address, kind == KIND_STORE, PC if kind == KIND_LOAD else None, t[M])[1]
+        else:
+            occupancy = 1
+        memoryStalls += occupancy - 1
+        t[W] = max(t[lastM] + occupancy, prev[W] + 1)
+
+        if dstE is not None:
+            ready[dstE] = t[lastE] if forwardE else t[M] if forwardM else t[W]
+        if dstM is not None:
+            ready[dstM] = t[lastM] + occupancy - 1 if forwardLoad else t[W]
+        if kind == KIND_BRANCH:
+            branches += 1
+            if predictor == "stall":
+                mispredicted = True
+            elif predictor == "nottaken":
+                mispredicted = taken
+            elif predictor == "taken":
+                mispredicted = not taken
+            else:
+                index = (PC >> 2) % len(counters)
+                mispredicted = (counters[index] >= 2) != taken
+                counters[index] = min(counters[index] + 1, 3) if taken else max(counters[index] - 1, 0)
+            if mispredicted:
+                mispredictions += 1
+                fetchReady = t[resolve]
+        elif kind == KIND_JR:
+            fetchReady = t[resolve]
+        elif kind == KIND_JUMP:
+            fetchReady = t[D]
+        prev = t
+        count += 1
+
+    stats = {
+        "core": "timing",
+        "cycles": prev[W] if count else 0,
+        "instructions": count,
+        "CPI": prev[W] / count if count else None,
+        "dataStalls": dataStalls,
+        "controlStalls": controlStalls,
+        "memoryStalls": memoryStalls,
+        "branches": branches,
+        "mispredictions": mispredictions,
+    }
+    if cache is not None:
+        stats["cache"] = cache.stats()
+    return stats
+
+
+# 记录一次轨迹，在多个配置下重放
+def evaluate(program, configs, data=None, max_instructions=1000000):
+    fd, path = tempfile.mkstemp(suffix=".trace")
+    os.close(fd)
+    try:
+        record(path, program, data, max_instructions=max_instructions)
+        trace = load(path)
+        return [replay(trace, config) for config in configs]
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    configs = [
+        TimingConfig(),
+        TimingConfig(branchStage="E"),
+        TimingConfig(forwarding="MW"),
+        TimingConfig(forwarding=""),
+        TimingConfig(loadLatency=3, storeLatency=2),
+        TimingConfig(predictor="bimodal"),
+        TimingConfig(cacheSize=1024, missLatency=10),
+        TimingConfig(cacheSize=1024, missLatency=10, prefetcher="stride", prefetchDistance=4),
+        TimingConfig(fetchStages=2),
+        TimingConfig(executeStages=2),
+        TimingConfig(memoryStages=2),
+        TimingConfig(fetchStages=2, executeStages=2, memoryStages=2),
+        TimingConfig(fetchStages=3, executeStages=3, memoryStages=3, branchStage="E"),
+    ]
+    names = sys.argv[1:] or ["program_loop", "program_unrolling4", "program_unrolling10"]
+    for name in names:
+        print(name)
+        for config, stats in zip(configs, evaluate(getattr(PIPE, name), configs)):
+            print(f"  {config.describe()}: cycles={stats['cycles']}\tCPI={stats['CPI']:.3f}")
@@ -0,0 +1,103 @@
+import array
+import itertools
+import json
+import lzma
+import struct
+import zlib
+
+MAGIC = b"CPUTRACE"
+
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+# 块头：压缩后的长度、记录数
+BLOCK_HEADER = struct.Struct("<II")
+
+
+# *****************************
+# 整数记录的流式压缩文件
+# 每条记录由固定个数的整数字段组成。记录先缓存在内存里，凑满一块后按字段分列，
+# 每列做差分后存成64位整数数组再整体压缩，所以写入时每条记录只有一次列表追加。
+# 每块从0开始差分，读的时候逐块解压，用生成器逐条返回记录。
+# *****************************
+class TraceWriter:
+    def __init__(self, path, fields, codec="zlib", blockSize=65536):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec: {codec}")
+        self.fields = list(fields)
+        self.codec = codec
+        self.compress = CODECS[codec][0]
+        self.blockSize = blockSize
+        self.records = []
+        self.count = 0
+        self.file = open(path, "wb")
+        header = json.dumps({"fields": self.fields, "codec": codec}).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, *values):
+        self.records.append(values)
+        if len(self.records) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        data = bytearray()
+        for column in zip(*self.records):
+            deltas = [column[0]] + [b - a for a, b in zip(column, column[1:])]
+            data += array.array("q", deltas).tobytes()
+        block = self.compress(bytes(data))
+        self.file.write(BLOCK_HEADER.pack(len(block), len(self.records)))
+        self.file.write(block)
+        self.count += len(self.records)
+        self.records = []
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+class TraceReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.readHeader(f)
+
+    def readHeader(self, f):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a trace file")
+        length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+        self.fields = header["fields"]
+        self.codec = header["codec"]
+        self.decompress = CODECS[self.codec][1]
+
+    # 逐条返回记录元组
+    def __iter__(self):
+        for block in self.blocks():
+            yield from zip(*block)
+
+    # 逐块返回各列的值
+    def blocks(self):
+        with open(self.path, "rb") as f:
+            self.readHeader(f)
+            while True:
+                header = f.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    return
+                length, count = BLOCK_HEADER.unpack(header)
+                data = self.decompress(f.read(length))
+                deltas = array.array("q")
+                deltas.frombytes(data)
+                yield [itertools.accumulate(deltas[i * count:(i + 1) * count])
+                       for i in range(len(self.fields))]
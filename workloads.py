@@ -0,0 +1,399 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import PIPE
+import SEQ
+from PIPE import MyError, wrap
+from assembler import assemble_source
+
+# 生成的程序使用的寄存器：$2只在最后放exit的服务号（--syscalls时正常退出），
+# $8/$9是指针和结束地址，$10是累加值，$11/$12是读出的数据，$13-$23是各程序的循环变量
+BRANCHES = ["bne", "beq", "bgt", "bge", "blt", "ble"]
+
+# 每种程序默认的规模和重复次数，默认配置下PIPE运行几万到几十万个周期
+DEFAULTS = {
+    "sum": (256, 64),
+    "scale": (256, 32),
+    "memcpy": (256, 64),
+    "bsort": (48, 4),
+    "matmul": (8, 8),
+    "list": (128, 64),
+}
+
+
+# *****************************
+# 带标签的汇编程序
+# 跳转指令的目标写成标签，render时换算成汇编器使用的字节偏移（分支相对下一条指令，j/jal是绝对地址）
+# *****************************
+class Assembly:
+    def __init__(self):
+        self.lines = []
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.lines)
+
+    def label(self, name):
+        if name in self.labels:
+            raise MyError(f"workload_error: duplicate label({name})")
+        self.labels[name] = len(self.lines)
+
+    def emit(self, text, comment=None, target=None):
+        self.lines.append((text, comment, target))
+
+    def render(self):
+        out = []
+        where = {index: name for name, index in self.labels.items()}
+        for index, (text, comment, target) in enumerate(self.lines):
+            if target is not None:
+                if target not in self.labels:
+                    raise MyError(f"workload_error: undefined label({target})")
+                op = text.split(" ", 1)[0]
+                if op in BRANCHES:
+                    text = f"{text}, {(self.labels[target] - index - 1) * 4}"
+                else:
+                    text = f"{text} {self.labels[target] * 4}"
+            if index in where:
+                out.append(f"    # {where[index]}:")
+            out.append(f"    {text:24}# {comment}" if comment else f"    {text}")
+        return "\n".join(out) + "\n"
+
+
+# *****************************
+# 生成的程序
+# source是汇编源程序，data是数据内存的初始值（从地址0开始），
+# expected是{字编号: 值}，程序正常结束后这些字应该是这些值
+# *****************************
+class Workload:
+    def __init__(self, kind, size, passes, seed, source, data, expected):
+        self.kind = kind
+        self.size = size
+        self.passes = passes
+        self.seed = seed
+        self.source = source
+        self.data = data
+        self.expected = expected
+        self.program = assemble_source(source)
+
+    @property
+    def name(self):
+        return f"{self.kind}-{self.size}x{self.passes}-s{self.seed}"
+
+    # 数据内存中用到的字数
+    @property
+    def dataWords(self):
+        return max(len(self.data), max(self.expected, default=-1) + 1)
+
+    # 返回和预期不同的[(字编号, 实际值, 预期值)]
+    def verify(self, dmem):
+        return [(index, dmem.mem[index], value) for index, value in sorted(self.expected.items())
+                if dmem.mem[index] != value]
+
+
+# 重复passes次的外层循环，body在循环里生成指令
+def repeat(asm, passes, body):
+    asm.emit(f"addi $20, $0, {passes}", "pass = passes")
+    asm.label("pass")
+    body()
+    asm.emit("addi $20, $20, -1", "pass = pass - 1")
+    asm.emit("bgt $20, $0", "if pass > 0 goto pass", "pass")
+
+
+def finish(asm):
+    asm.emit("addi $2, $0, 10", "exit")
+    asm.emit("syscall")
+
+
+# 数组求和：result = passes * sum(a)
+def sumArray(rng, size, passes):
+    a = [rng.randint(-1000, 1000) for _ in range(size)]
+    asm = Assembly()
+    asm.emit("addi $10, $0, 0", "s = 0")
+
+    def body():
+        asm.emit("addi $8, $0, 0", "p = a")
+        asm.emit(f"addi $9, $0, {size * 4}", "end = a + size")
+        asm.label("loop")
+        asm.emit("lw $11, 0($8)", "x = *p")
+        asm.emit("add $10, $10, $11", "s = s + x")
+        asm.emit("addi $8, $8, 4", "p = p + 1")
+        asm.emit("blt $8, $9", "if p < end goto loop", "loop")
+
+    repeat(asm, passes, body)
+    asm.emit(f"sw $10, {size * 4}($0)", "result = s")
+    finish(asm)
+    return asm, a, {size: wrap(sum(a) * passes)}
+
+
+# 数组缩放：b[i] = k * a[i]，乘法展开成k-1次加法
+def scaleArray(rng, size, passes):
+    a = [rng.randint(-1000, 1000) for _ in range(size)]
+    k = rng.randint(2, 7)
+    asm = Assembly()
+
+    def body():
+        asm.emit("addi $8, $0, 0", "p = a")
+        asm.emit(f"addi $9, $0, {size * 4}", "end = a + size")
+        asm.label("loop")
+        asm.emit("lw $11, 0($8)", "x = *p")
+        asm.emit("add $12, $11, $11", "y = 2x")
+        for i in range(3, k + 1):
+            asm.emit("add $12, $12, $11", f"y = {i}x")
+        asm.emit(f"sw $12, {size * 4}($8)", "b[i] = y")
+        asm.emit("addi $8, $8, 4", "p = p + 1")
+        asm.emit("blt $8, $9", "if p < end goto loop", "loop")
+
+    repeat(asm, passes, body)
+    finish(asm)
+    return asm, a, {size + i: wrap(k * x) for i, x in enumerate(a)}
+
+
+# 按字复制：dst = src
+def memcpy(rng, size, passes):
+    src = [rng.randint(-1 << 20, 1 << 20) for _ in range(size)]
+    asm = Assembly()
+
+    def body():
+        asm.emit("addi $8, $0, 0", "p = src")
+        asm.emit(f"addi $9, $0, {size * 4}", "end = src + size")
+        asm.label("loop")
+        asm.emit("lw $11, 0($8)", "x = *p")
+        asm.emit(f"sw $11, {size * 4}($8)", "dst[i] = x")
+        asm.emit("addi $8, $8, 4", "p = p + 1")
+        asm.emit("blt $8, $9", "if p < end goto loop", "loop")
+
+    repeat(asm, passes, body)
+    finish(asm)
+    return asm, src, {size + i: x for i, x in enumerate(src)}
+
+
+# 冒泡排序：每一遍先把原始数组复制到工作区，再对工作区排序
+def bubbleSort(rng, size, passes):
+    a = [rng.randint(-1000, 1000) for _ in range(size)]
+    work = size * 4
+    asm = Assembly()
+
+    def body():
+        asm.emit("addi $8, $0, 0", "p = a")
+        asm.emit(f"addi $9, $0, {work}", "end = a + size")
+        asm.label("copy")
+        asm.emit("lw $11, 0($8)")
+        asm.emit(f"sw $11, {work}($8)", "w[i] = a[i]")
+        asm.emit("addi $8, $8, 4")
+        asm.emit("blt $8, $9", "if p < end goto copy", "copy")
+        asm.emit(f"addi $13, $0, {(size - 1) * 4}", "limit = (size - 1) * 4")
+        asm.label("outer")
+        asm.emit("ble $13, $0", "if limit <= 0 goto sorted", "sorted")
+        asm.emit(f"addi $8, $0, {work}", "p = w")
+        asm.emit("add $9, $8, $13", "end = w + limit")
+        asm.label("inner")
+        asm.emit("lw $11, 0($8)", "x = p[0]")
+        asm.emit("lw $12, 4($8)", "y = p[1]")
+        asm.emit("ble $11, $12", "if x <= y goto next", "next")
+        asm.emit("sw $12, 0($8)", "p[0] = y")
+        asm.emit("sw $11, 4($8)", "p[1] = x")
+        asm.label("next")
+        asm.emit("addi $8, $8, 4", "p = p + 1")
+        asm.emit("blt $8, $9", "if p < end goto inner", "inner")
+        asm.emit("addi $13, $13, -4", "limit = limit - 4")
+        asm.emit("j", "goto outer", "outer")
+        asm.label("sorted")
+
+    repeat(asm, passes, body)
+    finish(asm)
+    return asm, a, {size + i: x for i, x in enumerate(sorted(a))}
+
+
+# 矩阵乘法：C = A * B（size x size），乘法用加法循环实现，B的元素是0到3
+def matrixMultiply(rng, size, passes):
+    n = size
+    A = [rng.randint(-9, 9) for _ in range(n * n)]
+    B = [rng.randint(0, 3) for _ in range(n * n)]
+    row = n * 4
+    asm = Assembly()
+    asm.emit(f"addi $9, $0, {row}", "rowBytes = n * 4")
+    asm.emit(f"addi $23, $0, {n * row}", "endA = n * n * 4")
+
+    def body():
+        asm.emit("addi $14, $0, 0", "rowA = &A[0][0]")
+        asm.emit(f"addi $21, $0, {2 * n * row}", "c = &C[0][0]")
+        asm.label("iloop")
+        asm.emit("addi $15, $0, 0", "col = 0")
+        asm.label("jloop")
+        asm.emit("addi $10, $0, 0", "s = 0")
+        asm.emit("addi $17, $14, 0", "pa = rowA")
+        asm.emit(f"addi $18, $15, {n * row}", "pb = &B[0][j]")
+        asm.emit("add $16, $17, $9", "endRow = rowA + rowBytes")
+        asm.label("kloop")
+        asm.emit("lw $11, 0($17)", "x = *pa")
+        asm.emit("lw $12, 0($18)", "y = *pb")
+        asm.emit("ble $12, $0", "if y <= 0 goto mdone", "mdone")
+        asm.label("mloop")
+        asm.emit("add $10, $10, $11", "s = s + x")
+        asm.emit("addi $12, $12, -1", "y = y - 1")
+        asm.emit("bgt $12, $0", "if y > 0 goto mloop", "mloop")
+        asm.label("mdone")
+        asm.emit("addi $17, $17, 4", "pa = pa + 1")
+        asm.emit("add $18, $18, $9", "pb = pb + n")
+        asm.emit("blt $17, $16", "if pa < endRow goto kloop", "kloop")
+        asm.emit("sw $10, 0($21)", "*c = s")
+        asm.emit("addi $21, $21, 4", "c = c + 1")
+        asm.emit("addi $15, $15, 4", "col = col + 4")
+        asm.emit("blt $15, $9", "if col < rowBytes goto jloop", "jloop")
+        asm.emit("add $14, $14, $9", "rowA = rowA + rowBytes")
+        asm.emit("blt $14, $23", "if rowA < endA goto iloop", "iloop")
+
+    repeat(asm, passes, body)
+    finish(asm)
+    C = [sum(A[i * n + k] * B[k * n + j] for k in range(n)) for i in range(n) for j in range(n)]
+    return asm, A + B, {2 * n * n + i: wrap(x) for i, x in enumerate(C)}
+
+
+# 链表遍历：size个节点(值, 下一个节点的地址)按随机顺序放在内存里，最后一个节点的下一个是-1
+def listChase(rng, size, passes):
+    order = list(range(size))
+    rng.shuffle(order)
+    data = [0] * (2 * size)
+    for position, node in enumerate(order):
+        data[2 * node] = rng.randint(-1000, 1000)
+        data[2 * node + 1] = order[position + 1] * 8 if position + 1 < size else -1
+    asm = Assembly()
+    asm.emit("addi $10, $0, 0", "s = 0")
+
+    def body():
+        asm.emit(f"addi $8, $0, {order[0] * 8}", "p = head")
+        asm.label("loop")
+        asm.emit("lw $11, 0($8)", "x = p->value")
+        asm.emit("lw $8, 4($8)", "p = p->next")
+        asm.emit("add $10, $10, $11", "s = s + x")
+        asm.emit("bge $8, $0", "if p >= 0 goto loop", "loop")
+
+    repeat(asm, passes, body)
+    asm.emit(f"sw $10, {size * 8}($0)", "result = s")
+    finish(asm)
+    return asm, data, {2 * size: wrap(sum(data[0::2]) * passes)}
+
+
+GENERATORS = {
+    "sum": sumArray,
+    "scale": scaleArray,
+    "memcpy": memcpy,
+    "bsort": bubbleSort,
+    "matmul": matrixMultiply,
+    "list": listChase,
+}
+
+
+# *****************************
+# 生成一个程序，相同的参数总是生成相同的程序和数据
+# size/passes为None时使用DEFAULTS；检查程序和数据能放进imemWords/dmemWords字的内存
+# *****************************
+def generate(kind, size=None, passes=None, seed=0, imemWords=256, dmemWords=1024):
+    if kind not in GENERATORS:
+        raise MyError(f"workload_error: unknown workload({kind})")
+    defaultSize, defaultPasses = DEFAULTS[kind]
+    size = defaultSize if size is None else size
+    passes = defaultPasses if passes is None else passes
+    if size < 1 or passes < 1:
+        raise MyError(f"workload_error: invalid size({size}) or passes({passes})")
+    # 每种程序用自己的随机数序列，增加种类不影响已有程序的数据
+    rng = random.Random(f"{kind}:{size}:{seed}")
+    asm, data, expected = GENERATORS[kind](rng, size, passes)
+    header = f"# {kind}: size={size} passes={passes} seed={seed}\n"
+    workload = Workload(kind, size, passes, seed, header + asm.render(), data, expected)
+    if len(workload.program) > imemWords:
+        raise MyError(f"workload_error: {workload.name} needs {len(workload.program)} instructions, "
+                      f"imem has {imemWords}")
+    if workload.dataWords > dmemWords:
+        raise MyError(f"workload_error: {workload.name} needs {workload.dataWords} words of data, "
+                      f"dmem has {dmemWords}")
+    # 数据地址都用addi/lw/sw的16位有符号立即数给出
+    if (workload.dataWords - 1) * 4 >= 1 << 15:
+        raise MyError(f"workload_error: {workload.name} needs {workload.dataWords} words of data, "
+                      f"16-bit immediates reach {1 << 13}")
+    return workload
+
+
+# 每种程序各一个，规模按scale放大重复次数
+def corpus(seed=0, scale=1):
+    return [generate(kind, passes=passes * scale, seed=seed) for kind, (_, passes) in DEFAULTS.items()]
+
+
+# 写出汇编源文件和数据文件（每行一个整数，main.py的--data可以直接读取），返回两个路径
+def save(workload, directory):
+    source = os.path.join(directory, workload.name + ".s")
+    data = os.path.join(directory, workload.name + ".dat")
+    with open(source, "w") as f:
+        f.write(workload.source)
+    with open(data, "w") as f:
+        f.write("".join(f"{x}\n" for x in workload.data))
+    return source, data
+
+
+# 运行并检查结果，返回(统计信息, 主机秒数, 和预期不同的字)
+# 数据内存有dmemWords字
+def run(workload, core="pipe", max_cycles=10 ** 8, dmemWords=1024, **options):
+    if core == "pipe":
+        sim = PIPE.Simulator(dmem=PIPE.DMemory(dmemWords), **options)
+    else:
+        sim = SEQ.Simulator(dmem=SEQ.DMemory(dmemWords), **options)
+    sim.load(workload.program, workload.data)
+    start = time.perf_counter()
+    stats = sim.run(max_cycles)
+    elapsed = time.perf_counter() - start
+    return stats, elapsed, workload.verify(sim.dmem)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成参数化的测试程序，可以直接运行并检查结果")
+    parser.add_argument("kinds", nargs="*", default=list(GENERATORS),
+                        help=f"程序种类：{', '.join(GENERATORS)}，默认全部")
+    parser.add_argument("--size", type=int, help="数组长度、矩阵边长或者链表节点数，默认见DEFAULTS")
+    parser.add_argument("--passes", type=int, help="重复执行的次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+    parser.add_argument("--output", metavar="DIR", help="把每个程序的.s和.dat写到目录里")
+    parser.add_argument("--run", action="store_true", help="运行每个程序，输出周期数、模拟速度并检查结果")
+    parser.add_argument("--core", choices=["pipe", "seq"], default="pipe", help="--run使用的处理器模型")
+    parser.add_argument("--max-cycles", type=int, default=10 ** 8, help="--run的最大时钟数")
+    parser.add_argument("--dmem-size", type=int, default=1024, help="数据内存的字数，较大的size需要更大的内存")
+    args = parser.parse_args(argv)
+
+    try:
+        workloads = [generate(kind, args.size, args.passes, args.seed, dmemWords=args.dmem_size)
+                     for kind in args.kinds]
+    except MyError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for workload in workloads:
+            source, data = save(workload, args.output)
+            print(f"{workload.name}: {len(workload.program)} instructions, {len(workload.data)} data words "
+                  f"-> {source}, {data}")
+    if args.run:
+        failed = 0
+        print(f"{'workload':28}{'cycles':>10}{'instr':>10}{'CPI':>8}{'seconds':>9}{'kHz':>8}  result")
+        for workload in workloads:
+            stats, elapsed, wrong = run(workload, args.core, args.max_cycles, args.dmem_size)
+            if not stats["halted"]:
+                result = "not halted"
+            elif wrong:
+                result = f"{len(wrong)} wrong words, first {wrong[0]}"
+            else:
+                result = "ok"
+            failed += result != "ok"
+            CPI = f"{stats['CPI']:.3f}" if stats["CPI"] else "-"
+            print(f"{workload.name:28}{stats['cycles']:>10}{stats['instructions']:>10}{CPI:>8}"
+                  f"{elapsed:>9.2f}{stats['cycles'] / elapsed / 1000 if elapsed else 0:>8.1f}  {result}")
+        return 1 if failed else 0
+    if not args.output:
+        for workload in workloads:
+            sys.stdout.write(workload.source)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())